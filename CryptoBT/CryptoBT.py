@@ -1,17 +1,29 @@
-import copy
-import uuid
+import os
 from abc import ABCMeta, abstractmethod
-from typing import Optional, Type, Callable
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+from typing import Optional, Type, Callable, Iterable, List, Tuple, Union
 
 import pandas as pd
 import numpy as np
-from itertools import chain
-
+from itertools import chain, product
+
+from . import _checkpoint
+from ._kernel import fill_bar, match_bar
+from ._ledger import _TradeLedger
+from ._margin import (CROSS, ISOLATED, MARGIN_MODES, as_funding, cross_liquidation_price, funding_payments,
+                      liquidation_prices, maintenance_tier)
+from .cache import get_indicator_cache
+from ._orders import _OrderBook
+from ._profile import _Profiler
 from ._preset import symbol_config_map
 from ._stats import get_backtesting_results
+from ._vectorized import run_signals
 from .dto import SymbolConfig
+from .fills import FillModel
+from .ticks import TickReplay
 from .idl import *
-from ._util import _as_str, _Indicator, _Data, try_
+from ._util import _as_str, _as_list, _Indicator, _Data, _df_from_shm, _df_to_shm, try_
 
 
 class Strategy(metaclass=ABCMeta):
@@ -19,9 +31,16 @@ class Strategy(metaclass=ABCMeta):
         self.trading_engine = trading_engine
         self.data = data
         self.params = params
-        self.position = None
+        self.position = _PositionView(trading_engine)
         self._indicators = []
 
+        for k, v in params.items():
+            if not hasattr(self, k):
+                raise AttributeError(f"Strategy '{self.__class__.__name__}' is missing parameter '{k}'. "
+                                     "Strategy class should define parameters as class variables before they "
+                                     "can be optimized or run with.")
+            setattr(self, k, v)
+
     @abstractmethod
     def init(self):
         pass
@@ -56,8 +75,17 @@ class Strategy(metaclass=ABCMeta):
 
     def I(self,  # noqa: E743
           func: Callable, *args,
-          name=None, plot=True, overlay=None, color=None, scatter=False,
+          name=None, plot=True, overlay=None, color=None, scatter=False, cache=True, warmup=None,
           **kwargs) -> np.ndarray:
+        """
+        Declare an indicator `func(*args, **kwargs)`, computed once up front
+        and revealed bar by bar in `Strategy.next()`. Unless `cache=False`,
+        results are reused from the indicator cache (see `CryptoBT.cache`).
+
+        `warmup` is how many bars before each value the indicator needs,
+        by default as many as it has leading NaNs. Streaming runs (see
+        `CryptoBT.stream`) keep that many bars between chunks.
+        """
         if name is None:
             params = ','.join(filter(None, map(_as_str, chain(args, kwargs.values()))))
             func_name = _as_str(func)
@@ -66,67 +94,161 @@ class Strategy(metaclass=ABCMeta):
             name = name.format(*map(_as_str, args),
                                **dict(zip(kwargs.keys(), map(_as_str, kwargs.values()))))
 
-        try:
-            value = func(*args, **kwargs)
-        except Exception as e:
-            raise RuntimeError(f'Indicator "{name}" error') from e
-
-        if isinstance(value, pd.DataFrame):
-            value = value.values.T
-
-        if value is not None:
-            value = try_(lambda: np.asarray(value, order='C'), None)
+        indicator_cache = get_indicator_cache() if cache else None
+        key = indicator_cache.key(func, args, kwargs) if indicator_cache is not None else None
+        value = indicator_cache.get(key) if key is not None else None
+        is_cached = value is not None
+        if not is_cached:
+            try:
+                value = _as_indicator_array(func(*args, **kwargs), len(self.data))
+            except Exception as e:
+                raise RuntimeError(f'Indicator "{name}" error') from e
         is_arraylike = bool(value is not None and value.shape)
 
-        # Optionally flip the array if the user returned e.g. `df.values`
-        if is_arraylike and np.argmax(value.shape) == 0:
-            value = value.T
-
-        if not is_arraylike or not 1 <= value.ndim <= 2 or value.shape[-1] != len(self.data.Close):
+        if not is_arraylike or not 1 <= value.ndim <= 2 or value.shape[-1] != len(self.data):
             raise ValueError(
                 'Indicators must return (optionally a tuple of) numpy.arrays of same '
                 f'length as `data` (data shape: {self.data.Close.shape}; indicator "{name}" '
                 f'shape: {getattr(value, "shape", "")}, returned value: {value})')
 
+        if key is not None and not is_cached:
+            value = indicator_cache.put(key, value)
+
         if plot and overlay is None and np.issubdtype(value.dtype, np.number):
-            x = value / self.data.Close
             # By default, overlay if strong majority of indicator values
             # is within 30% of Close
-            with np.errstate(invalid='ignore'):
-                overlay = ((x < 1.4) & (x > .6)).mean() > .6
+            with np.errstate(invalid='ignore', divide='ignore'):
+                overlay = try_(lambda: (((value / self.data.Close) < 1.4) &
+                                        ((value / self.data.Close) > .6)).mean() > .6, False)
 
         value = _Indicator(value, name=name, plot=plot, overlay=overlay,
-                           color=color, scatter=scatter,
+                           color=color, scatter=scatter, warmup=warmup,
                            # _Indicator.s Series accessor uses this:
                            index=self.data.index)
         self._indicators.append(value)
         return value
 
+    def I_batch(self, func: Callable, *args, params: Iterable, select=None,
+                name=None, plot=True, cache=True, **kwargs) -> np.ndarray:
+        """
+        Declare a batched indicator `func(*args, params, **kwargs)` over a
+        vector of parameter values at once, e.g. `lib.sma_batch` (or
+        `lib.batched(f)` of any `f(*args, n)`), as a 2-D block with a row
+        per value of `params`.
+
+        With `select`, the row of that value is declared and returned
+        instead. In an optimization, every run then picks its row from the
+        one cached block rather than computing the indicator again.
+        """
+        params = list(params)
+        if name is None:
+            name = ','.join(filter(None, chain(map(_as_str, chain(args, kwargs.values())),
+                                               [f'{params[0]}..{params[-1]}' if params else ''])))
+            name = f'{_as_str(func)}({name})'
+        block = self.I(func, *args, params, name=name, plot=plot and select is None,
+                       cache=cache, **kwargs)
+        if block.ndim != 2 or len(block) != len(params):
+            raise ValueError(f'Batched indicator "{name}" must return a row per parameter value '
+                             f'({len(params)}), not an array of shape {block.shape}')
+        block._opts['params'] = params
+        if select is None:
+            return block
+        if select not in params:
+            raise ValueError(f'{select!r} is not one of the parameter values of "{name}"')
+        return self.I(_param_row, block, params, select, name=f'{name}[{select}]', plot=plot, cache=False)
+
+
+def _param_row(block: np.ndarray, params: list, value) -> np.ndarray:
+    return block[params.index(value)]
+
+
+def _as_indicator_array(value, n_bars: Optional[int] = None) -> Optional[np.ndarray]:
+    """Indicator function output as a C-ordered (optionally 2d, bars last) array, or None."""
+    if isinstance(value, pd.DataFrame):
+        value = value.values.T
+
+    if value is not None:
+        value = try_(lambda: np.asarray(value, order='C'), None)
+
+    # Optionally flip the array if the user returned e.g. `df.values`, unless
+    # bars are already last (e.g. a block of more rows than there are bars yet)
+    if value is not None and value.shape and np.argmax(value.shape) == 0 and value.shape[-1] != n_bars:
+        value = value.T
+    return value
+
+
+class _Account:
+    """Wallet cash, shared by the engines of a portfolio."""
+    def __init__(self, cash: float):
+        self.cash = cash
+        self.equity = cash
+
 
 class _TradingEngine:
-    def __init__(self, data, balance, maker_fee, taker_fee, hedge_mode, exclusive_orders, symbol: str = "BTC-USDT"):
+    def __init__(self, data: _Data, balance, maker_fee, taker_fee, hedge_mode, exclusive_orders,
+                 symbol: str = "BTC-USDT",
+                 symbol_config: Optional[SymbolConfig] = None,
+                 account: Optional[_Account] = None,
+                 ohlc: Optional[np.ndarray] = None,
+                 leverage: float = 1.0,
+                 margin_mode: str = CROSS,
+                 funding: Optional[np.ndarray] = None,
+                 fill_model: Optional[FillModel] = None):
         self.symbol = symbol
         self.data = data
+        # Plain (bars x OHLC) block for scalar per-bar lookups in the fill loop
+        self._ohlc = data.df[['Open', 'High', 'Low', 'Close']].to_numpy(dtype=float) if ohlc is None else ohlc
         self.init_balance = balance
         self.maker_fee = maker_fee
         self.taker_fee = taker_fee
-        buy_position = Position(symbol=self.symbol)
-        sell_position = Position(symbol=self.symbol)
+        buy_position = Position(symbol=self.symbol, side=Side.Buy)
+        sell_position = Position(symbol=self.symbol, side=Side.Sell)
         self.position = {
             Side.Buy: buy_position, Side.Sell: sell_position
         }
-        self.pending_orders = []  # Store new order and created order
-        self.trades = []
+        self._buy_position, self._sell_position = buy_position, sell_position
+        self.order_book = _OrderBook()  # Store new order and created order
+        self.open_trades: List[Trade] = []
+        self.trades = _TradeLedger()  # Closed trades
 
+        # Free cash; position margin is held in `Position.size * Position.entry_price`
+        self.account = _Account(balance) if account is None else account
         self.equity = balance
-        self.equitys = [self.equity]
+        self.equitys = []
         self.hedge_mode = hedge_mode
         self.exclusive_orders = exclusive_orders
 
-        self.symbol_config: SymbolConfig = symbol_config_map[symbol]
+        self.symbol_config: SymbolConfig = (symbol_config_map[symbol] if symbol_config is None
+                                            else symbol_config)
+        if margin_mode not in MARGIN_MODES:
+            raise ValueError(f'Margin mode should be one of {MARGIN_MODES}, not {margin_mode!r}')
+        self.margin_mode = margin_mode
         self.leverage = 1.0
+        self.set_leverage(leverage)
+        # Funding rate paid on each bar, if any
+        self._funding = funding
+        self.funding_paid = 0.
+        self.liquidations: List[Order] = []
+        # How triggered orders fill; by default in full at the bar's price, with the fee of their order type
+        self.fill_model = fill_model
+        if fill_model is not None and fill_model.participation is not None and 'Volume' not in data.df:
+            raise ValueError('A fill model capping participation needs a `Volume` column')
+        # Liquidation triggers of the open positions, recomputed when cash or positions change
+        self._margin_key = None
+        self._liquidate_below = self._liquidate_above = np.nan
+        self._sides_below = self._sides_above = ()
 
         self._i = 0
+        # Bars dropped from the front of `data` (by a bounded live history), so recorded times stay absolute
+        self._bar_offset = 0
+
+    @property
+    def cash(self) -> float:
+        return self.account.cash
+
+    @cash.setter
+    def cash(self, value: float):
+        self.account.cash = value
 
     def new_order(self, *,
                   side: Side,
@@ -136,93 +258,479 @@ class _TradingEngine:
                   tp: Optional[float] = None,
                   sl: Optional[float] = None,
                   trail: Optional[float] = None,
-                  exec_type: Optional[ExecType] = ExecType.TakerFill
+                  exec_type: Optional[ExecType] = ExecType.TakerFill,
+                  reduce_only: bool = False
                   ):
         i = self._i = len(self.data) - 1
-        if price <= 0 or (size != None and size <= 0):
+        if (price is not None and price <= 0) or (size is not None and size <= 0):
             return None
         # Todo: Implement exclusive orders
-        if size is None:
-            size = self.equity / price
-        size = self._verify_order_size(size)
-        if price is None:
-            # Market order
-            price = self.data[i].open
-        if size * price > self.equity:
-            return None
-        self.equity -= size * price
-        order = Order(side=side, size=size, price=price, stop=stop, tp=tp, sl=sl, trail=trail, exec_type=exec_type)
-        self.pending_orders.append(order)
+        if size is not None:
+            size = self._verify_order_size(size)
+            if size <= 0:
+                return None
+        # Market orders (price is None) are filled at the open of the next bar
+        order = Order(side=side, size=size, price=price, stop=stop, tp=tp, sl=sl, trail=trail,
+                      create_time=i + self._bar_offset,
+                      exec_type=exec_type, reduce_only=reduce_only)
+        if self.fill_model is not None and self.fill_model.latency:
+            self.order_book.add(order, active_from=i + self._bar_offset + 1 + self.fill_model.latency)
+        else:
+            self.order_book.add(order)
         return order
 
-    def set_leverage(self, leverage):
-        # Todo: implement
-        pass
-
-    def handle_execution(self):
+    @property
+    def pending_orders(self) -> List['Order']:
+        return self.order_book.active_orders
+
+    def close_position(self, side: Optional[Side] = None):
+        sides = (side,) if side is not None else (Side.Buy, Side.Sell)
+        for side in sides:
+            position = self.position[side]
+            if position.size > 0:
+                self.new_order(side=side.opposite(), size=position.size, reduce_only=True)
+
+    def settle_positions(self, price: float):
+        i = len(self.data) - 1 + self._bar_offset
+        for side, position in self.position.items():
+            if position.size > 0:
+                order = Order(side=side.opposite(), size=position.size, price=price, reduce_only=True)
+                order.exec_time = i
+                size = position.size
+                self.cash += size * position.entry_price / self.leverage + position.close(price)
+                self._close_prev_trades(order, price, size)
+        for order in self.order_book.active_orders:
+            order.cancel()
+
+    def set_leverage(self, leverage: float):
+        """
+        Set the leverage of new and open positions. The margin of open
+        positions, `size * entry price / leverage`, is topped up from or
+        released to cash.
+        """
+        if not 1 <= leverage <= self.symbol_config.max_leverage:
+            raise ValueError(f'Leverage of {self.symbol} should be between 1 and '
+                             f'{self.symbol_config.max_leverage}, not {leverage}')
+        notional = sum(position.size * position.entry_price for position in self.position.values())
+        top_up = notional / leverage - notional / self.leverage
+        if top_up > self.cash:
+            raise ValueError(f'Not enough cash for the margin of open positions at {leverage}x leverage')
+        self.cash -= top_up
+        self.leverage = float(leverage)
+
+    def handle_execution(self, ticks: Optional[Tuple[np.ndarray, np.ndarray]] = None):
+        """
+        Fill orders against the current bar, or, given the bar's trades as
+        `(prices, quantities)`, trade by trade; then mark to market.
+        """
         i = self._i = len(self.data) - 1
-
-        current_data = self.data.iloc[i]
-
-        current_price = current_data.Close
-        for order in self.pending_orders:
-            if current_data.Low <= order.price <= current_data.High:
-                # Order price hit
-                if order.reduce_only:
-                    # Close Position
-                    pnl = self.position[order.side.opposite()].close(current_price, order.size)
-
-                    # Return equity
-                    self.equity += pnl
-
-                    # Record trade
-                    self._close_prev_trades(order)
-                else:
-                    # Open Position
-                    if self.position[order.side].size == 0:
-                        self.position[order.side].open_with_order(order)
-                    self.trades.append(Trade(symbol=self.symbol, size=order.size, entry_price=order.price,
-                                             side=order.side, time=i))
-
-                # The order of tpsl will only be placed after the parent order is filled
-                if order.tp and ((order.side == Side.Buy and order.tp >= current_data.Low) or (
-                        order.side == Side.Sell and order.tp <= current_data.High)):
-                    tp_order = self.new_order(side=order.side.opposite(), size=order.size, price=order.tp)
-                    tp_order.parent_order_id = order.order_id
-                    tp_order.reduce_only = True
-                    self.pending_orders.append(tp_order)
-                if order.sl and ((order.side == Side.Buy and order.sl <= current_data.Hig) or (
-                        order.side == Side.Sell and order.sl >= current_data.Low)):
-                    sl_order = self.new_order(side=order.side.opposite(), size=order.size, price=order.sl)
-                    sl_order.parent_order_id = order.order_id
-                    sl_order.reduce_only = True
-                    self.pending_orders.append(sl_order)
-
-                self.pending_orders.remove(order)
+        buy_position, sell_position = self._buy_position, self._sell_position
+        order_book = self.order_book
+        if not (order_book or buy_position.size or sell_position.size):
+            # Nothing to match or mark to market
+            self.equitys.append(self.equity)
+            return
+
+        current_open, current_high, current_low, current_price = self._ohlc[i].tolist()
+        if self._funding is not None and (buy_position.size or sell_position.size):
+            self._pay_funding(self._funding[i], current_open)
+        if order_book:
+            if ticks is None:
+                self._match_orders(i + self._bar_offset, current_open, current_high, current_low)
             else:
-                # Post only
-                order.OrderStatus = OrderStatus.Created
-
-        self.pending_orders = []
+                self._match_ticks(i + self._bar_offset, *ticks)
+        if buy_position.size or sell_position.size:
+            self._check_liquidation(i + self._bar_offset, current_open, current_high, current_low)
+
+        # Cash plus margin and unrealized pnl of both positions, written so that at 1x
+        # leverage positions are worth exactly `size * price` long and `size * (2 * entry - price)` short
+        margin_rate = 1 / self.leverage
+        self.equity = (self.cash + buy_position.size * current_price -
+                       buy_position.size * buy_position.entry_price * (1 - margin_rate) +
+                       sell_position.size * (sell_position.entry_price * (1 + margin_rate) - current_price))
         self.equitys.append(self.equity)
 
+    def _pay_funding(self, rate: float, price: float):
+        if not rate:
+            return
+        payments = funding_payments((1, -1), (self._buy_position.size, self._sell_position.size), price, rate)
+        self.cash += float(payments.sum())
+        self._book_funding(payments)
+
+    def _book_funding(self, payments: np.ndarray):
+        """Book funding `payments` received by the long and short positions to their open trades."""
+        self.funding_paid -= float(payments.sum())
+        long_payment, short_payment = payments.tolist()
+        long_size, short_size = self._buy_position.size, self._sell_position.size
+        for trade in self.open_trades:
+            payment, size = (long_payment, long_size) if trade.side == Side.Buy else (short_payment, short_size)
+            if size:  # Float dust of partly closed trades may outlive their position
+                trade.funding -= payment * trade.size / size
+
+    def _check_liquidation(self, i: int, current_open: float, current_high: float, current_low: float):
+        buy_position, sell_position = self._buy_position, self._sell_position
+        key = (self.cash, buy_position.size, buy_position.entry_price, sell_position.size,
+               sell_position.entry_price, self.leverage)
+        if key != self._margin_key:
+            self._margin_key = key
+            self._update_liquidation_prices()
+        # NaN triggers compare False
+        start = len(self.trades)
+        if current_low <= self._liquidate_below:
+            self._liquidate(self._sides_below, min(current_open, self._liquidate_below), i)
+        elif current_high >= self._liquidate_above:
+            self._liquidate(self._sides_above, max(current_open, self._liquidate_above), i)
+        else:
+            return
+        if self.cash < 0:
+            # The loss beyond cash isn't borne, so it's taken off the liquidated trades' fees
+            self.trades.rebate(start, -self.cash / self.trades.notional(start))
+            self.cash = 0.
+
+    def _update_liquidation_prices(self):
+        buy_position, sell_position = self._buy_position, self._sell_position
+        sign = np.array([1., -1.])
+        size = np.array([buy_position.size, sell_position.size])
+        entry = np.array([buy_position.entry_price, sell_position.entry_price])
+        tiers = self.symbol_config.maintenance_tiers
+        if self.margin_mode == ISOLATED:
+            self._liquidate_below, self._liquidate_above = \
+                liquidation_prices(sign, size, entry, size * entry / self.leverage, tiers).tolist()
+            self._sides_below, self._sides_above = (Side.Buy,), (Side.Sell,)
+        else:
+            collateral = self.cash + float(np.sum(size * entry)) / self.leverage
+            price, slope = cross_liquidation_price(sign, size, entry, collateral, tiers)
+            self._liquidate_below = price if slope > 0 else np.nan
+            self._liquidate_above = price if slope < 0 else np.nan
+            self._sides_below = self._sides_above = (Side.Buy, Side.Sell)
+
+    def _liquidate(self, sides: Tuple[Side, ...], price: float, i: int):
+        """
+        Close the positions of `sides` at `price`. What's left of their
+        margin above maintenance is returned; the maintenance margin goes
+        to the exchange (and with cross margin, any loss beyond it is
+        taken from cash, which callers then floor at zero).
+        """
+        tiers = self.symbol_config.maintenance_tiers
+        for side in sides:
+            position = self.position[side]
+            if position.size <= 0:
+                continue
+            size = position.size
+            margin = size * position.entry_price / self.leverage
+            rate, amount = maintenance_tier(size * position.entry_price, tiers)
+            maintenance = float(rate) * size * price - float(amount)
+            pnl = position.close(price)
+            balance = margin + pnl - maintenance
+            returned = max(balance, 0.) if self.margin_mode == ISOLATED else balance
+            self.cash += returned
+
+            order = Order(side=side.opposite(), size=size, price=price, create_time=i, reduce_only=True)
+            order.exec_time = i
+            order.exec_price = price
+            order.OrderStatus = OrderStatus.TakerFill
+            # What the position loses beyond its pnl is a fee to the exchange
+            self._close_prev_trades(order, price, size, margin + pnl - returned)
+            self.liquidations.append(order)
+            self.order_book.cancel_reduce_only(side.opposite())
+
+    def _match_orders(self, i: int, current_open: float, current_high: float, current_low: float):
+        order_book = self.order_book
+        fill_model = self.fill_model
+        if fill_model is not None:
+            self._match_with_model(fill_model, i, current_open, current_high, current_low)
+            return
+        rows, fill_prices = order_book.match(current_open, current_high, current_low)
+        orders = order_book.orders
+        for row, fill_price in zip(rows.tolist(), fill_prices.tolist()):
+            # An earlier fill this bar may have canceled the order (e.g. the other leg of tp/sl)
+            if order_book.is_active(row):
+                self._fill(orders[row], fill_price, i)
+        order_book.post()
+
+    def _match_with_model(self, fill_model: FillModel, i: int, current_open: float, current_high: float,
+                          current_low: float):
+        order_book = self.order_book
+        rows, fill_prices = order_book.match(current_open, current_high, current_low, i)
+        if len(rows):
+            volume = float(self.data.Volume[-1]) if fill_model.participation is not None else np.inf
+            fill_prices, is_maker, expired, budget = fill_model.fill(
+                order_book._book[rows], fill_prices, current_high, current_low, volume)
+            orders = order_book.orders
+            for row, fill_price, maker, expire in zip(rows.tolist(), fill_prices.tolist(), is_maker.tolist(),
+                                                      expired.tolist()):
+                if not order_book.is_active(row):
+                    continue
+                if expire:
+                    order_book.set_status(orders[row], OrderStatus.Expired)
+                elif budget > 0:
+                    budget -= self._fill(orders[row], fill_price, i, maker, budget)
+        order_book.post()
+
+    def _match_ticks(self, i: int, prices: np.ndarray, quantities: np.ndarray):
+        order_book = self.order_book
+        start = 0
+        while start < len(prices):
+            n_orders = len(order_book.orders)
+            rows, trade_idx, fill_prices = order_book.match_ticks(prices[start:], quantities[start:], i)
+            orders = order_book.orders
+            restart = None
+            for row, k, fill_price in zip(rows.tolist(), trade_idx.tolist(), fill_prices.tolist()):
+                if restart is not None and start + k >= restart:
+                    break
+                if order_book.is_active(row):
+                    self._fill(orders[row], fill_price, i)
+                    if len(order_book.orders) != n_orders and restart is None:
+                        # New tp/sl orders rest from the next trade on, so match again from there
+                        restart = start + k + 1
+            if restart is None:
+                break
+            start = restart
+        order_book.post()
+
+    def _fill(self, order: 'Order', fill_price: float, i: int, is_maker: Optional[bool] = None,
+              max_size: float = np.inf) -> float:
+        """
+        Fill `order` at `fill_price`, as a maker fill if `is_maker` (by
+        default, if it's a limit order without a stop), and return the
+        size filled. Beyond `max_size`, the rest of the order stays in
+        the book.
+        """
+        order_book = self.order_book
+        if is_maker is None:
+            is_maker = order.price is not None and order.stop is None
+        status = OrderStatus.MakerFill if is_maker else OrderStatus.TakerFill
+        fee_rate = self.maker_fee if is_maker else self.taker_fee
+        partial = False
+        if order.reduce_only:
+            # Close Position
+            position = self.position[order.side.opposite()]
+            size = min(order.size, position.size)
+            if size <= 0:
+                order_book.set_status(order, OrderStatus.Rejected)
+                return 0.
+            if size > max_size:
+                size = self._verify_order_size(max_size)
+                if size <= 0:
+                    return 0.
+                partial = True
+                self._fill_part(order, size, fill_price, i)
+            margin = size * position.entry_price / self.leverage
+            pnl = position.close(fill_price, size)
+
+            # Return margin and realized pnl
+            fee = size * fill_price * fee_rate
+            self.cash += margin + pnl
+            self.cash -= fee
+
+            # Record trade
+            order.exec_time = i
+            self._close_prev_trades(order, fill_price, size, fee)
+            if partial:
+                return size
+            # Finalized before its siblings are canceled, so its row keeps the fill's status
+            order.exec_price = fill_price
+            order_book.set_status(order, status)
+            if order.parent_order_id is not None:
+                order_book.cancel_children(order.parent_order_id)
+            if position.size <= 0:
+                order_book.cancel_reduce_only(order.side)
+            return size
+        else:
+            # Open Position
+            size = order.size
+            # Margin plus fee per unit of size is `fill_price * (1 / leverage + fee_rate)`
+            if size is None:
+                size = self._verify_order_size(self.cash / (fill_price * (1 / self.leverage + fee_rate)))
+            if size <= 0 or size * fill_price * (1 / self.leverage + fee_rate) > self.cash:
+                order_book.set_status(order, OrderStatus.Rejected)
+                return 0.
+            order_book.set_size(order, size)
+            filled_before = order.exec_time is not None
+            if size > max_size:
+                size = self._verify_order_size(max_size)
+                if size <= 0:
+                    return 0.
+                partial = True
+                self._fill_part(order, size, fill_price, i)
+            order.exec_time = i
+            fee = size * fill_price * fee_rate
+            self.cash -= size * fill_price / self.leverage
+            self.cash -= fee
+            self.position[order.side].open_with_order(Order(side=order.side, size=size) if partial else order,
+                                                      fill_price)
+            self.open_trades.append(Trade(symbol=self.symbol, size=size, entry_price=fill_price,
+                                          side=order.side, entry_order_id=order.order_id, time=i, fees=fee))
+
+            # The order of tpsl will only be placed after the parent order is filled
+            children = order_book.children(order.order_id) if filled_before else ()
+            if children:
+                # Earlier parts of the order already placed them, for the size filled so far
+                for child in children:
+                    order_book.set_size(child, child.size + size)
+            else:
+                if order.tp:
+                    self._add_child_order(order, price=order.tp, size=size)
+                if order.sl:
+                    self._add_child_order(order, stop=order.sl, size=size)
+            if partial:
+                return size
+
+        order.exec_price = fill_price
+        order_book.set_status(order, status)
+        return size
+
+    def _fill_part(self, order: 'Order', size: float, fill_price: float, i: int):
+        """Leave `order` in the book with what's left of it after filling `size`."""
+        order.exec_time = i
+        order.exec_price = fill_price
+        self.order_book.set_size(order, self._verify_order_size(order.size - size))
+        if order.reduce_only and order.parent_order_id is not None:
+            # The other leg of a tp/sl pair now has less to close too
+            for sibling in self.order_book.children(order.parent_order_id):
+                if sibling is not order:
+                    self.order_book.set_size(sibling, max(sibling.size - size, 0.))
+
+    def _add_child_order(self, parent: 'Order', price: Optional[float] = None, stop: Optional[float] = None,
+                         size: Optional[float] = None):
+        child = Order(side=parent.side.opposite(), size=parent.size if size is None else size, price=price,
+                      stop=stop, create_time=parent.exec_time, parent_order_id=parent.order_id, reduce_only=True)
+        self.order_book.add(child)
+
     def _verify_order_size(self, origin_size: float) -> float:
-        result = int(origin_size / self.symbol_config.tick_size) * self.symbol_config.tick_size
-        if result > self.symbol_config.max_order_size:
-            result = self.symbol_config.max_order_size
-        return result
+        return float(self.symbol_config.round_size(origin_size))
+
+    def _close_prev_trades(self, close_order, price, size, fee: float = 0.):
+        # Latest trades are closed first, each with its share of the exit `fee`
+        # and of the fees and funding it has paid so far
+        remain_size = size
+        side = close_order.side.opposite()
+        for trade in reversed(self.open_trades):
+            if remain_size <= 0:
+                break
+            if trade.side == side:
+                trade_size = trade.size
+                closed = trade.close(close_order, price, remain_size)
+                share = closed / trade_size
+                fees, funding = trade.fees * share, trade.funding * share
+                if trade.trade_status == TradeStatus.Open:
+                    trade.fees -= fees
+                    trade.funding -= funding
+                self.trades.append(trade, closed, close_order.exec_time, price, close_order.order_id,
+                                   fees + fee * closed / size, funding)
+                remain_size -= closed
+        self.open_trades = [trade for trade in self.open_trades if trade.trade_status == TradeStatus.Open]
+
+
+class _KernelEngine(_TradingEngine):
+    """
+    `_TradingEngine` that fills orders on bars with the `_kernel` loops
+    over the order book's columns and a flat account state instead of
+    `Order` and `Position` methods. Trades are still recorded per fill in
+    Python, and tick replays and fill models use the reference matching.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._state = np.zeros(5)
+
+    def _match_orders(self, i: int, current_open: float, current_high: float, current_low: float):
+        if self.fill_model is not None:
+            return super()._match_orders(i, current_open, current_high, current_low)
+        order_book = self.order_book
+        n = len(order_book.orders)
+        # Up to a tp and a sl child per filled order
+        book = order_book.reserve(2 * n)
+        columns = [book[name] for name in ('id', 'parent', 'side', 'price', 'size', 'stop', 'tp', 'sl',
+                                           'reduce_only', 'status')]
+        status = columns[-1]
+        if match_bar is None:
+            rows, fill_prices = order_book.match(current_open, current_high, current_low)
+        else:
+            rows, fill_prices = match_bar(book['side'], book['price'], book['stop'], status, n,
+                                          current_open, current_high, current_low)
+        if not len(rows):
+            order_book.post()
+            return
+
+        buy_position, sell_position = self._buy_position, self._sell_position
+        state = self._state
+        state[:] = (self.cash, buy_position.size, buy_position.entry_price,
+                    sell_position.size, sell_position.entry_price)
+        status_before = status[:n].copy()
+        config = self.symbol_config
+        rows, fill_prices, sizes, statuses, n_children = fill_bar(
+            *columns, n, order_book._next_id, rows, fill_prices, state, self.maker_fee, self.taker_fee,
+            self.leverage, config.tick_size, config.max_order_size)
+        self.cash, buy_position.size, buy_position.entry_price, sell_position.size, sell_position.entry_price = \
+            state.tolist()
+
+        children = [Order(side=Side(side), size=size, price=None if price != price else price,
+                          stop=None if stop != stop else stop, create_time=i, parent_order_id=parent,
+                          reduce_only=True)
+                    for side, size, price, stop, parent in zip(*(book[name][n:n + n_children].tolist()
+                                                                for name in ('side', 'size', 'price', 'stop',
+                                                                             'parent')))]
+        order_book.sync(n, status_before, children)
+
+        orders = order_book.orders
+        rejected, maker = OrderStatus.Rejected.value, OrderStatus.MakerFill.value
+        for row, fill_price, size, status in zip(rows.tolist(), fill_prices.tolist(), sizes.tolist(),
+                                                 statuses.tolist()):
+            if status == rejected:
+                continue
+            order = orders[row]
+            order.exec_time = i
+            order.exec_price = fill_price
+            order.OrderStatus = OrderStatus(status)
+            fee = size * fill_price * (self.maker_fee if status == maker else self.taker_fee)
+            if order.reduce_only:
+                self._close_prev_trades(order, fill_price, size, fee)
+            else:
+                order.size = size
+                self.open_trades.append(Trade(symbol=self.symbol, size=size, entry_price=fill_price,
+                                              side=order.side, entry_order_id=order.order_id, time=i, fees=fee))
+        order_book.post()
+
 
-    def _close_prev_trades(self, close_order):
-        for trade in reversed(self.trades):
-            if trade.trade_status == TradeStatus.Open and trade.side == close_order.side.opposite():
-                trade.trade_status = TradeStatus.Closed
+class _PositionView:
+    """
+    Net position of the strategy as seen from `Strategy.next()`.
+    Long size is positive, short size is negative.
+    """
+    def __init__(self, trading_engine: _TradingEngine):
+        self.__engine = trading_engine
 
-                remain_trade = trade.close(close_order)
-                if remain_trade is not None:
-                    self.trades.append(remain_trade)
+    @property
+    def size(self) -> float:
+        position = self.__engine.position
+        return position[Side.Buy].size - position[Side.Sell].size
+
+    @property
+    def pnl(self) -> float:
+        price = self.__engine.data.Close[-1]
+        return sum(position.get_pnl(price) for position in self.__engine.position.values())
+
+    @property
+    def is_long(self) -> bool:
+        return self.size > 0
+
+    @property
+    def is_short(self) -> bool:
+        return self.size < 0
+
+    def __bool__(self):
+        return self.size != 0
+
+    def close(self):
+        self.__engine.close_position()
+
+    def __repr__(self):
+        return f'<Position: {self.size}>'
 
 
 class Position:
+    __slots__ = ('symbol', 'size', 'entry_price', 'side', 'time')
+
     def __init__(self, symbol: str = "BTC-USDT", size: float = 0, entry_price: float = 0,
                  side: Side = Side.Buy,
                  time: int = 0):
@@ -232,12 +740,14 @@ class Position:
         self.side = side
         self.time = time
 
-    def open_with_order(self, order):
+    def open_with_order(self, order, price: Optional[float] = None):
         assert order.side == self.side
+        if price is None:
+            price = order.price
         if self.size == 0:
-            self.entry_price = order.price
+            self.entry_price = price
         else:
-            self.entry_price = order.price * order.size / (self.size + order.size) + self.entry_price * self.size / (
+            self.entry_price = price * order.size / (self.size + order.size) + self.entry_price * self.size / (
                     self.size + order.size)
         self.size += order.size
 
@@ -252,7 +762,7 @@ class Position:
     def close(self, price: float, size: float = None):
         if size is None or size > self.size:
             size = self.size
-        result = self.get_pnl(price)
+        result = self.get_pnl(price, size)
 
         self.size -= size
 
@@ -260,6 +770,9 @@ class Position:
 
 
 class Order:
+    __slots__ = ('side', 'size', 'price', 'stop', 'tp', 'sl', 'trail', 'create_time', 'exec_type', 'exec_time',
+                 'exec_price', 'OrderStatus', 'order_id', 'parent_order_id', 'reduce_only', '_book')
+
     def __init__(self, side: Side,
                  size: Optional[float] = None,
                  price: Optional[float] = None,
@@ -269,7 +782,7 @@ class Order:
                  trail: Optional[float] = None,
                  create_time: Optional[int] = None,
                  exec_type: Optional[ExecType] = ExecType.TakerFill,
-                 parent_order_id: Optional[uuid.UUID] = None,
+                 parent_order_id: Optional[int] = None,
                  reduce_only: Optional[bool] = False
                  ):
         self.side = side
@@ -282,23 +795,31 @@ class Order:
         self.create_time = create_time
         self.exec_type = exec_type
         self.exec_time = None
+        self.exec_price = None
 
         self.OrderStatus = OrderStatus.New
-        self.order_id = uuid.uuid4()
+        # Assigned, increasing, by the order book once the order is placed
+        self.order_id: Optional[int] = None
         self.parent_order_id = parent_order_id
         self.reduce_only = reduce_only
+        self._book = None
 
     def cancel(self):
-        # Todo: implement
-        self.OrderStatus = OrderStatus.Canceled
+        if self._book is not None:
+            self._book.cancel(self)
+        else:
+            self.OrderStatus = OrderStatus.Canceled
 
 
 class Trade:
+    __slots__ = ('symbol', 'size', 'entry_price', 'entry_size', 'exit_price', 'side', 'entry_order_id',
+                 'entry_time', 'exit_time', 'exit_order_id', 'trade_status', 'fees', 'funding')
 
     def __init__(self, symbol: str = "BTC-USDT", size: float = 0, entry_price: float = 0,
                  side: Side = Side.Buy,
-                 entry_order_id: Optional[uuid.UUID] = None,
-                 time: int = 0):
+                 entry_order_id: Optional[int] = None,
+                 time: int = 0,
+                 fees: float = 0.):
         self.symbol = symbol
         self.size = size
         self.entry_price = entry_price
@@ -308,31 +829,28 @@ class Trade:
         self.entry_order_id = entry_order_id
         self.entry_time = time
         self.exit_time = None
-        self.exit_size = None
         self.exit_order_id = None
         self.trade_status = TradeStatus.Open
-
-    def __copy__(self):
-        copy_obj = Trade(symbol=self.symbol, size=self.size, entry_price=self.entry_price, side=self.side,
-                         entry_order_id=self.entry_order_id, time=self.entry_time)
-        return copy_obj
-
-    def close(self, order: Order):
-        remain_trade = None
-        remain_size = order.size - self.size
-        self.exit_size = order.size
-        self.exit_price = order.price
-        self.exit_time = order.exec_time
-        self.exit_order_id = order.order_id
-
-        if remain_size < 0:
-            remain_trade = copy.deepcopy(self)
-            remain_trade.size = -remain_size
-            order.size = 0
-
-        self.trade_status = TradeStatus.Closed
-
-        return remain_trade
+        # Fees and funding paid so far by the part still open
+        self.fees = fees
+        self.funding = 0.
+
+    def close(self, order: Order, price: Optional[float] = None, size: Optional[float] = None) -> float:
+        """
+        Close up to `size` of the trade with `order` and return the size
+        closed. A partial close leaves the rest of the trade open.
+        """
+        if size is None:
+            size = order.size
+        closed = min(size, self.size)
+        self.size -= closed
+        if self.size <= 0:
+            self.size = closed
+            self.exit_price = order.price if price is None else price
+            self.exit_time = order.exec_time
+            self.exit_order_id = order.order_id
+            self.trade_status = TradeStatus.Closed
+        return closed
 
 
 class Backtest:
@@ -342,7 +860,30 @@ class Backtest:
                  maker_fee: Optional[float] = 0,
                  taker_fee: Optional[float] = 0,
                  hedge_mode: Optional[bool] = False,
-                 exclusive_orders: Optional[bool] = False):
+                 exclusive_orders: Optional[bool] = False,
+                 kernel: bool = False,
+                 leverage: float = 1,
+                 margin_mode: str = CROSS,
+                 funding_rates: Optional[Union[float, pd.Series]] = None,
+                 fill_model: Optional[FillModel] = None):
+        """
+        With `kernel=True`, orders are filled by the array kernels of
+        `CryptoBT._kernel`, compiled if numba is installed, instead of the
+        reference `_TradingEngine` methods; results are the same.
+
+        Positions hold `size * entry price / leverage` of margin, and are
+        liquidated when the bar's High/Low takes their margin plus pnl
+        (`margin_mode='isolated'`), or the cash and the margin and pnl of
+        all positions (`'cross'`), down to the maintenance margin of the
+        symbol's tiers. `funding_rates`, a constant or a series indexed by
+        funding time, are paid every 8 hours at the bar's open.
+
+        A `fill_model` (see `CryptoBT.fills`) adds slippage, volume
+        participation caps, order latency and maker/taker fees by how
+        orders meet the market to the fills.
+        """
+        if margin_mode not in MARGIN_MODES:
+            raise ValueError(f'Margin mode should be one of {MARGIN_MODES}, not {margin_mode!r}')
         self._results = None
 
         self.balance = balance
@@ -350,29 +891,444 @@ class Backtest:
         self.taker_fee = taker_fee
         self.hedge_mode = hedge_mode
         self.exclusive_orders = exclusive_orders
+        self.kernel = kernel
+        self.leverage = leverage
+        self.margin_mode = margin_mode
+        self.funding_rates = funding_rates
+        self.fill_model = fill_model
 
         self._strategy: Type[Strategy] = strategy
-        self.data: pd.DataFrame = data
+        # A shallow copy, so the caller's frame keeps its column names
+        self.data: pd.DataFrame = data.copy(deep=False)
         self.data.columns = map(lambda x: x.lower().capitalize(), self.data.columns)
 
-    def run(self, **kwargs) -> pd.Series:
-
-        trading_engine = _TradingEngine(self.data, self.balance, self.maker_fee, self.taker_fee, self.hedge_mode,
-                                        self.exclusive_orders)
-        strategy = self._strategy(trading_engine, self.data, kwargs)
+    def run(self, *, ticks: Optional[Union[str, Iterable]] = None, profile: bool = False,
+            checkpoint_every: Optional[int] = None, checkpoint_path: Optional[str] = None,
+            **kwargs) -> pd.Series:
+        """
+        Run the strategy over the data, with `kwargs` overriding its
+        parameters. With `ticks`, an aggTrades file (see `CryptoBT.ticks`)
+        or an iterable of `(timestamps, prices, quantities)` chunks, orders
+        are filled trade by trade within each bar the trades cover, while
+        `Strategy.next()` is still called once per bar.
+
+        With `profile=True`, the results also hold a `_profile` with the
+        time spent in each phase, per-bar latencies, order and fill counts
+        and memory snapshots.
+
+        With `checkpoint_every=N`, the state of the run is saved to
+        `checkpoint_path` every `N` bars, and an interrupted run can be
+        continued from there with `resume()`.
+        """
+        if checkpoint_every is not None and not checkpoint_path:
+            raise ValueError('`checkpoint_every` needs a `checkpoint_path` to save to')
+        profiler = _Profiler(len(self.data)) if profile else None
+        data, trading_engine, strategy = self._prepare(kwargs)
+        replay = TickReplay(ticks, self.data.index) if ticks is not None else None
+        if profiler:
+            profiler.instrument(strategy, trading_engine)
+            profiler.mark('setup')
 
         strategy.init()
+        data._update()  # Strategy.init might have changed/added to data.df
+        if profiler:
+            profiler.mark('init')
+
+        checkpoint = None
+        if checkpoint_every is not None:
+            checkpoint = dict(path=checkpoint_path, every=checkpoint_every,
+                              meta=self._checkpoint_meta(strategy.params))
+        return self._run_bars(data, trading_engine, strategy, 0, replay, profiler, checkpoint)
+
+    def resume(self, path: str, *, ticks: Optional[Union[str, Iterable]] = None,
+               checkpoint_every: Optional[int] = None) -> pd.Series:
+        """
+        Continue a run from its last checkpoint at `path`, saved by
+        `run(checkpoint_every=..., checkpoint_path=path)` of a backtest of
+        the same strategy, data and settings. The strategy is initialized
+        again (its indicators aren't saved) and the run goes on from the
+        bar after the checkpoint, still checkpointing to `path` every
+        `checkpoint_every` bars (by default, as often as before).
+        """
+        snapshot = _checkpoint.load(path)
+        meta = snapshot['meta']
+        params = meta['params']
+        expected = self._checkpoint_meta(params)
+        for key, value in expected.items():
+            if meta[key] != value:
+                raise ValueError(f'Checkpoint {path!r} is of a run with a different {key}: '
+                                 f'{meta[key]!r}, not {value!r}')
+
+        data, trading_engine, strategy = self._prepare(params)
+        strategy.init()
+        data._update()
+        _checkpoint.restore(snapshot, trading_engine, strategy)
+        replay = TickReplay(ticks, self.data.index) if ticks is not None else None
+        checkpoint = dict(path=path, every=checkpoint_every or meta['every'], meta=meta)
+        return self._run_bars(data, trading_engine, strategy, snapshot['bar'], replay, None, checkpoint)
+
+    def _prepare(self, params: dict) -> Tuple[_Data, '_TradingEngine', Strategy]:
+        # Wrap the OHLCV frame once; each bar only moves the cursor of the
+        # pre-built NumPy arrays instead of slicing a new DataFrame
+        data = _Data(self.data.copy(deep=False))
+        engine_class = _KernelEngine if self.kernel else _TradingEngine
+        trading_engine = engine_class(data, self.balance, self.maker_fee, self.taker_fee, self.hedge_mode,
+                                      self.exclusive_orders, leverage=self.leverage, margin_mode=self.margin_mode,
+                                      funding=as_funding(self.data.index, self.funding_rates),
+                                      fill_model=self.fill_model)
+        return data, trading_engine, self._strategy(trading_engine, data, params)
+
+    def _checkpoint_meta(self, params: dict) -> dict:
+        settings = self._backtest_kwargs()
+        del settings['funding_rates']  # Possibly a Series, which is not compared
+        settings['fill_model'] = repr(settings['fill_model'])
+        return dict(strategy=f'{self._strategy.__module__}.{self._strategy.__qualname__}', params=dict(params),
+                    data=_checkpoint.data_key(self.data), settings=settings)
+
+    def _run_bars(self, data: _Data, trading_engine: '_TradingEngine', strategy: Strategy, start: int,
+                  replay: Optional[TickReplay], profiler: Optional[_Profiler], checkpoint: Optional[dict]
+                  ) -> pd.Series:
+        n = len(self.data)
+        # Indicators used in Strategy.next()
+        indicator_attrs = [(attr, indicator) for attr, indicator in strategy.__dict__.items()
+                           if isinstance(indicator, _Indicator)]
+        every = checkpoint['every'] if checkpoint else 0
+        next_checkpoint = start + every if every else n + 1
+
+        for i in range(start, n):
+            data._set_length(i + 1)
+            for attr, indicator in indicator_attrs:
+                # Slice indicator on the last dimension (case of 2d indicator)
+                setattr(strategy, attr, indicator[..., :i + 1])
+
+            # Orders placed on the previous bar are matched against this bar first
+            trading_engine.handle_execution(replay(i) if replay is not None else None)
+            strategy.next()
 
-        for i in range(len(self.data)):
-            strategy.data = self.data.iloc[:i]
+            if i + 1 == next_checkpoint:
+                _checkpoint.save(checkpoint['path'], i + 1, trading_engine, strategy,
+                                 dict(checkpoint['meta'], every=every))
+                next_checkpoint += every
 
-            strategy.next()
-            trading_engine.handle_execution()
+        else:
+            if profiler:
+                profiler.mark('loop')
+            # Settle any positions still open at the last close
+            trading_engine.settle_positions(data.Close[-1])
+            if profiler:
+                profiler.mark('settle')
+
+        self._results = get_backtesting_results(data=self.data, trades=trading_engine.trades.columns(),
+                                                equity=trading_engine.equitys)
+        if profiler:
+            profiler.mark('stats')
+            self._results['_profile'] = profiler.result(trading_engine)
+        return self._results
+
+    def run_vectorized(self, entries, exits=None, *,
+                       short_entries=None,
+                       short_exits=None,
+                       size: Optional[float] = None,
+                       exec_type: Optional[ExecType] = ExecType.TakerFill,
+                       symbol: str = "BTC-USDT") -> pd.Series:
+        """
+        Run a "signal mode" backtest from precomputed boolean signal arrays
+        (e.g. built from `Strategy.I` indicators) without a per-bar loop.
+
+        Signals on bar `i` are filled as market orders at the open of bar
+        `i + 1`, the same as orders placed in `Strategy.next()`. `size` is
+        the order size (scalar or per-bar array); by default every entry
+        uses all available cash.
+        """
+        if self.leverage != 1 or self.funding_rates is not None or self.fill_model is not None:
+            raise ValueError('run_vectorized() models neither leverage, funding nor fill models, use run()')
+        fee_rate = self.maker_fee if exec_type == ExecType.MakerFill else self.taker_fee
+        equity, trades = run_signals(self.data.Open.to_numpy(), self.data.Close.to_numpy(),
+                                     entries=entries, exits=exits,
+                                     short_entries=short_entries, short_exits=short_exits,
+                                     size=size, balance=self.balance, fee_rate=fee_rate,
+                                     symbol_config=symbol_config_map[symbol])
+        self._results = get_backtesting_results(data=self.data, trades=trades, equity=equity)
+        return self._results
 
+    def optimize(self, *,
+                 maximize: Union[str, Callable[[pd.Series], float]] = 'Equity Final [$]',
+                 method: str = 'grid',
+                 max_tries: Optional[Union[int, float]] = None,
+                 constraint: Optional[Callable[[SimpleNamespace], bool]] = None,
+                 return_heatmap: bool = False,
+                 max_workers: Optional[int] = None,
+                 random_state: Optional[int] = None,
+                 results_store=None,
+                 **kwargs) -> Union[pd.Series, Tuple[pd.Series, pd.Series]]:
+        """
+        Optimize strategy parameters over the ranges given as keyword
+        arguments, e.g. `bt.optimize(fast=range(5, 20), slow=[30, 50])`.
+
+        `maximize` is a key of the results or a function of them. `method`
+        is `'grid'` (every combination) or `'random'` (`max_tries`
+        combinations, a count or a fraction of the grid). `constraint`
+        gets the candidate parameters as attributes and filters them out
+        by returning False.
+
+        Runs are spread over `max_workers` processes (default: CPU count);
+        the OHLCV arrays are placed in shared memory once and mapped by
+        every worker. Returns the results of the best run, and the metric
+        of every run as a `pd.Series` heatmap if `return_heatmap`.
+
+        With a `results_store` (a `CryptoBT.results.ResultsStore`), runs
+        stored there before are scored from their stored results instead
+        of run again, and the new runs are stored.
+        """
+        param_grid = _param_grid(kwargs, method, max_tries, constraint, random_state)
+        names = list(kwargs.keys())
+
+        stored = {}
+        if results_store is not None:
+            keys = results_store.run_keys(self, param_grid)
+            found = results_store.find(keys)
+            stored = {k: _score(results_store.get(found[key]), maximize)
+                      for k, key in enumerate(keys) if key in found}
+        pending = [params for k, params in enumerate(param_grid) if k not in stored]
+        keep_results = results_store is not None
+
+        max_workers = max_workers or os.cpu_count() or 1
+        if max_workers == 1 or len(pending) <= 1:
+            _optimize_state.update(backtest=self, maximize=maximize, keep_results=keep_results)
+            try:
+                outputs = [_optimize_run(params) for params in pending]
+            finally:
+                _optimize_state.clear()
+        else:
+            shm, meta = _df_to_shm(self.data)
+            try:
+                with ProcessPoolExecutor(max_workers=max_workers, initializer=_optimize_init,
+                                         initargs=(shm.name, meta, self._strategy, self._backtest_kwargs(),
+                                                   maximize, keep_results)) as executor:
+                    chunksize = max(1, len(pending) // (max_workers * 4))
+                    outputs = list(executor.map(_optimize_run, pending, chunksize=chunksize))
+            finally:
+                shm.close()
+                shm.unlink()
+
+        if keep_results:
+            pending_keys = [key for k, key in enumerate(keys) if k not in stored]
+            for key, params, (_, results) in zip(pending_keys, pending, outputs):
+                results_store.put(key, params, results)
+            outputs = [score for score, _ in outputs]
+        outputs = iter(outputs)
+        scores = [stored[k] if k in stored else next(outputs) for k in range(len(param_grid))]
+
+        heatmap = pd.Series(scores, name=maximize if isinstance(maximize, str) else _as_str(maximize),
+                            index=pd.MultiIndex.from_tuples([tuple(params.values()) for params in param_grid],
+                                                            names=names),
+                            dtype=float)
+        if heatmap.isnull().all():
+            best_params = param_grid[0]
         else:
-            for trade in trading_engine.trades:
-                trade.close()
+            best_params = param_grid[int(np.nanargmax(heatmap.values))]
 
-        self._results = get_backtesting_results(data=self.data, trades=trading_engine.trades,
-                                                equity=trading_engine.equitys)
+        self._results = self.run(**best_params)
+        if return_heatmap:
+            return self._results, heatmap
+        return self._results
+
+    def walk_forward(self, *,
+                     train: int,
+                     test: int,
+                     step: Optional[int] = None,
+                     anchored: bool = False,
+                     maximize: Union[str, Callable[[pd.Series], float]] = 'Equity Final [$]',
+                     method: str = 'grid',
+                     max_tries: Optional[Union[int, float]] = None,
+                     constraint: Optional[Callable[[SimpleNamespace], bool]] = None,
+                     max_workers: Optional[int] = None,
+                     random_state: Optional[int] = None,
+                     **kwargs) -> pd.Series:
+        """
+        Walk-forward analysis: optimize the parameter ranges in `kwargs`
+        (as `optimize()` does) on a window of `train` bars, run the best
+        parameters on the `test` bars that follow, and move both windows
+        on by `step` bars (default: `test`, at least that so test windows
+        don't overlap). With `anchored=True`, every training window starts
+        at the first bar instead of rolling. Indicators of each test run
+        are warmed up on its training bars, which aren't traded.
+
+        Folds are spread over `max_workers` processes (default: CPU
+        count), which map the OHLCV arrays from one shared memory block
+        and backtest zero-copy row slices of them.
+
+        Returns the results of the stitched out-of-sample test windows,
+        each compounding from the equity the previous one ended with (and
+        with any bars between them left out), and
+        a `_folds` frame with every fold's windows, chosen parameters and
+        train and test scores.
+        """
+        n = len(self.data)
+        if train <= 0 or test <= 0:
+            raise ValueError('`train` and `test` should be positive bar counts')
+        step = step or test
+        if step < test:
+            raise ValueError(f'`step` of {step} bars would overlap test windows of {test} bars')
+        folds = []
+        for start in range(0, n - train, step):
+            test_start = start + train
+            folds.append((0 if anchored else start, test_start, min(test_start + test, n)))
+        if not folds:
+            raise ValueError(f'Data of {n} bars is too short for a training window of {train} bars')
+        param_grid = _param_grid(kwargs, method, max_tries, constraint, random_state)
+
+        max_workers = max_workers or os.cpu_count() or 1
+        if max_workers == 1 or len(folds) == 1:
+            _walk_forward_state.update(df=self.data, strategy=self._strategy, backtest_kwargs=self._backtest_kwargs(),
+                                       maximize=maximize, param_grid=param_grid)
+            try:
+                outcomes = [_walk_forward_fold(fold) for fold in folds]
+            finally:
+                _walk_forward_state.clear()
+        else:
+            shm, meta = _df_to_shm(self.data)
+            try:
+                with ProcessPoolExecutor(max_workers=min(max_workers, len(folds)), initializer=_walk_forward_init,
+                                         initargs=(shm.name, meta, self._strategy, self._backtest_kwargs(),
+                                                   maximize, param_grid)) as executor:
+                    outcomes = list(executor.map(_walk_forward_fold, folds))
+            finally:
+                shm.close()
+                shm.unlink()
+
+        # Stitch the test windows, scaling each by the growth of the ones before it
+        equities, trades, rows = [], [], []
+        growth = 1.
+        stitched = 0  # Bars of the test windows before this one
+        for (train_start, test_start, test_end), (params, train_score, test_score, equity, fold_trades) in \
+                zip(folds, outcomes):
+            equities.append(equity * growth)
+            for key in ('size', 'fees', 'funding'):
+                fold_trades[key] = fold_trades[key] * growth
+            fold_trades['entry_time'] = fold_trades['entry_time'] + stitched
+            fold_trades['exit_time'] = fold_trades['exit_time'] + stitched
+            stitched += test_end - test_start
+            trades.append(fold_trades)
+            growth *= equity[-1] / self.balance
+            index = self.data.index
+            rows.append({'TrainStart': index[train_start], 'TrainEnd': index[test_start - 1],
+                         'TestStart': index[test_start], 'TestEnd': index[test_end - 1],
+                         **params, 'TrainScore': train_score, 'TestScore': test_score})
+
+        trades = {key: np.concatenate([fold_trades[key] for fold_trades in trades]) for key in trades[0]}
+        test_rows = np.concatenate([np.arange(test_start, test_end) for _, test_start, test_end in folds])
+        self._results = get_backtesting_results(data=self.data.iloc[test_rows], trades=trades,
+                                                equity=np.concatenate(equities))
+        self._results['_folds'] = pd.DataFrame(rows)
         return self._results
+
+    def _run_after(self, start: int, params: dict) -> pd.Series:
+        """
+        Run over the bars from `start` on, with the bars before it only
+        warming up the indicators, and return the results of those bars.
+        """
+        data, trading_engine, strategy = self._prepare(params)
+        strategy.init()
+        data._update()
+        trading_engine.equitys = [trading_engine.equity] * start
+        results = self._run_bars(data, trading_engine, strategy, start, None, None, None)
+        trades = results['_trades']
+        trades = {'entry_time': trades.EntryBar.to_numpy() - start, 'exit_time': trades.ExitBar.to_numpy() - start,
+                  'side': trades.Side.to_numpy(), 'size': trades.Size.to_numpy(dtype=float),
+                  'entry_price': trades.EntryPrice.to_numpy(), 'exit_price': trades.ExitPrice.to_numpy(),
+                  'fees': trades.Fees.to_numpy(), 'funding': trades.Funding.to_numpy()}
+        self._results = get_backtesting_results(data=self.data.iloc[start:], trades=trades,
+                                                equity=results['_equity_curve'].Equity.to_numpy()[start:])
+        return self._results
+
+    def _backtest_kwargs(self) -> dict:
+        return dict(balance=self.balance, maker_fee=self.maker_fee, taker_fee=self.taker_fee,
+                    hedge_mode=self.hedge_mode, exclusive_orders=self.exclusive_orders, kernel=self.kernel,
+                    leverage=self.leverage, margin_mode=self.margin_mode, funding_rates=self.funding_rates,
+                    fill_model=self.fill_model)
+
+
+def _param_grid(kwargs: dict, method: str, max_tries, constraint, random_state) -> List[dict]:
+    """The parameter combinations of `Backtest.optimize()` to test."""
+    if not kwargs:
+        raise ValueError('Need some strategy parameters to optimize')
+    if method not in ('grid', 'random'):
+        raise ValueError(f"Optimization method should be 'grid' or 'random', not {method!r}")
+
+    names = list(kwargs.keys())
+    param_grid = [dict(zip(names, values)) for values in product(*map(_as_list, kwargs.values()))]
+    if constraint is not None:
+        param_grid = [params for params in param_grid if constraint(SimpleNamespace(**params))]
+    if method == 'random' or max_tries is not None:
+        if max_tries is None:
+            max_tries = 200
+        if 0 < max_tries <= 1:
+            max_tries = int(max_tries * len(param_grid))
+        rng = np.random.default_rng(random_state)
+        picked = rng.choice(len(param_grid), size=min(len(param_grid), max(1, int(max_tries))), replace=False)
+        param_grid = [param_grid[i] for i in sorted(picked)]
+    if not param_grid:
+        raise ValueError('No admissible parameter combinations to test')
+    return param_grid
+
+
+def _score(results: pd.Series, maximize) -> float:
+    try:
+        value = maximize(results) if callable(maximize) else results[maximize]
+        return float(value)
+    except (TypeError, KeyError, ValueError):
+        return np.nan
+
+
+# Per-process state of `Backtest.optimize()` workers
+_optimize_state = {}
+
+
+def _optimize_init(shm_name, meta, strategy, backtest_kwargs, maximize, keep_results=False):
+    from multiprocessing.shared_memory import SharedMemory
+
+    shm = SharedMemory(name=shm_name)
+    _optimize_state.update(shm=shm, maximize=maximize, keep_results=keep_results,
+                           backtest=Backtest(_df_from_shm(shm, meta), strategy, **backtest_kwargs))
+
+
+def _optimize_run(params: dict) -> Union[float, Tuple[float, pd.Series]]:
+    """The score of a run with `params`, and its results if they are to be kept."""
+    results = _optimize_state['backtest'].run(**params)
+    score = _score(results, _optimize_state['maximize'])
+    return (score, results) if _optimize_state['keep_results'] else score
+
+
+# Per-process state of `Backtest.walk_forward()` workers
+_walk_forward_state = {}
+
+
+def _walk_forward_init(shm_name, meta, strategy, backtest_kwargs, maximize, param_grid):
+    from multiprocessing.shared_memory import SharedMemory
+
+    shm = SharedMemory(name=shm_name)
+    _walk_forward_state.update(shm=shm, df=_df_from_shm(shm, meta), strategy=strategy,
+                               backtest_kwargs=backtest_kwargs, maximize=maximize, param_grid=param_grid)
+
+
+def _walk_forward_fold(fold: Tuple[int, int, int]):
+    """Optimize on the training rows of `fold`, then run the best parameters on its test rows."""
+    train_start, test_start, test_end = fold
+    state = _walk_forward_state
+    df, maximize, param_grid = state['df'], state['maximize'], state['param_grid']
+    # Row slices of the shared frame are views, so no fold copies the data
+    train_bt = Backtest(df.iloc[train_start:test_start], state['strategy'], **state['backtest_kwargs'])
+    scores = np.array([_score(train_bt.run(**params), maximize) for params in param_grid])
+    best = 0 if np.isnan(scores).all() else int(np.nanargmax(scores))
+    params = param_grid[best]
+
+    # The training rows warm up the indicators of the test run
+    results = Backtest(df.iloc[train_start:test_end], state['strategy'], **state['backtest_kwargs']
+                       )._run_after(test_start - train_start, params)
+    trades = results['_trades']
+    trades = {'entry_time': trades.EntryBar.to_numpy(), 'exit_time': trades.ExitBar.to_numpy(),
+              'side': trades.Side.to_numpy(), 'size': trades.Size.to_numpy(dtype=float),
+              'entry_price': trades.EntryPrice.to_numpy(), 'exit_price': trades.ExitPrice.to_numpy(),
+              'fees': trades.Fees.to_numpy(), 'funding': trades.Funding.to_numpy()}
+    return params, scores[best], _score(results, maximize), results['_equity_curve'].Equity.to_numpy(), trades
@@ -1,2 +1,3 @@
 from .CryptoBT import Strategy, Backtest
-from . import lib
\ No newline at end of file
+from . import lib
+from .portfolio import PortfolioStrategy, PortfolioBacktest
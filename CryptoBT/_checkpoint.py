@@ -0,0 +1,74 @@
+"""
+Checkpoints of a running `Backtest`.
+
+A checkpoint holds what the bars seen so far changed, and nothing that
+re-running `Strategy.init()` on the same data rebuilds: the engine's
+positions, order book, trades, equity curve and cash, and the strategy's
+own attributes other than its indicators and data. Both are pickled
+together, so references between them (e.g. a strategy keeping an
+`Order`) survive, then compressed into one file, written aside and
+renamed into place so a crash mid-write leaves the previous one intact.
+"""
+import hashlib
+import os
+import pickle
+import zlib
+from types import FunctionType, MethodType
+
+import numpy as np
+import pandas as pd
+
+from ._util import _Array, _Data
+from .cache import _fingerprint, _fingerprint_index
+
+_MAGIC = b'CryptoBT-checkpoint-1\n'
+
+# Rebuilt from the data and the Backtest on resume
+_ENGINE_REBUILT = ('data', '_ohlc', '_funding', 'fill_model')
+_STRATEGY_REBUILT = ('trading_engine', 'data', 'position', 'params', '_indicators')
+
+
+def _is_state(value) -> bool:
+    # Indicators and data views are recomputed by `init()`, and profiled runs wrap methods in closures
+    return not isinstance(value, (_Array, _Data, FunctionType, MethodType))
+
+
+def data_key(df: pd.DataFrame) -> str:
+    """Fingerprint of the OHLCV data a run is over."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((len(df), list(df.columns))).encode())
+    for column in df.columns.intersection(['Open', 'High', 'Low', 'Close', 'Volume']):
+        _fingerprint(df[column].to_numpy(), h)
+    _fingerprint_index(df.index, h)
+    return h.hexdigest()
+
+
+def save(path: str, bar: int, engine, strategy, meta: dict):
+    """Write a checkpoint of `engine` and `strategy` after `bar` bars, with the run's `meta`."""
+    engine_state = {key: value for key, value in vars(engine).items()
+                    if key not in _ENGINE_REBUILT and _is_state(value)}
+    engine_state['equitys'] = np.asarray(engine.equitys)
+    strategy_state = {key: value for key, value in vars(strategy).items()
+                      if key not in _STRATEGY_REBUILT and _is_state(value)}
+    payload = pickle.dumps({'meta': meta, 'bar': bar, 'engine': engine_state, 'strategy': strategy_state},
+                           protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(zlib.compress(payload, 1))
+    os.replace(tmp_path, path)
+
+
+def load(path: str) -> dict:
+    with open(path, 'rb') as f:
+        if f.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f'{path!r} is not a CryptoBT checkpoint')
+        return pickle.loads(zlib.decompress(f.read()))
+
+
+def restore(snapshot: dict, engine, strategy):
+    """Put the state of a loaded checkpoint into a freshly initialized `engine` and `strategy`."""
+    engine_state = dict(snapshot['engine'])
+    engine_state['equitys'] = engine_state['equitys'].tolist()
+    vars(engine).update(engine_state)
+    vars(strategy).update(snapshot['strategy'])
@@ -0,0 +1,190 @@
+"""
+Fill, tp/sl, fee and position accounting of one bar as scalar loops over
+the order book's columns, compiled with numba when it's installed.
+Without numba, `fill_bar` runs as plain Python and orders are matched by
+the vectorized `_OrderBook.match` instead of `match_bar`.
+
+The account is a flat `state` array of
+`[cash, long size, long entry price, short size, short entry price]`, and
+position margin is `size * entry price / leverage`.
+"""
+import numpy as np
+
+from .idl import OrderStatus, Side
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+_NEW = OrderStatus.New.value
+_CREATED = OrderStatus.Created.value
+_TAKER_FILL = OrderStatus.TakerFill.value
+_MAKER_FILL = OrderStatus.MakerFill.value
+_CANCELED = OrderStatus.Canceled.value
+_REJECTED = OrderStatus.Rejected.value
+_BUY = Side.Buy.value
+_SELL = Side.Sell.value
+
+CASH, LONG_SIZE, LONG_ENTRY, SHORT_SIZE, SHORT_ENTRY = range(5)
+
+
+def _is_active(status) -> bool:
+    return status == _NEW or status == _CREATED
+
+
+def _match_bar(side, price, stop, status, n, open_, high, low):
+    """Scalar equivalent of `_OrderBook.match()` over the first `n` rows."""
+    rows = np.empty(n, dtype=np.int64)
+    fill_prices = np.empty(n)
+    k = 0
+    for row in range(n):
+        if not _is_active(status[row]):
+            continue
+        buy = side[row] == _BUY
+        limit, stop_price = price[row], stop[row]
+        has_stop = not np.isnan(stop_price)
+        if has_stop and not (high >= stop_price if buy else low <= stop_price):
+            continue
+        is_limit = not np.isnan(limit)
+        if is_limit and not (low <= limit if buy else high >= limit):
+            continue
+        if is_limit:
+            fill_price = limit if has_stop else (min(open_, limit) if buy else max(open_, limit))
+        elif has_stop:
+            fill_price = max(open_, stop_price) if buy else min(open_, stop_price)
+        else:
+            fill_price = open_
+        rows[k] = row
+        fill_prices[k] = fill_price
+        k += 1
+    return rows[:k], fill_prices[:k]
+
+
+def _round_size(size, tick_size, max_size):
+    """`SymbolConfig.round_size()` of a scalar."""
+    ticks = np.floor(np.rint(size / tick_size * 1e6) / 1e6)
+    return min(ticks * tick_size, max_size)
+
+
+def _cancel(status, n, parent, reduce_only, side, parent_id, reduce_side) -> int:
+    """Cancel active children of `parent_id` (if >= 0), or reduce-only orders of `reduce_side` (if > 0)."""
+    n_canceled = 0
+    for row in range(n):
+        if not _is_active(status[row]):
+            continue
+        if (parent_id >= 0 and parent[row] == parent_id) or \
+                (reduce_side > 0 and reduce_only[row] and side[row] == reduce_side):
+            status[row] = _CANCELED
+            n_canceled += 1
+    return n_canceled
+
+
+def _fill_bar(ids, parent, side, price, size, stop, tp, sl, reduce_only, status, n, next_id,
+              rows, fill_prices, state, maker_fee, taker_fee, leverage, tick_size, max_size):
+    """
+    Fill the matched `rows` at `fill_prices`, in order, the same as
+    `_TradingEngine._fill()` does one order at a time. Book columns and
+    `state` are updated in place; the tp/sl children of filled orders are
+    written as new rows from `n` on (the book must have room for two per
+    matched row).
+
+    Returns, per fill attempt, the row, fill price, filled size and
+    resulting status, and the number of child rows added.
+    """
+    m = len(rows)
+    out_rows = np.empty(m, dtype=np.int64)
+    out_prices = np.empty(m)
+    out_sizes = np.empty(m)
+    out_status = np.empty(m, dtype=np.int8)
+    n_out = 0
+    n_rows = n
+    for k in range(m):
+        row = rows[k]
+        # An earlier fill this bar may have canceled the order (e.g. the other leg of tp/sl)
+        if not _is_active(status[row]):
+            continue
+        fill_price = fill_prices[k]
+        is_maker = not np.isnan(price[row]) and np.isnan(stop[row])
+        fill_status = _MAKER_FILL if is_maker else _TAKER_FILL
+        fee_rate = maker_fee if is_maker else taker_fee
+        filled = 0.
+
+        if reduce_only[row]:
+            # Close the position on the other side
+            size_at, entry_at = (SHORT_SIZE, SHORT_ENTRY) if side[row] == _BUY else (LONG_SIZE, LONG_ENTRY)
+            position_size, entry_price = state[size_at], state[entry_at]
+            filled = min(size[row], position_size)
+            if filled <= 0:
+                status[row] = _REJECTED
+                fill_status = _REJECTED
+            else:
+                pnl = (fill_price - entry_price) * filled if side[row] == _SELL else (entry_price - fill_price) * filled
+                state[size_at] = position_size - filled
+                state[CASH] += filled * entry_price / leverage + pnl
+                state[CASH] -= filled * fill_price * fee_rate
+                # Finalized before its siblings are canceled, so its row keeps the fill's status
+                status[row] = fill_status
+                if parent[row] >= 0:
+                    _cancel(status, n_rows, parent, reduce_only, side, parent[row], 0)
+                if state[size_at] <= 0:
+                    _cancel(status, n_rows, parent, reduce_only, side, -1, side[row])
+        else:
+            # Open a position
+            cash = state[CASH]
+            filled = size[row]
+            if np.isnan(filled):
+                filled = _round_size(cash / (fill_price * (1 / leverage + fee_rate)), tick_size, max_size)
+            if filled <= 0 or filled * fill_price * (1 / leverage + fee_rate) > cash:
+                status[row] = _REJECTED
+                fill_status = _REJECTED
+            else:
+                size[row] = filled
+                state[CASH] = cash - filled * fill_price / leverage
+                state[CASH] -= filled * fill_price * fee_rate
+                size_at, entry_at = (LONG_SIZE, LONG_ENTRY) if side[row] == _BUY else (SHORT_SIZE, SHORT_ENTRY)
+                position_size = state[size_at]
+                if position_size == 0:
+                    state[entry_at] = fill_price
+                else:
+                    state[entry_at] = (fill_price * filled / (position_size + filled) +
+                                       state[entry_at] * position_size / (position_size + filled))
+                state[size_at] = position_size + filled
+
+                # The tp/sl orders are only placed once the parent order is filled
+                for child_price, child_stop in ((tp[row], np.nan), (np.nan, sl[row])):
+                    level = child_price if np.isnan(child_stop) else child_stop
+                    if np.isnan(level) or level == 0:
+                        continue
+                    ids[n_rows] = next_id
+                    next_id += 1
+                    parent[n_rows] = ids[row]
+                    side[n_rows] = _SELL if side[row] == _BUY else _BUY
+                    price[n_rows] = child_price
+                    size[n_rows] = filled
+                    stop[n_rows] = child_stop
+                    tp[n_rows] = np.nan
+                    sl[n_rows] = np.nan
+                    reduce_only[n_rows] = True
+                    status[n_rows] = _NEW
+                    n_rows += 1
+
+        if fill_status != _REJECTED and _is_active(status[row]):
+            status[row] = fill_status
+        out_rows[n_out] = row
+        out_prices[n_out] = fill_price
+        out_sizes[n_out] = filled
+        out_status[n_out] = fill_status
+        n_out += 1
+    return out_rows[:n_out], out_prices[:n_out], out_sizes[:n_out], out_status[:n_out], n_rows - n
+
+
+if njit is not None:
+    _is_active = njit(cache=True)(_is_active)
+    _round_size = njit(cache=True)(_round_size)
+    _cancel = njit(cache=True)(_cancel)
+    match_bar = njit(cache=True, nogil=True)(_match_bar)
+    fill_bar = njit(cache=True, nogil=True)(_fill_bar)
+else:
+    match_bar = None
+    fill_bar = _fill_bar
@@ -0,0 +1,69 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from .idl import Side
+
+_TRADE_DTYPE = np.dtype([
+    ('entry_time', np.int64),
+    ('exit_time', np.int64),
+    ('side', np.int8),
+    ('size', np.float64),
+    ('entry_price', np.float64),
+    ('exit_price', np.float64),
+    ('fees', np.float64),
+    ('funding', np.float64),
+    ('entry_order_id', np.int64),
+    ('exit_order_id', np.int64),
+])
+
+
+class _TradeLedger:
+    """
+    Append-only record of closed trades, one row of a structured array
+    each. A partial close records the closed part as its own row, so open
+    `Trade` objects are only ever shrunk, never copied. Rows carry the fees
+    (entry and exit, and the maintenance margin lost to a liquidation) and
+    the funding the closed part paid.
+    """
+    def __init__(self, capacity: int = 64):
+        self._rows = np.zeros(capacity, dtype=_TRADE_DTYPE)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self._rows[column][:self._n]
+
+    def append(self, trade, size: float, exit_time: int, exit_price: float, exit_order_id,
+               fees: float = 0., funding: float = 0.):
+        n = self._n
+        if n == len(self._rows):
+            self._rows = np.resize(self._rows, 2 * n)
+        self._rows[n] = (trade.entry_time, exit_time, 1 if trade.side == Side.Buy else -1, size,
+                         trade.entry_price, exit_price, fees, funding,
+                         -1 if trade.entry_order_id is None else trade.entry_order_id,
+                         -1 if exit_order_id is None else exit_order_id)
+        self._n = n + 1
+
+    def notional(self, start: int = 0) -> float:
+        """Entry value of the rows from `start` on."""
+        rows = self._rows[start:self._n]
+        return float(np.sum(rows['size'] * rows['entry_price']))
+
+    def rebate(self, start: int, rate: float):
+        """Take `rate` per unit of entry value off the fees of the rows from `start` on."""
+        rows = self._rows[start:self._n]
+        rows['fees'] -= rate * rows['size'] * rows['entry_price']
+
+    def __getstate__(self):
+        # Spare capacity isn't pickled, e.g. into checkpoints
+        return {'_rows': self._rows[:max(self._n, 1)].copy(), '_n': self._n}
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {column: self[column] for column in _TRADE_DTYPE.names}
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns())
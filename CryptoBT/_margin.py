@@ -0,0 +1,132 @@
+"""
+Margin of perpetual futures positions: maintenance margin tiers,
+liquidation prices and funding. Positions are passed as arrays of
+`sign` (1 long, -1 short), `size` and `entry` price, so a whole book is
+handled in single array operations.
+"""
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from ._util import _index_ns
+
+ISOLATED = 'isolated'
+CROSS = 'cross'
+MARGIN_MODES = (ISOLATED, CROSS)
+
+# Binance perpetuals settle funding every 8 hours, at 00:00, 08:00 and 16:00 UTC
+FUNDING_INTERVAL = pd.Timedelta(hours=8)
+
+
+def maintenance_tier(notional, tiers: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Maintenance margin rate and amount of positions of `notional` value,
+    from `tiers` rows of `(notional cap, rate, amount)`, or from a
+    `stack_tiers()` block with the tiers of each row of `notional`; the
+    maintenance margin is `notional * rate - amount`.
+    """
+    if tiers.ndim == 3:
+        notional = np.asarray(notional)
+        k = np.minimum(np.sum(tiers[:, None, :, 0] < notional[..., None], axis=-1), tiers.shape[1] - 1)
+        rows = np.arange(len(tiers))[:, None]
+        return tiers[rows, k, 1], tiers[rows, k, 2]
+    k = np.minimum(np.searchsorted(tiers[:, 0], notional, side='left'), len(tiers) - 1)
+    return tiers[k, 1], tiers[k, 2]
+
+
+def stack_tiers(tiers: Sequence[np.ndarray]) -> np.ndarray:
+    """Maintenance tiers of several symbols as one `(symbols, tiers, 3)` block, padded with their last tier."""
+    depth = max(len(rows) for rows in tiers)
+    return np.stack([np.concatenate([rows, np.repeat(rows[-1:], depth - len(rows), axis=0)]) for rows in tiers])
+
+
+def liquidation_prices(sign, size, entry, margin, tiers: np.ndarray) -> np.ndarray:
+    """
+    Isolated margin: the price at which each position's margin plus
+    unrealized pnl falls to its maintenance margin, NaN for empty ones.
+    """
+    sign, size, entry, margin = map(np.asarray, (sign, size, entry, margin))
+    rate, amount = maintenance_tier(size * entry, tiers)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price = (sign * size * entry - margin - amount) / (size * (sign - rate))
+    return np.where(size > 0, price, np.nan)
+
+
+def cross_liquidation_price(sign, size, entry, collateral: float, tiers: np.ndarray) -> Tuple[float, float]:
+    """
+    Cross margin: the price at which `collateral` (cash plus position
+    margins) plus the positions' unrealized pnl falls to their total
+    maintenance margin. Also returns the slope of that margin balance in
+    price: positive if it is reached by the price falling, negative by it
+    rising, and 0 if the positions are hedged so it's never reached.
+    """
+    sign, size, entry = map(np.asarray, (sign, size, entry))
+    rate, amount = maintenance_tier(size * entry, tiers)
+    slope = float(np.sum(size * (sign - rate)))
+    if not slope:
+        return np.nan, 0.
+    return float(np.sum(sign * size * entry) - collateral - np.sum(amount)) / slope, slope
+
+
+def cross_liquidation(sign, size, entry, collateral: float, tiers: np.ndarray,
+                      open_: np.ndarray, high: np.ndarray, low: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Cross margin over several symbols, with `size` and `entry` as
+    `(symbols, sides)` arrays and `tiers` from `stack_tiers()`: if the
+    margin balance (`collateral` plus unrealized pnl less maintenance
+    margin) of all positions falls to zero within a bar, as every symbol
+    moves from its open to its adverse extreme (low or high) in step,
+    the prices at which it does, by symbol; else None.
+    """
+    sign, size, entry = map(np.asarray, (sign, size, entry))
+    rate, amount = maintenance_tier(size * entry, tiers)
+    slope = np.sum(size * (sign - rate), axis=1)
+    held = slope != 0
+    if not held.any():
+        return None  # Hedged, the balance doesn't move with prices
+    base = collateral - float(np.sum(sign * size * entry - amount))
+    worst = np.where(slope > 0, low, high)
+    at_open = base + float(slope[held] @ open_[held])
+    at_worst = base + float(slope[held] @ worst[held])
+    if at_worst > 0:
+        return None
+    step = at_open / (at_open - at_worst) if at_open > 0 else 0.
+    return open_ + step * (worst - open_)
+
+
+def funding_schedule(index: pd.Index, rates: Union[float, pd.Series],
+                     interval: pd.Timedelta = FUNDING_INTERVAL) -> np.ndarray:
+    """
+    Funding rate paid on each bar of `index`: on the first bar at or after
+    every funding time, the latest of `rates` (a constant, or a series
+    indexed by funding time) as of that bar; 0 on all other bars.
+    """
+    times = _index_ns(index)
+    period = times // interval.value
+    is_funding = np.empty(len(times), dtype=bool)
+    if len(times):
+        is_funding[0] = times[0] % interval.value == 0
+        is_funding[1:] = period[1:] != period[:-1]
+    if not isinstance(rates, pd.Series):
+        return np.where(is_funding, float(rates), 0.)
+
+    rates = rates.sort_index()
+    k = np.searchsorted(_index_ns(rates.index), times, side='right') - 1
+    values = rates.to_numpy(dtype=float)[np.maximum(k, 0)]
+    schedule = np.where(is_funding & (k >= 0), values, 0.)
+    schedule[np.isnan(schedule)] = 0
+    return schedule
+
+
+def funding_payments(sign, size, price, rate: float) -> np.ndarray:
+    """Cash received by each position: longs pay shorts when the rate is positive."""
+    return -np.asarray(sign) * np.asarray(size) * price * rate
+
+
+def as_funding(index: pd.Index, rates: Optional[Union[float, pd.Series]]) -> Optional[np.ndarray]:
+    """`funding_schedule()`, or None if there is no funding or all of it is zero."""
+    if rates is None:
+        return None
+    schedule = funding_schedule(index, rates)
+    return schedule if schedule.any() else None
@@ -0,0 +1,272 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .idl import ExecType, OrderStatus, Side
+
+_ORDER_DTYPE = np.dtype([
+    ('id', np.int64),
+    ('parent', np.int64),
+    ('side', np.int8),
+    ('price', np.float64),
+    ('size', np.float64),
+    ('stop', np.float64),
+    ('tp', np.float64),
+    ('sl', np.float64),
+    ('reduce_only', np.bool_),
+    ('status', np.int8),
+    ('post_only', np.bool_),  # Expires rather than take liquidity, with a `FillModel`
+    ('active_from', np.int64),  # First bar the order can fill on
+])
+
+_NEW = OrderStatus.New.value
+_CREATED = OrderStatus.Created.value
+_BUY = Side.Buy.value
+_STATUSES = {status.value: status for status in OrderStatus}
+
+
+def _nan_if_none(value) -> float:
+    return np.nan if value is None else value
+
+
+class _OrderBook:
+    """
+    Pending orders kept as rows of a structured array, so that matching
+    a bar against every resting order is a handful of vectorized ops.
+    `Order` objects are kept alongside as the handles given to strategies.
+    """
+    def __init__(self, capacity: int = 64):
+        self._book = np.zeros(capacity, dtype=_ORDER_DTYPE)
+        self._orders: List = []
+        self._n_active = 0
+        self._next_id = 0
+        self._n_posted = 0  # Rows before this one were already seen at a bar end
+        # Finalized orders dropped from the book, by status
+        self._n_dropped = np.zeros(max(_STATUSES) + 1, dtype=np.int64)
+
+    def __len__(self):
+        return self._n_active
+
+    def __bool__(self):
+        return self._n_active > 0
+
+    def __getstate__(self):
+        # Spare capacity isn't pickled, e.g. into checkpoints
+        state = self.__dict__.copy()
+        state['_book'] = self._book[:max(len(self._orders), 1)].copy()
+        return state
+
+    @property
+    def orders(self) -> List:
+        """All orders still in the book, including ones finalized this bar."""
+        return self._orders
+
+    @property
+    def active_orders(self) -> List:
+        book = self._book[:len(self._orders)]
+        return [self._orders[row] for row in np.flatnonzero(self._active_mask(book))]
+
+    def status_counts(self) -> Dict[OrderStatus, int]:
+        """Number of orders ever added by their current status."""
+        counts = self._n_dropped + np.bincount(self._book['status'][:len(self._orders)],
+                                               minlength=len(self._n_dropped))
+        return {status: int(counts[value]) for value, status in _STATUSES.items()}
+
+    def add(self, order, active_from: int = 0):
+        n = len(self._orders)
+        if n == len(self._book):
+            self._book = np.resize(self._book, 2 * n)
+        order.order_id = self._next_id
+        order._book = self
+        self._next_id += 1
+        parent = order.parent_order_id
+        self._book[n] = (order.order_id, -1 if parent is None else parent, order.side.value,
+                         _nan_if_none(order.price), _nan_if_none(order.size), _nan_if_none(order.stop),
+                         _nan_if_none(order.tp), _nan_if_none(order.sl), order.reduce_only, _NEW,
+                         order.exec_type == ExecType.MakerFill, active_from)
+        self._orders.append(order)
+        self._n_active += 1
+
+    def reserve(self, extra: int) -> np.ndarray:
+        """Make room for `extra` more rows and return the book's array."""
+        n = len(self._orders)
+        if n + extra > len(self._book):
+            self._book = np.resize(self._book, max(2 * len(self._book), n + extra))
+        return self._book
+
+    def sync(self, n: int, status_before: np.ndarray, new_orders: List):
+        """
+        Catch up with the columns of the first `n` rows having been changed
+        in place, and `new_orders` having been written as the rows after.
+        """
+        status = self._book['status']
+        changed = np.flatnonzero(status[:n] != status_before)
+        for row, value in zip(changed.tolist(), status[changed].tolist()):
+            self._orders[row].OrderStatus = _STATUSES[value]
+        self._n_active -= int(np.count_nonzero((status_before[changed] == _NEW) |
+                                               (status_before[changed] == _CREATED)))
+        self._book['post_only'][n:n + len(new_orders)] = False
+        self._book['active_from'][n:n + len(new_orders)] = 0
+        for row, order in enumerate(new_orders, n):
+            order.order_id = int(self._book['id'][row])
+            order._book = self
+            order.OrderStatus = _STATUSES[int(status[row])]
+            if order.OrderStatus in (OrderStatus.New, OrderStatus.Created):
+                self._n_active += 1
+        self._orders.extend(new_orders)
+        self._next_id += len(new_orders)
+
+    def match(self, open_: float, high: float, low: float, bar: Optional[int] = None
+              ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return rows of the orders triggered by the bar, in submission order,
+        and the price each fills at. Given the `bar` number, orders that
+        only become active after it are left out.
+        """
+        book = self._book[:len(self._orders)]
+        buy = book['side'] == _BUY
+        price, stop = book['price'], book['stop']
+
+        # Stop orders trigger on the bar's range first, then act as market or limit orders
+        has_stop = ~np.isnan(stop)
+        triggered = ~has_stop | np.where(buy, high >= stop, low <= stop)
+        is_limit = ~np.isnan(price)
+        limit_hit = np.where(buy, low <= price, high >= price)
+        hit = self._active_mask(book) & triggered & (~is_limit | limit_hit)
+        if bar is not None:
+            hit &= book['active_from'] <= bar
+
+        rows = np.flatnonzero(hit)
+        buy, price, stop, has_stop, is_limit = buy[rows], price[rows], stop[rows], has_stop[rows], is_limit[rows]
+        # A stop (or gap through a limit) fills at the open if the bar opened beyond it
+        market_price = np.where(has_stop, np.where(buy, np.maximum(open_, stop), np.minimum(open_, stop)), open_)
+        limit_price = np.where(has_stop, price, np.where(buy, np.minimum(open_, price), np.maximum(open_, price)))
+        return rows, np.where(is_limit, limit_price, market_price)
+
+    def match_ticks(self, prices: np.ndarray, quantities: np.ndarray, bar: Optional[int] = None
+                    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return rows of the orders filled by a sequence of trades, in the
+        order they fill, with the index of the trade filling each and its
+        price. Market orders take the first trade, stops the trade that
+        crosses them; a resting limit fills once the quantity traded at or
+        through its price covers its size.
+        """
+        n = len(prices)
+        book = self._book[:len(self._orders)]
+        active = self._active_mask(book)
+        if bar is not None:
+            active &= book['active_from'] <= bar
+        rows = np.flatnonzero(active)
+        if not n or not len(rows):
+            return rows[:0], rows[:0], np.empty(0)
+        book = book[rows]
+        buy = book['side'] == _BUY
+        price, stop, size = book['price'], book['stop'], book['size']
+
+        # Running extremes are monotonic, so the first trade crossing a level is a binary search
+        run_max = np.maximum.accumulate(prices)
+        neg_run_min = -np.minimum.accumulate(prices)
+        has_stop = ~np.isnan(stop)
+        fill_idx = np.zeros(len(rows), dtype=np.int64)
+        fill_idx[has_stop & buy] = np.searchsorted(run_max, stop[has_stop & buy], side='left')
+        fill_idx[has_stop & ~buy] = np.searchsorted(neg_run_min, -stop[has_stop & ~buy], side='left')
+        fill_price = prices[np.minimum(fill_idx, n - 1)]
+
+        is_limit = ~np.isnan(price)
+        # Limits already marketable at the first trade take it, like a gap through them on bars
+        marketable = is_limit & ~has_stop & np.where(buy, prices[0] <= price, prices[0] >= price)
+        for k in np.flatnonzero(is_limit & ~marketable & (fill_idx < n)).tolist():
+            start = fill_idx[k]
+            window = prices[start:]
+            through = window <= price[k] if buy[k] else window >= price[k]
+            if np.isnan(size[k]):
+                j = int(np.argmax(through)) if through.any() else n  # All-in size is known only at fill
+            else:
+                j = int(np.searchsorted(np.cumsum(np.where(through, quantities[start:], 0)), size[k] * (1 - 1e-9)))
+            fill_idx[k] = start + j
+            fill_price[k] = price[k]
+
+        filled = np.flatnonzero(fill_idx < n)
+        order = filled[np.argsort(fill_idx[filled], kind='stable')]
+        return rows[order], fill_idx[order], fill_price[order]
+
+    def is_active(self, row: int) -> bool:
+        return self._book['status'][row] in (_NEW, _CREATED)
+
+    def set_status(self, order, status: OrderStatus):
+        row = self._row(order)
+        if row is not None:
+            self._finalize(np.array([row]), status)
+        order.OrderStatus = status
+
+    def set_size(self, order, size: float):
+        row = self._row(order)
+        if row is not None:
+            self._book['size'][row] = size
+        order.size = size
+
+    def cancel(self, order):
+        self.set_status(order, OrderStatus.Canceled)
+
+    def children(self, parent_id: int) -> List:
+        """The tp/sl orders of `parent_id` still in the book."""
+        book = self._book[:len(self._orders)]
+        return [self._orders[row]
+                for row in np.flatnonzero(self._active_mask(book) & (book['parent'] == parent_id)).tolist()]
+
+    def cancel_children(self, parent_id: int):
+        """Cancel the remaining tp/sl orders once one of them filled."""
+        book = self._book[:len(self._orders)]
+        self._finalize(np.flatnonzero(self._active_mask(book) & (book['parent'] == parent_id)),
+                       OrderStatus.Canceled)
+
+    def cancel_reduce_only(self, side: Side):
+        """Cancel reduce-only orders of `side` once the position they reduce is flat."""
+        book = self._book[:len(self._orders)]
+        self._finalize(np.flatnonzero(self._active_mask(book) & book['reduce_only'] &
+                                      (book['side'] == side.value)),
+                       OrderStatus.Canceled)
+
+    def post(self):
+        """
+        End of bar: orders left unfilled rest in the book, finalized
+        orders are dropped once they make up most of it.
+        """
+        n = len(self._orders)
+        book = self._book[:n]
+        status = book['status'][self._n_posted:]
+        for row in (np.flatnonzero(status == _NEW) + self._n_posted).tolist():
+            self._orders[row].OrderStatus = OrderStatus.Created
+        status[status == _NEW] = _CREATED
+        if n - self._n_active > max(self._n_active, 32):
+            active = self._active_mask(book)
+            self._n_dropped += np.bincount(book['status'][~active], minlength=len(self._n_dropped))
+            keep = np.flatnonzero(active)
+            self._book[:len(keep)] = book[keep]
+            self._orders = [self._orders[row] for row in keep.tolist()]
+        self._n_posted = len(self._orders)
+
+    @staticmethod
+    def _active_mask(book) -> np.ndarray:
+        status = book['status']
+        return (status == _NEW) | (status == _CREATED)
+
+    def _row(self, order):
+        if order._book is not self:
+            return None
+        n = len(self._orders)
+        row = np.searchsorted(self._book['id'][:n], order.order_id)
+        if row < n and self._book['id'][row] == order.order_id:
+            return row
+        return None
+
+    def _finalize(self, rows: np.ndarray, status: OrderStatus):
+        if not len(rows):
+            return
+        status_column = self._book['status']
+        rows = rows[(status_column[rows] == _NEW) | (status_column[rows] == _CREATED)]
+        status_column[rows] = status.value
+        self._n_active -= len(rows)
+        for row in rows.tolist():
+            self._orders[row].OrderStatus = status
@@ -6,7 +6,20 @@ BTCUSDT = SymbolConfig(
     exchange='binance',
     tick_size=0.00001,
     min_trade_amount=0.00001,
-    max_trade_amount=130)
+    max_trade_amount=130,
+    # Binance USDⓈ-M BTCUSDT perpetual
+    maintenance_tiers=(
+        (50_000, .004, 0),
+        (250_000, .005, 50),
+        (3_000_000, .01, 1_300),
+        (15_000_000, .025, 46_300),
+        (30_000_000, .05, 421_300),
+        (80_000_000, .1, 1_921_300),
+        (100_000_000, .125, 3_921_300),
+        (200_000_000, .15, 6_421_300),
+        (300_000_000, .25, 26_421_300),
+        (500_000_000, .5, 101_421_300),
+    ))
 
 symbol_config_map = {
     'BTC-USDT': BTCUSDT
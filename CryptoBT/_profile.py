@@ -0,0 +1,145 @@
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from .idl import OrderStatus
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _rss_mb() -> float:
+    """Current resident set size, or the peak one where that's all there is."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except (OSError, AttributeError):
+        if resource is None:
+            return np.nan
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+class Profile:
+    """
+    Instrumentation of one `Backtest.run(profile=True)`, returned as its
+    `_profile` result.
+
+    `phases` holds the wall time in seconds of every phase of the run,
+    `bar_latency` the time each bar spent in fills plus `Strategy.next()`,
+    `counters` the number of bars, orders, fills, rejections and trades,
+    and `memory` RSS (and `tracemalloc` usage, if tracing) snapshots.
+    """
+    def __init__(self, phases: pd.Series, bar_latency: np.ndarray, counters: Dict[str, int],
+                 memory: pd.DataFrame):
+        self.phases = phases
+        self.bar_latency = bar_latency
+        self.counters = counters
+        self.memory = memory
+
+    def histogram(self, bins=None) -> pd.Series:
+        """Bar count by latency, in log-spaced buckets from 1 µs to 1 s by default."""
+        if bins is None:
+            bins = np.logspace(-6, 0, 13)
+        counts, edges = np.histogram(self.bar_latency, bins=bins)
+        index = pd.IntervalIndex.from_breaks(pd.to_timedelta(edges, unit='s'), closed='left')
+        return pd.Series(counts, index=index, name='Bars')
+
+    def __repr__(self):
+        latency = self.bar_latency
+        quantiles = np.percentile(latency, [50, 99]) * 1e6 if len(latency) else (np.nan, np.nan)
+        return (f'<Profile {self.phases["total"]:.3f}s, '
+                f'bar latency p50 {quantiles[0]:.1f}µs p99 {quantiles[1]:.1f}µs, {self.counters}>')
+
+
+class _Profiler:
+    """
+    Wraps the hot methods of one run's engine and strategy. Only set up
+    with `profile=True`, so unprofiled runs keep their plain method calls.
+    """
+    # Memory is also snapshot about this many times over the bar loop
+    N_LOOP_SNAPSHOTS = 20
+
+    def __init__(self, n_bars: int):
+        self._n_bars = n_bars
+        self._start = self._last = time.perf_counter()
+        self._phases: Dict[str, float] = {}
+        self._bar_start = np.zeros(n_bars)
+        self._bar_latency = np.zeros(n_bars)
+        self._indicator_time = self._execution_time = self._next_time = 0.
+        self._memory: List[Dict] = []
+        self._snapshot_every = max(n_bars // self.N_LOOP_SNAPSHOTS, 1)
+
+    def _snapshot(self, label: str):
+        row = {'at': label, 'rss_mb': _rss_mb()}
+        if tracemalloc.is_tracing():
+            row['traced_mb'], row['traced_peak_mb'] = (x / 2**20 for x in tracemalloc.get_traced_memory())
+        self._memory.append(row)
+
+    def mark(self, phase: str):
+        """End `phase`, which started at the previous mark."""
+        now = time.perf_counter()
+        self._phases[phase] = now - self._last
+        self._last = now
+        self._snapshot(phase)
+
+    def instrument(self, strategy, trading_engine):
+        perf_counter = time.perf_counter
+        bar_start, bar_latency = self._bar_start, self._bar_latency
+        indicator, handle_execution, next_ = strategy.I, trading_engine.handle_execution, strategy.next
+        snapshot_every = self._snapshot_every
+
+        def timed_indicator(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return indicator(*args, **kwargs)
+            finally:
+                self._indicator_time += perf_counter() - start
+
+        def timed_handle_execution(*args, **kwargs):
+            i = len(trading_engine.data) - 1
+            start = bar_start[i] = perf_counter()
+            handle_execution(*args, **kwargs)
+            self._execution_time += perf_counter() - start
+
+        def timed_next():
+            i = len(trading_engine.data) - 1
+            start = perf_counter()
+            next_()
+            end = perf_counter()
+            self._next_time += end - start
+            bar_latency[i] = end - bar_start[i]
+            if not i % snapshot_every:
+                self._snapshot(f'bar {i}')
+
+        strategy.I = timed_indicator
+        trading_engine.handle_execution = timed_handle_execution
+        strategy.next = timed_next
+
+    def result(self, trading_engine) -> Profile:
+        phases = self._phases
+        loop = phases.pop('loop', 0.)
+        init = phases.pop('init', 0.)
+        ordered = {
+            'setup': phases.pop('setup', 0.),
+            'init': init - self._indicator_time,
+            'Strategy.I': self._indicator_time,
+            'handle_execution': self._execution_time,
+            'next': self._next_time,
+            'loop overhead': loop - self._execution_time - self._next_time,
+            **phases,
+        }
+        ordered['total'] = self._last - self._start
+        # Fills and rejections are told by the orders' final statuses, whichever engine matched them
+        statuses = trading_engine.order_book.status_counts()
+        counters = {'bars': self._n_bars, 'orders': trading_engine.order_book._next_id,
+                    'fills': statuses[OrderStatus.TakerFill] + statuses[OrderStatus.MakerFill],
+                    'rejections': statuses[OrderStatus.Rejected], 'trades': len(trading_engine.trades)}
+        return Profile(pd.Series(ordered, name='Seconds'), self._bar_latency, counters,
+                       pd.DataFrame(self._memory).set_index('at'))
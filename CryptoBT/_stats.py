@@ -1,6 +1,290 @@
 import numpy as np
 import pandas as pd
-from typing import List
+from typing import Callable, Dict, List, Union
 
-def get_backtesting_results(data: pd.DataFrame, trades: List, equity)->pd.Series:
-    pass
\ No newline at end of file
+_TRADE_COLUMNS = ('entry_time', 'exit_time', 'side', 'size', 'entry_price', 'exit_price', 'fees', 'funding')
+
+
+def _trades_to_columns(trades: Union[List, Dict[str, np.ndarray]], last_i: int, last_price: float
+                       ) -> Dict[str, np.ndarray]:
+    """
+    Turn a list of `Trade` objects (or an already columnar mapping) into
+    one array per field; still open trades are valued at the last close.
+    """
+    if isinstance(trades, dict):
+        columns = {key: np.asarray(trades[key]) for key in _TRADE_COLUMNS}
+    else:
+        rows = [(trade.entry_time,
+                 last_i if trade.exit_time is None else trade.exit_time,
+                 1 if trade.side.value == 1 else -1,
+                 trade.size,
+                 trade.entry_price,
+                 last_price if trade.exit_time is None else trade.exit_price,
+                 trade.fees,
+                 trade.funding)
+                for trade in trades]
+        values = np.array(rows, dtype=float).reshape(-1, len(_TRADE_COLUMNS))
+        columns = dict(zip(_TRADE_COLUMNS, values.T))
+    columns['entry_time'] = columns['entry_time'].astype(np.int64)
+    columns['exit_time'] = columns['exit_time'].astype(np.int64)
+    columns['side'] = columns['side'].astype(np.int8)
+    return columns
+
+
+def _as_datetime_index(index: pd.Index) -> pd.Index:
+    if isinstance(index, pd.DatetimeIndex):
+        return index
+    # Binance exports index bars by millisecond epoch timestamps
+    if np.issubdtype(index.dtype, np.integer) and len(index) and index[0] > 1e11:
+        return pd.DatetimeIndex(np.asarray(index).astype('datetime64[ms]'))
+    return index
+
+
+def _bar_span(index: pd.Index) -> pd.Timedelta:
+    """Median spacing of bars on a time index, 0 if they aren't on one."""
+    index = _as_datetime_index(index)
+    if isinstance(index, pd.DatetimeIndex) and len(index) > 1:
+        return pd.Timedelta(np.median(np.diff(index.asi8)), 'ns')
+    return pd.Timedelta(0)
+
+
+def _periods_per_year(bar_span: pd.Timedelta) -> float:
+    # Crypto trades around the clock, so a year has 365 days of bars
+    return pd.Timedelta(days=365) / bar_span if bar_span else 365
+
+
+def _covered_bars(entry_time: np.ndarray, exit_time: np.ndarray, n: int) -> int:
+    """How many of `n` bars lie within any of the `[entry, exit]` bar spans."""
+    if not len(entry_time):
+        return 0
+    order = np.argsort(entry_time, kind='stable')
+    entry, exit = entry_time[order], np.minimum(exit_time[order], n - 1)
+    # Spans sorted by entry overlap the ones before only up to the furthest exit of those
+    covered_until = np.maximum.accumulate(np.append(-1, exit[:-1]))
+    return int(np.maximum(exit - np.maximum(entry - 1, covered_until), 0).sum())
+
+
+class _EquityStats:
+    """
+    Statistics of an equity curve fed to `update()` a stretch of bars at
+    a time, so that it needn't be held whole: only every `every`-th bar
+    of it (and the last) is kept for the results' `_equity_curve`.
+    """
+    def __init__(self, every: int = 1):
+        self.every = every
+        self.n = 0
+        self._start = self._end = None
+        self._is_datetime = False
+        # Bar spacings on a time index, counted by value for their median
+        self._spacings: Dict[int, int] = {}
+        self._last_time = None
+        self._first_close = self._last_close = np.nan
+        self._first_equity = self._last_equity = np.nan
+        self._peak = -np.inf
+        self._max_dd = 0.
+        # Bar returns: count, mean and sum of squared deviations, merged stretch by stretch
+        self._n_returns, self._mean_return, self._m2_return = 0, 0., 0.
+        self._downside = 0.
+        # Drawdowns: the last bar at a peak, the deepest drawdown since, and the ones ended before
+        self._last_peak = None
+        self._tail_dd = None
+        self._n_dd, self._sum_dd, self._max_dd_duration, self._sum_dd_duration = 0, 0., 0, 0
+        # (index, equity, drawdown) of the kept bars of each stretch, and of the last bar
+        self._curve: List[tuple] = []
+        self._last_bar = None
+
+    def update(self, index: pd.Index, close: np.ndarray, equity: np.ndarray):
+        """Add the next bars, with their `index`, `close` prices and `equity`."""
+        equity = np.asarray(equity, dtype=float)
+        m = len(equity)
+        if not m:
+            return
+        first_bar = self.n
+        times = _as_datetime_index(index)
+        if not first_bar:
+            self._start = times[0]
+            self._is_datetime = isinstance(times, pd.DatetimeIndex)
+            self._first_close, self._first_equity = close[0], equity[0]
+        self._end = times[-1]
+
+        if self._is_datetime:
+            t = times.asi8
+            spacings = np.diff(t if self._last_time is None else np.append(self._last_time, t))
+            for value, count in zip(*np.unique(spacings, return_counts=True)):
+                self._spacings[value] = self._spacings.get(value, 0) + int(count)
+            self._last_time = t[-1]
+
+        with np.errstate(divide='ignore', invalid='ignore'):  # A liquidated account has no equity left
+            previous = equity if not first_bar else np.append(self._last_equity, equity)
+            returns = np.diff(previous) / previous[:-1]
+            if len(returns):
+                k, mean = len(returns), returns.mean()
+                m2 = ((returns - mean) ** 2).sum()
+                if self._n_returns:
+                    delta, total = mean - self._mean_return, self._n_returns + k
+                    self._mean_return += delta * k / total
+                    self._m2_return += m2 + delta ** 2 * self._n_returns * k / total
+                else:
+                    self._mean_return, self._m2_return = mean, m2
+                self._n_returns += k
+                self._downside += (np.minimum(returns, 0) ** 2).sum()
+
+        peak = np.maximum.accumulate(np.append(self._peak, equity))[1:]
+        dd = 1 - equity / peak
+        self._peak = peak[-1]
+        self._max_dd = np.maximum(self._max_dd, dd.max())
+        self._add_drawdowns(first_bar, dd)
+
+        start = -first_bar % self.every
+        self._curve.append((index[start::self.every], equity[start::self.every], dd[start::self.every]))
+        self._last_bar = (index[-1:], equity[-1:], dd[-1:])
+        self.n += m
+        self._last_close, self._last_equity = close[-1], equity[-1]
+
+    def _add_drawdowns(self, first_bar: int, dd: np.ndarray):
+        # Drawdowns run from a bar at its peak (`dd == 0`) to the next one; the bars of the
+        # one still open before this stretch stand in as its peak bar and its deepest bar
+        bars = np.arange(first_bar, first_bar + len(dd))
+        if self._last_peak is not None:
+            head = [(self._last_peak, 0.)]
+            if self._tail_dd is not None:
+                head.append((first_bar - 1, self._tail_dd))
+            head_bars, head_dd = zip(*head)
+            bars, dd = np.append(head_bars, bars), np.append(head_dd, dd)
+        at_peak = np.flatnonzero(dd == 0)
+        if not len(at_peak):
+            return
+        starts = np.flatnonzero(np.diff(np.append(at_peak, len(dd))) > 1)
+        ended = starts[starts < len(at_peak) - 1]
+        if len(ended):
+            depths = np.maximum.reduceat(dd, at_peak[starts])[:len(ended)]
+            durations = bars[at_peak[ended + 1]] - bars[at_peak[ended]]
+            self._n_dd += len(ended)
+            self._sum_dd += depths.sum()
+            self._max_dd_duration = max(self._max_dd_duration, int(durations.max()))
+            self._sum_dd_duration += int(durations.sum())
+        last = at_peak[-1]
+        self._last_peak = int(bars[last])
+        self._tail_dd = dd[last + 1:].max() if last + 1 < len(dd) else None
+
+    def _bar_span(self) -> pd.Timedelta:
+        """As `_bar_span()` of the whole index."""
+        if not self._spacings:
+            return pd.Timedelta(0)
+        values = np.array(sorted(self._spacings))
+        cumulative = np.cumsum([self._spacings[value] for value in values])
+        total = cumulative[-1]
+        lower, upper = values[np.searchsorted(cumulative, [(total - 1) // 2 + 1, total // 2 + 1])]
+        return pd.Timedelta((lower + upper) / 2, 'ns')
+
+    def results(self, trades: Union[List, Dict[str, np.ndarray]],
+                trade_times: Callable[[np.ndarray], pd.Index]) -> pd.Series:
+        """Results of a run with `trades`, `trade_times` giving the index values of bars they span."""
+        n = self.n
+        is_datetime = self._is_datetime
+
+        def duration(bars):
+            # Bars span `index` spacing when it is a time index, else they stay bar counts
+            bars = np.asarray(bars)
+            if is_datetime:
+                return pd.to_timedelta(bars * bar_span)
+            return bars
+
+        bar_span = self._bar_span()
+
+        # Drawdowns, the one still open included
+        n_dd, sum_dd = self._n_dd, self._sum_dd
+        max_dd_duration, sum_dd_duration = self._max_dd_duration, self._sum_dd_duration
+        if self._last_peak is not None and self._last_peak < n - 1:
+            n_dd, sum_dd = n_dd + 1, sum_dd + self._tail_dd
+            max_dd_duration = max(max_dd_duration, n - 1 - self._last_peak)
+            sum_dd_duration += n - 1 - self._last_peak
+
+        # Trades
+        columns = _trades_to_columns(trades, n - 1, self._last_close)
+        side, size = columns['side'], columns['size']
+        entry_price, exit_price = columns['entry_price'], columns['exit_price']
+        entry_time, exit_time = columns['entry_time'], columns['exit_time']
+        fees, funding = columns['fees'], columns['funding']
+        # Net of fees and funding, so trade stats add up to the equity curve
+        pnl = side * (exit_price - entry_price) * size - fees - funding
+        returns = pnl / (entry_price * size)
+        trade_durations = exit_time - entry_time
+        n_trades = len(pnl)
+
+        first_equity, last_equity = self._first_equity, self._last_equity
+        s = {}
+        s['Start'] = self._start
+        s['End'] = self._end
+        s['Duration'] = s['End'] - s['Start']
+        s['Exposure Time [%]'] = _covered_bars(entry_time, exit_time, n) / n * 100
+        s['Equity Final [$]'] = last_equity
+        s['Equity Peak [$]'] = self._peak
+        s['Return [%]'] = (last_equity - first_equity) / first_equity * 100
+        s['Buy & Hold Return [%]'] = (self._last_close - self._first_close) / self._first_close * 100
+
+        periods_per_year = _periods_per_year(bar_span)
+        k = self._n_returns
+        mean_return = self._mean_return if k else 0.
+        total_return = last_equity / first_equity
+        annual_return = total_return ** (periods_per_year / max(n - 1, 1)) - 1
+        volatility = np.sqrt(self._m2_return / (k - 1)) * np.sqrt(periods_per_year) if k > 1 else np.nan
+        downside = np.sqrt(self._downside / k if k else 0.) * np.sqrt(periods_per_year)
+        max_dd = self._max_dd
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s['Return (Ann.) [%]'] = annual_return * 100
+            s['Volatility (Ann.) [%]'] = volatility * 100
+            s['Sharpe Ratio'] = mean_return * periods_per_year / volatility
+            s['Sortino Ratio'] = mean_return * periods_per_year / downside
+            s['Calmar Ratio'] = annual_return / max_dd if max_dd else np.nan
+        s['Max. Drawdown [%]'] = -max_dd * 100
+        s['Avg. Drawdown [%]'] = -sum_dd / n_dd * 100 if n_dd else 0.
+        s['Max. Drawdown Duration'] = duration(max_dd_duration) if n_dd else np.nan
+        s['Avg. Drawdown Duration'] = duration(np.round(sum_dd_duration / n_dd)) if n_dd else np.nan
+        s['# Trades'] = n_trades
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s['Win Rate [%]'] = (pnl > 0).mean() * 100 if n_trades else np.nan
+            s['Best Trade [%]'] = returns.max() * 100 if n_trades else np.nan
+            s['Worst Trade [%]'] = returns.min() * 100 if n_trades else np.nan
+            # Leveraged trades can lose more than their notional; the mean then bottoms out at -100%
+            s['Avg. Trade [%]'] = (np.exp(np.log1p(np.maximum(returns, -1)).mean()) - 1) * 100 if n_trades else np.nan
+            s['Max. Trade Duration'] = duration(trade_durations.max()) if n_trades else np.nan
+            s['Avg. Trade Duration'] = duration(np.round(trade_durations.mean())) if n_trades else np.nan
+            s['Profit Factor'] = pnl[pnl > 0].sum() / -pnl[pnl < 0].sum() if n_trades else np.nan
+            s['Expectancy [%]'] = returns.mean() * 100 if n_trades else np.nan
+            s['SQN'] = np.sqrt(n_trades) * pnl.mean() / pnl.std(ddof=1) if n_trades > 1 else np.nan
+
+        curve = self._curve + ([self._last_bar] if (n - 1) % self.every else [])
+        indexes, equities, drawdowns = zip(*curve)
+        index = indexes[0].append(list(indexes[1:])) if len(indexes) > 1 else indexes[0]
+        s['_equity_curve'] = pd.DataFrame({'Equity': np.concatenate(equities),
+                                           'DrawdownPct': np.concatenate(drawdowns)}, index=index)
+        s['_trades'] = pd.DataFrame({
+            'Size': size,
+            'Side': side,
+            'EntryBar': entry_time,
+            'ExitBar': exit_time,
+            'EntryPrice': entry_price,
+            'ExitPrice': exit_price,
+            'Fees': fees,
+            'Funding': funding,
+            'PnL': pnl,
+            'ReturnPct': returns,
+            'EntryTime': trade_times(entry_time) if n_trades else [],
+            'ExitTime': trade_times(exit_time) if n_trades else [],
+            'Duration': duration(trade_durations),
+        })
+
+        # Filled one by one so NumPy doesn't try to unpack the DataFrames
+        values = np.empty(len(s), dtype=object)
+        for i, value in enumerate(s.values()):
+            values[i] = value
+        return pd.Series(values, index=list(s.keys()))
+
+
+def get_backtesting_results(data: pd.DataFrame, trades: List, equity) -> pd.Series:
+    equity = np.asarray(equity, dtype=float)
+    n = len(equity)
+    stats = _EquityStats()
+    stats.update(data.index[:n], data['Close'].to_numpy(dtype=float)[:n], equity)
+    return stats.results(trades, lambda bars: data.index[bars])
@@ -1,8 +1,12 @@
-from typing import Dict, List, Optional, Sequence, Union, cast
+import warnings
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Sequence, Tuple, Union, cast
 
 import numpy as np
 from numbers import Number
 import pandas as pd
+
+
 def try_(lazy_func, default=None, exception=Exception):
     try:
         return lazy_func()
@@ -98,6 +102,7 @@ class _Data:
         self.__pip: Optional[float] = None
         self.__cache: Dict[str, _Array] = {}
         self.__arrays: Dict[str, _Array] = {}
+        self.__timeframes: Dict[int, '_TimeframeData'] = {}
         self._update()
 
     def __getitem__(self, item):
@@ -112,6 +117,23 @@ class _Data:
     def _set_length(self, i):
         self.__i = i
         self.__cache.clear()
+        for timeframe in self.__timeframes.values():
+            timeframe._set_length(i)
+
+    def tf(self, rule: str) -> '_TimeframeData':
+        """
+        The data resampled to a higher timeframe, e.g. `data.tf('1h').Close`,
+        with bars aligned to (and advancing with) these bars: each bar
+        holds the latest higher timeframe bar completed by its close, so
+        `Strategy.next()` never sees a bar still forming. Built once per
+        `rule`, on first use.
+        """
+        period = pd.Timedelta(rule).value
+        timeframe = self.__timeframes.get(period)
+        if timeframe is None:
+            timeframe = self.__timeframes[period] = _TimeframeData(self.__df, period)
+            timeframe._set_length(self.__i)
+        return timeframe
 
     def _update(self):
         index = self.__df.index.copy()
@@ -119,6 +141,8 @@ class _Data:
                          for col, arr in self.__df.items()}
         # Leave index as Series because pd.Timestamp nicer API to work with
         self.__arrays['__index'] = index
+        # Resampled again from the changed data on next use
+        self.__timeframes.clear()
 
     def __repr__(self):
         i = min(self.__i, len(self.__df)) - 1
@@ -178,3 +202,115 @@ class _Data:
 
     def __setstate__(self, state):
         self.__dict__ = state
+
+
+def _index_ns(index: pd.Index) -> np.ndarray:
+    """Bar open times as nanoseconds since the epoch."""
+    if isinstance(index, pd.DatetimeIndex):
+        return index.asi8
+    values = np.asarray(index)
+    # Binance exports index bars by millisecond epoch timestamps
+    if np.issubdtype(values.dtype, np.integer) and len(values) and values[0] > 1e11:
+        return values.astype(np.int64) * 1_000_000
+    raise ValueError('Higher timeframes need a DatetimeIndex or millisecond timestamps as the data index')
+
+
+class _TimeframeData(_Data):
+    """
+    Higher timeframe view of some data, see `_Data.tf()`. Its columns are
+    aligned to the base bars; `bars` holds the resampled bars themselves,
+    one per period (the last one possibly still forming), and `align()`
+    maps values computed on them, e.g. indicators, to the base bars.
+    """
+    def __init__(self, df: pd.DataFrame, period: int):
+        times = _index_ns(df.index)
+        n = len(times)
+        base_period = int(np.median(np.diff(times))) if n > 1 else period
+        if period < base_period:
+            raise ValueError(f'Timeframe of {pd.Timedelta(period)} is shorter than the data '
+                             f'bars of {pd.Timedelta(base_period)}')
+
+        # Periods are aligned to the epoch, like exchange candles
+        bucket = times // period
+        starts = np.flatnonzero(np.concatenate(([True], bucket[1:] != bucket[:-1]))) if n else np.array([], int)
+        ends = np.append(starts[1:], n) - 1
+        columns = {}
+        for column, aggregate in (('Open', None), ('High', np.maximum), ('Low', np.minimum),
+                                  ('Close', None), ('Volume', np.add)):
+            if column not in df:
+                continue
+            values = df[column].to_numpy(dtype=float)
+            columns[column] = (values[starts] if column == 'Open' else values[ends] if column == 'Close' else
+                               aggregate.reduceat(values, starts) if n else values[:0])
+        open_times = bucket[starts] * period
+        if isinstance(df.index, pd.DatetimeIndex):
+            bars_index = pd.DatetimeIndex(open_times, tz='UTC' if df.index.tz is not None else None)
+            if df.index.tz is not None:
+                bars_index = bars_index.tz_convert(df.index.tz)
+        else:
+            bars_index = pd.Index(open_times // 1_000_000)
+        self.bars = pd.DataFrame(columns, index=bars_index.rename(df.index.name))
+
+        # A period is complete at the close of its last bar if that reaches the period's end,
+        # else (a gap at its end) on the first bar of the next period
+        complete = times[ends] + base_period >= (bucket[ends] + 1) * period
+        completed_at = np.where(complete, ends, ends + 1)
+        # Position of the latest completed period on every base bar, -1 before the first
+        positions = np.full(n, -1, dtype=np.int64)
+        in_range = completed_at < n
+        np.maximum.at(positions, completed_at[in_range], np.flatnonzero(in_range))
+        self._positions = np.maximum.accumulate(positions) if n else positions
+
+        super().__init__(pd.DataFrame({column: self.align(values) for column, values in columns.items()},
+                                      index=df.index))
+
+    def align(self, values) -> np.ndarray:
+        """Map per-period `values` (on the last dimension) to the base bars, NaN before the first period."""
+        values = np.asarray(values, dtype=float)
+        if values.shape[-1] != len(self.bars):
+            raise ValueError(f'Expected values for {len(self.bars)} bars, got {values.shape[-1]}')
+        aligned = values[..., np.maximum(self._positions, 0)]
+        aligned[..., self._positions < 0] = np.nan
+        return aligned
+
+
+def _df_to_shm(df: pd.DataFrame) -> Tuple[SharedMemory, dict]:
+    """
+    Copy the numeric columns and the index of `df` into one shared memory
+    block, so worker processes can map the data instead of unpickling it.
+    Returns the block and the metadata `_df_from_shm()` needs to rebuild it.
+    """
+    numeric = [col for col, dtype in df.dtypes.items() if np.issubdtype(dtype, np.number)]
+    index = df.index
+    index_values = np.asarray(index.asi8 if isinstance(index, pd.DatetimeIndex) else index.values)
+    if not np.issubdtype(index_values.dtype, np.number):
+        raise ValueError('Data index must be numeric or a DatetimeIndex to be shared between processes')
+
+    n = len(df)
+    values = df[numeric].to_numpy(dtype=float)
+    shm = SharedMemory(create=True, size=max(1, values.nbytes + n * 8))
+    np.ndarray(values.shape, dtype=float, buffer=shm.buf)[:] = values
+    np.ndarray(n, dtype=index_values.dtype, buffer=shm.buf, offset=values.nbytes)[:] = index_values
+    meta = dict(shape=values.shape, columns=numeric,
+                index_dtype=index_values.dtype, index_name=index.name,
+                index_tz=getattr(index, 'tz', None), is_datetime=isinstance(index, pd.DatetimeIndex),
+                # Non-numeric columns (e.g. a `Date` string column) are small enough to pickle
+                other=df[[col for col in df.columns if col not in numeric]].reset_index(drop=True))
+    return shm, meta
+
+
+def _df_from_shm(shm: SharedMemory, meta: dict) -> pd.DataFrame:
+    """Rebuild a DataFrame over the arrays in `shm` without copying them."""
+    shape = meta['shape']
+    values = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    index = np.ndarray(shape[0], dtype=meta['index_dtype'], buffer=shm.buf, offset=values.nbytes)
+    if meta['is_datetime']:
+        index = pd.DatetimeIndex(index.view('datetime64[ns]'), name=meta['index_name'])
+        if meta['index_tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(meta['index_tz'])
+    else:
+        index = pd.Index(index, name=meta['index_name'])
+    df = pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+    for col in meta['other'].columns:
+        df[col] = meta['other'][col].values
+    return df
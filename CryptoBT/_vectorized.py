@@ -0,0 +1,144 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .dto import SymbolConfig
+
+
+def _as_signal(signal, n: int) -> np.ndarray:
+    if signal is None:
+        return np.zeros(n, dtype=bool)
+    signal = np.asarray(signal)
+    if signal.shape != (n,):
+        raise ValueError(f'Signals must be 1d arrays of same length as `data` ({n}), got shape {signal.shape}')
+    return signal.astype(bool)
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """Forward-fill NaNs without a Python loop; leading NaNs become 0."""
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    values = values[idx]
+    values[np.isnan(values)] = 0
+    return values
+
+
+def _target_direction(entries, exits, short_entries, short_exits) -> np.ndarray:
+    """Per bar target position direction (1 long, -1 short, 0 flat) after the bar's signals."""
+    n = len(entries)
+    both = entries & short_entries
+    entries, short_entries = entries & ~both, short_entries & ~both
+
+    direction = np.full(n, np.nan)
+    direction[entries] = 1
+    direction[short_entries] = -1
+    # Exits only apply to the side of the latest entry, and lose to a same-bar entry
+    last_entry = _ffill(direction.copy())
+    exits = ~(entries | short_entries) & ((exits & (last_entry == 1)) | (short_exits & (last_entry == -1)))
+    direction[exits] = 0
+    return _ffill(direction)
+
+
+def run_signals(open_: np.ndarray, close: np.ndarray, *,
+                entries, exits=None, short_entries=None, short_exits=None,
+                size=None,
+                balance: float,
+                fee_rate: float,
+                symbol_config: SymbolConfig) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Backtest boolean entry/exit signals with market orders.
+
+    Signals observed on the close of bar `i` are filled at the open of bar
+    `i + 1`, like market orders placed in `Strategy.next()`. Positions still
+    open at the end are settled at the last close. With `size=None` every
+    entry uses all available cash, otherwise `size` (scalar or per-bar array,
+    read on the signal bar) is the order size.
+
+    Returns the per-bar equity curve and columnar trades.
+    """
+    open_, close = np.asarray(open_, dtype=float), np.asarray(close, dtype=float)
+    n = len(close)
+    direction = _target_direction(*(_as_signal(signal, n)
+                                    for signal in (entries, exits, short_entries, short_exits)))
+
+    # Direction held during each bar, i.e. after the fills at its open
+    position = np.empty(n)
+    position[0] = 0
+    position[1:] = direction[:-1]
+    prev_position = np.empty(n)
+    prev_position[0] = 0
+    prev_position[1:] = position[:-1]
+    changes = np.flatnonzero(position != prev_position)
+    new_dir, old_dir = position[changes], prev_position[changes]
+    price = open_[changes]
+
+    if size is not None:
+        size = np.broadcast_to(np.asarray(size, dtype=float), (n,))
+        size = symbol_config.round_size(size[np.maximum(changes - 1, 0)])
+    cash, new_size = _fills(price, new_dir, old_dir, size, balance, fee_rate, symbol_config)
+    new_dir = np.where(new_size > 0, new_dir, 0)
+
+    # Mark to market every bar from the state after its latest fill
+    last_change = np.full(n, -1)
+    last_change[changes] = np.arange(len(changes))
+    np.maximum.accumulate(last_change, out=last_change)
+    started = last_change >= 0
+    k = last_change[started]
+    long_size = np.where(new_dir[k] == 1, new_size[k], 0.)
+    short_size = np.where(new_dir[k] == -1, new_size[k], 0.)
+    equity = np.full(n, float(balance))
+    equity[started] = (cash[k] + long_size * close[started] +
+                       short_size * (2 * price[k] - close[started]))
+
+    # Every opened position is closed at the next change, or settled at the last close
+    opened = np.flatnonzero(new_dir != 0)
+    exit_time = np.append(changes[1:], n - 1)[opened]
+    closed = opened + 1 < len(changes)
+    exit_price = np.where(closed, open_[exit_time], close[-1])
+    # Settling at the last close costs no fee
+    fees = new_size[opened] * price[opened] * fee_rate + np.where(closed, new_size[opened] * exit_price * fee_rate, 0)
+    trades = {
+        'entry_time': changes[opened],
+        'exit_time': exit_time,
+        'side': new_dir[opened].astype(np.int8),
+        'size': new_size[opened],
+        'entry_price': price[opened],
+        'exit_price': exit_price,
+        'fees': fees,
+        'funding': np.zeros(len(opened)),
+    }
+    return equity, trades
+
+
+def _fills(price, new_dir, old_dir, size, balance, fee_rate, symbol_config) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Whether an entry is affordable, and all-in sizes (`size=None`),
+    depend on the cash left by the previous trade, so this recurrence
+    runs once per fill (not per bar), in the same order of operations
+    as `_TradingEngine._fill`: entries costing more than the cash are
+    rejected.
+    """
+    cash = np.empty(len(price))
+    new_size = np.zeros(len(price))
+    sizes = size.tolist() if size is not None else [None] * len(price)
+    balance, held, entry = float(balance), 0., 0.
+    for k, (fill_price, new, old, order_size) in enumerate(zip(price.tolist(), new_dir.tolist(), old_dir.tolist(),
+                                                               sizes)):
+        if old and held > 0:
+            margin = held * entry
+            pnl = (fill_price - entry) * held if old == 1 else (entry - fill_price) * held
+            balance += margin + pnl
+            balance -= held * fill_price * fee_rate
+        held = 0.
+        if new:
+            held = (float(symbol_config.round_size(balance / (fill_price * (1 + fee_rate))))
+                    if order_size is None else order_size)
+            if held > 0 and held * fill_price * (1 + fee_rate) <= balance:
+                balance -= held * fill_price
+                balance -= held * fill_price * fee_rate
+                entry = fill_price
+            else:
+                held = 0.
+        cash[k] = balance
+        new_size[k] = held
+    return cash, new_size
@@ -0,0 +1,227 @@
+"""
+Memoization of `Strategy.I` indicators.
+
+An indicator is keyed by its function (module, name and bytecode, along
+with the module globals and helper functions it reads), its arguments
+and a fingerprint of the arrays among them, so optimization
+sweeps and repeated runs reuse e.g. `lib.sma(Close, 10)` instead of
+recomputing it. Results are kept in an in-memory LRU tier bounded by
+`max_bytes`, and, given a `path`, in an on-disk tier of `.npy` files
+shared across processes and sessions.
+
+Functions whose output can't be keyed reliably (closures, bound methods,
+globals or arguments other than arrays, Series, numbers and strings)
+are never cached. Arrays are hashed whole, along with the index of
+Series and data columns, so keys only match for the same values on the
+same bars. Cached arrays are private and read-only; strategies get
+copies of them.
+"""
+import hashlib
+import inspect
+import os
+import tempfile
+from collections import OrderedDict
+from numbers import Number
+from types import CodeType, ModuleType
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from ._util import _Array
+
+
+def _code_digest(code: CodeType, h, names: set):
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            _code_digest(const, h, names)  # Nested functions' reprs hold their memory address
+        else:
+            h.update(repr(const).encode())
+
+
+def _globals_digest(func: Callable, names: set, h, seen: set) -> bool:
+    """Feed the module globals among `names` that `func` reads into `h`; False if one can't be keyed."""
+    namespace = func.__globals__
+    for name in sorted(names):
+        if name not in namespace:
+            continue  # Attribute, builtin or unbound name
+        value = namespace[name]
+        h.update(f'{name}='.encode())
+        if isinstance(value, ModuleType):
+            h.update(f'<module {value.__name__}>;'.encode())
+        elif isinstance(value, type):
+            h.update(f'<class {value.__module__}.{value.__qualname__}>;'.encode())
+        elif callable(value):
+            key = _func_key(value, seen)
+            if key is None:
+                return False
+            h.update(f'{key};'.encode())
+        elif not _hash_arg(value, h):
+            return False
+    return True
+
+
+def _func_key(func: Callable, seen: Optional[set] = None) -> Optional[str]:
+    if inspect.ismethod(func):
+        return None
+    func = getattr(func, 'py_func', func)  # Numba dispatchers
+    code = getattr(func, '__code__', None)
+    if code is not None:
+        if func.__closure__:
+            return None
+        name = f'{func.__module__}.{func.__qualname__}'
+        seen = set() if seen is None else seen
+        if code in seen:
+            return name  # Recursive helper, already being hashed
+        seen.add(code)
+        h = hashlib.blake2b(digest_size=16)
+        names = set()
+        _code_digest(code, h, names)
+        h.update(repr((func.__defaults__, func.__kwdefaults__)).encode())
+        if not _globals_digest(func, names, h, seen):
+            return None
+        return f'{name}:{h.hexdigest()}'
+    # Builtins and ufuncs
+    name = getattr(func, '__qualname__', None) or getattr(func, '__name__', None)
+    if not isinstance(name, str):
+        return None
+    return f'{getattr(func, "__module__", None) or type(func).__module__}.{name}'
+
+
+def _fingerprint(arr: np.ndarray, h):
+    h.update(repr((arr.shape, arr.dtype.str)).encode())
+    h.update(np.ascontiguousarray(arr).data)
+
+
+def _fingerprint_index(index: pd.Index, h):
+    if isinstance(index, pd.RangeIndex):
+        h.update(repr(index).encode())
+        return
+    h.update(str(index.dtype).encode())
+    values = index.asi8 if isinstance(index, pd.DatetimeIndex) else np.asarray(index)
+    if values.dtype == object:
+        # Hashes of the values, as object arrays hold pointers
+        values = pd.util.hash_pandas_object(index, index=False).to_numpy()
+    _fingerprint(values, h)
+
+
+def _hash_arg(arg, h) -> bool:
+    """Feed `arg` into `h`; False if it can't be part of a key."""
+    index = None
+    if isinstance(arg, pd.Series):
+        arg, index = arg.to_numpy(), arg.index
+    elif isinstance(arg, _Array):
+        index = arg._opts.get('index')
+        index = None if index is None else index[:arg.shape[-1] if arg.ndim else 0]
+    if isinstance(arg, np.ndarray):
+        if arg.dtype == object:
+            return False
+        _fingerprint(arg, h)
+        if index is not None:
+            _fingerprint_index(index, h)
+    elif arg is None or isinstance(arg, (str, bool, Number)):
+        h.update(f'{type(arg).__name__}:{arg!r};'.encode())
+    elif isinstance(arg, (tuple, list)):
+        h.update(f'{type(arg).__name__}({len(arg)});'.encode())
+        return all(_hash_arg(item, h) for item in arg)
+    else:
+        return False
+    return True
+
+
+class IndicatorCache:
+    def __init__(self, max_bytes: int = 256 * 2**20, path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.hits = self.misses = 0
+        self._entries: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+        self._n_bytes = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def n_bytes(self) -> int:
+        """Size of the arrays in the in-memory tier."""
+        return self._n_bytes
+
+    def key(self, func: Callable, args: tuple, kwargs: dict) -> Optional[str]:
+        """Key of the indicator `func(*args, **kwargs)`, or None if it can't be cached."""
+        func_key = _func_key(func)
+        if func_key is None:
+            return None
+        h = hashlib.blake2b(func_key.encode(), digest_size=20)
+        if not _hash_arg(args, h) or not _hash_arg(sorted(kwargs.items()), h):
+            return None
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """A writable copy of the array cached under `key`, or None."""
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        elif self.path is not None:
+            try:
+                value = np.load(os.path.join(self.path, f'{key}.npy'), mmap_mode='r')
+            except (OSError, ValueError):
+                pass
+            else:
+                self._remember(key, value)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return np.array(value)
+
+    def put(self, key: str, value: np.ndarray) -> np.ndarray:
+        """Cache a read-only copy of `value` and return `value`."""
+        cached = np.array(value)
+        cached.flags.writeable = False
+        self._remember(key, cached)
+        if self.path is not None:
+            # Written aside and renamed, so concurrent readers never see partial files
+            fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=self.path)
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, cached)
+            os.replace(tmp_path, os.path.join(self.path, f'{key}.npy'))
+        return value
+
+    def clear(self):
+        """Empty the in-memory tier; files on disk are kept."""
+        self._entries.clear()
+        self._n_bytes = 0
+
+    def _remember(self, key: str, value: np.ndarray):
+        if value.nbytes > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._n_bytes -= previous.nbytes
+        self._entries[key] = value
+        self._n_bytes += value.nbytes
+        while self._n_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._n_bytes -= evicted.nbytes
+
+    def __repr__(self):
+        return (f'<IndicatorCache {len(self)} arrays, {self._n_bytes / 2**20:.1f}/{self.max_bytes / 2**20:.0f} MB, '
+                f'hits={self.hits} misses={self.misses}{f", path={self.path!r}" if self.path else ""}>')
+
+
+_indicator_cache: Optional[IndicatorCache] = IndicatorCache()
+
+
+def get_indicator_cache() -> Optional[IndicatorCache]:
+    """The cache used by `Strategy.I`, None if disabled."""
+    return _indicator_cache
+
+
+def set_indicator_cache(cache: Optional[IndicatorCache]):
+    """Make `Strategy.I` use `cache`, e.g. one with an on-disk tier, or pass None to disable caching."""
+    global _indicator_cache
+    _indicator_cache = cache
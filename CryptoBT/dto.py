@@ -1,10 +1,13 @@
-from typing import Optional
+from typing import Optional, Sequence, Tuple
+import numpy as np
 from .idl import SymbolType
 
 
 class SymbolConfig:
     def __init__(self, name: str, exchange: str = "binance", symbol_type: SymbolType = SymbolType.Future,
-                 tick_size: float = 0.00001, min_trade_amount: float = 0.00001, max_trade_amount: float = 130, is_active: bool = True):
+                 tick_size: float = 0.00001, min_trade_amount: float = 0.00001, max_trade_amount: float = 130, is_active: bool = True,
+                 max_leverage: float = 125,
+                 maintenance_tiers: Optional[Sequence[Tuple[float, float, float]]] = None):
         self.is_active = is_active
         self.name = name
         self.exchange = exchange
@@ -13,6 +16,15 @@ class SymbolConfig:
         self.min_order_size = min_trade_amount
         self.max_order_size = max_trade_amount
         self.is_active = is_active
+        self.max_leverage = max_leverage
+        # Rows of (position notional cap, maintenance margin rate, maintenance amount)
+        self.maintenance_tiers = np.asarray(maintenance_tiers or ((np.inf, .004, 0.),), dtype=float)
+
+    def round_size(self, size):
+        """Round order size(s) down to `tick_size`, capped at `max_order_size`."""
+        # Round off float noise first, so that e.g. 32.80079 doesn't floor to 32.80078
+        ticks = np.floor(np.round(np.asarray(size) / self.tick_size, 6))
+        return np.minimum(ticks * self.tick_size, self.max_order_size)
 
     def __str__(self):
         return f"Symbol({self.name}, {self.type})"
@@ -0,0 +1,73 @@
+"""
+Fill models: how the orders a bar triggers are filled.
+
+By default, triggered orders fill in full at the price the bar reaches
+them, limit orders without a stop paying the maker fee and the rest the
+taker fee. A `FillModel` passed to `Backtest(fill_model=...)` instead
+
+- adds slippage against the order to taker fills, a fixed amount plus a
+  fraction of the price, kept within the bar's range,
+- caps the size filled on a bar at a fraction of its `Volume`, leaving
+  the rest of the order to fill on the next bars,
+- makes orders reach the market a number of bars after being placed,
+- charges the maker fee to limit orders resting at their price, and the
+  taker fee to the rest, limit orders the bar opened through included;
+  post-only orders (`exec_type=ExecType.MakerFill`) that would take
+  liquidity expire instead.
+
+Prices, fee sides and expiries of all the orders a bar triggers are
+computed at once, on the order book's columns.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ._orders import _BUY
+
+
+class FillModel:
+    def __init__(self, *,
+                 slippage: float = 0,
+                 slippage_pct: float = 0,
+                 participation: Optional[float] = None,
+                 latency: int = 0):
+        """
+        Taker fills are `slippage` (in price units) plus `slippage_pct`
+        (a fraction of the price) worse. With `participation`, at most
+        that fraction of a bar's volume is filled on it, over all orders
+        in the order they trigger. Orders can fill from `latency` bars
+        after the bar following the one they were placed on.
+        """
+        if slippage < 0 or slippage_pct < 0:
+            raise ValueError('Slippage should be non-negative')
+        if participation is not None and not 0 < participation <= 1:
+            raise ValueError(f'Participation should be in (0, 1], not {participation}')
+        if latency < 0 or int(latency) != latency:
+            raise ValueError(f'Latency should be a non-negative number of bars, not {latency}')
+        self.slippage = float(slippage)
+        self.slippage_pct = float(slippage_pct)
+        self.participation = participation
+        self.latency = int(latency)
+
+    def __repr__(self):
+        return (f'FillModel(slippage={self.slippage}, slippage_pct={self.slippage_pct}, '
+                f'participation={self.participation}, latency={self.latency})')
+
+    def fill(self, orders: np.ndarray, fill_prices: np.ndarray, high: float, low: float, volume: float
+             ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+        """
+        Given the order book rows of the `orders` a bar triggers and the
+        prices the bar reaches them at, return their fill prices, whether
+        each is a maker fill, whether each expires instead, and the size
+        the bar can fill in total.
+        """
+        price = orders['price']
+        is_maker = ~np.isnan(price) & np.isnan(orders['stop']) & (fill_prices == price)
+        expired = orders['post_only'] & ~is_maker
+
+        slip = fill_prices * self.slippage_pct + self.slippage
+        slip[is_maker] = 0
+        prices = np.clip(np.where(orders['side'] == _BUY, fill_prices + slip, fill_prices - slip), low, high)
+
+        budget = np.inf if self.participation is None else self.participation * volume
+        return prices, is_maker, expired, budget
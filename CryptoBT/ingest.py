@@ -0,0 +1,396 @@
+"""
+Ingestion of OHLCV exports into a chunked, append-only history.
+
+A `Catalog` keeps one history per exchange, symbol and interval under
+`root/<exchange>/<symbol>/<interval>/`, split by calendar month (or day)
+into `OHLCVStore` chunks named `2023-04`, `2023-05`, ... Overlapping
+exports are merged and deduplicated by `Timestamp`; rows already stored
+are kept as they are, rows past the end of a chunk are appended to it,
+and only a chunk that gets rows inside its range is rewritten. Loading
+a date range opens just the chunks that cover it.
+
+`find_gaps()` reports runs of missing bars, and `Catalog.update()`
+downloads whatever is missing from an exchange's klines endpoint:
+`BinanceExchange` for the real one, `FileExchange` for local exports.
+"""
+import json
+import os
+import re
+import shutil
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+
+from .store import OHLCV_COLUMNS, OHLCVStore, TimeLike, _index_to_ms, _to_ms
+
+_CATALOG_FILE = 'catalog.json'
+_CHUNK_UNITS = ('M', 'D')
+_EXPORT_NAME = re.compile(r'ohlcv_(?P<exchange>[^_]+)_(?P<symbol>[^_]+)_(?P<interval>[^_]+)'
+                          r'_(?P<start>[\d-]+)_(?P<end>[\d-]+)\.csv$')
+
+Frames = Union[str, pd.DataFrame, Iterable[Union[str, pd.DataFrame]]]
+
+
+def parse_export_name(path: str) -> Optional[Dict[str, str]]:
+    """
+    Exchange, symbol, interval, start and end of an export named like
+    `ohlcv_binance_BTC-USDT_1m_2023-04-18_2023-04-25.csv`, or None.
+    """
+    match = _EXPORT_NAME.search(os.path.basename(path))
+    return match.groupdict() if match else None
+
+
+def interval_ms(interval: Union[str, int]) -> int:
+    """Length of a bar of `interval` ('1m', '4h', '1d', ... or milliseconds) in milliseconds."""
+    if isinstance(interval, (int, np.integer)):
+        return int(interval)
+    return pd.Timedelta(interval).value // 10**6
+
+
+def read_export(path: str) -> pd.DataFrame:
+    """A Binance-style OHLCV CSV export, indexed by millisecond `Timestamp`."""
+    return _normalize(pd.read_csv(path, index_col=0))
+
+
+def _normalize(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy(deep=False)
+    df.columns = map(lambda x: x.lower().capitalize(), df.columns)
+    df = df[[col for col in OHLCV_COLUMNS if col in df.columns]]
+    df.index = pd.Index(_index_to_ms(df.index), name='Timestamp')
+    return df
+
+
+def merge(frames: Frames) -> pd.DataFrame:
+    """
+    Merge OHLCV frames and export paths into one frame sorted by
+    `Timestamp`. Where they overlap, the row of the later one is kept.
+    """
+    if isinstance(frames, (str, pd.DataFrame)):
+        frames = [frames]
+    frames = [read_export(frame) if isinstance(frame, str) else _normalize(frame) for frame in frames]
+    if not frames:
+        raise ValueError('Nothing to merge')
+    df = pd.concat(frames) if len(frames) > 1 else frames[0]
+    timestamps = df.index.to_numpy()
+    order = np.argsort(timestamps, kind='stable')
+    timestamps = timestamps[order]
+    last = np.append(timestamps[1:] != timestamps[:-1], True)  # Last of each run of equal timestamps
+    return df.iloc[order[last]]
+
+
+def find_gaps(timestamps: np.ndarray, interval: Union[str, int]) -> pd.DataFrame:
+    """
+    Runs of missing bars in sorted millisecond `timestamps`, as the
+    `Start` and `End` Timestamp of the first and last missing bar and the
+    number of missing `Bars`.
+    """
+    step = interval_ms(interval)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    k = np.flatnonzero(np.diff(timestamps) > step)
+    return pd.DataFrame({'Start': timestamps[k] + step,
+                         'End': timestamps[k + 1] - step,
+                         'Bars': (timestamps[k + 1] - timestamps[k]) // step - 1})
+
+
+def _present(stored: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+    """Which of `timestamps` are in sorted `stored`."""
+    if not len(stored):
+        return np.zeros(len(timestamps), dtype=bool)
+    k = np.minimum(np.searchsorted(stored, timestamps), len(stored) - 1)
+    return stored[k] == timestamps
+
+
+class IngestReport:
+    """What ingesting into one history did, and the gaps left in it."""
+    def __init__(self, exchange: str, symbol: str, interval: str):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.interval = interval
+        self.rows = 0
+        self.added = 0
+        self.duplicates = 0
+        self.appended: List[str] = []
+        self.rewritten: List[str] = []
+        self.gaps = find_gaps(np.empty(0, dtype=np.int64), interval)
+
+    def __repr__(self):
+        return (f'<IngestReport {self.exchange} {self.symbol} {self.interval} rows={self.rows} '
+                f'added={self.added} duplicates={self.duplicates} appended={self.appended} '
+                f'rewritten={self.rewritten} gaps={len(self.gaps)}>')
+
+
+class Catalog:
+    def __init__(self, root: str, chunk: Optional[str] = None):
+        """
+        Histories under directory `root`, chunked by calendar month
+        (`chunk='M'`, the default) or day (`'D'`). The chunking is fixed
+        when the catalog is created.
+        """
+        self.root = root
+        path = os.path.join(root, _CATALOG_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                stored_chunk = json.load(f)['chunk']
+            if chunk is not None and chunk != stored_chunk:
+                raise ValueError(f'Catalog {root!r} is chunked by {stored_chunk!r}, not {chunk!r}')
+            chunk = stored_chunk
+        else:
+            chunk = chunk or 'M'
+            if chunk not in _CHUNK_UNITS:
+                raise ValueError(f'`chunk` must be one of {_CHUNK_UNITS}')
+            os.makedirs(root, exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump({'chunk': chunk}, f)
+        self.chunk = chunk
+
+    def __repr__(self):
+        return f'<Catalog {self.root!r} chunk={self.chunk!r}>'
+
+    def path(self, symbol: str, interval: str, exchange: str = 'binance') -> str:
+        return os.path.join(self.root, exchange, symbol, interval)
+
+    def _chunk_keys(self, timestamps: np.ndarray) -> np.ndarray:
+        return np.asarray(timestamps, dtype='datetime64[ms]').astype(f'datetime64[{self.chunk}]')
+
+    def _chunk_name(self, timestamp: int) -> str:
+        return str(self._chunk_keys(np.array([timestamp]))[0])
+
+    def chunks(self, symbol: str, interval: str, start: Optional[TimeLike] = None,
+               end: Optional[TimeLike] = None, exchange: str = 'binance') -> List[str]:
+        """Names of the stored chunks holding bars in `[start, end)`, oldest first."""
+        path = self.path(symbol, interval, exchange)
+        if not os.path.isdir(path):
+            return []
+        # Chunk names are ISO dates, so they sort chronologically as strings
+        names = sorted(name for name in os.listdir(path)
+                       if os.path.exists(os.path.join(path, name, 'meta.json')))
+        if start is not None:
+            first = self._chunk_name(_to_ms(start))
+            names = [name for name in names if name >= first]
+        if end is not None:
+            last = self._chunk_name(_to_ms(end) - 1)
+            names = [name for name in names if name <= last]
+        return names
+
+    def stores(self, symbol: str, interval: str, start: Optional[TimeLike] = None,
+               end: Optional[TimeLike] = None, exchange: str = 'binance') -> List[OHLCVStore]:
+        path = self.path(symbol, interval, exchange)
+        return [OHLCVStore(os.path.join(path, name))
+                for name in self.chunks(symbol, interval, start, end, exchange)]
+
+    def load(self, symbol: str, interval: str, start: Optional[TimeLike] = None,
+             end: Optional[TimeLike] = None, exchange: str = 'binance') -> pd.DataFrame:
+        """
+        Bars in `[start, end)` as a DataFrame indexed by `Timestamp`. Only
+        the chunks covering the range are opened; a range within a single
+        chunk is returned as views of its memory maps.
+        """
+        frames = [store.to_frame(start, end) for store in self.stores(symbol, interval, start, end, exchange)]
+        if not frames:
+            return pd.DataFrame(columns=list(OHLCV_COLUMNS), index=pd.Index([], dtype=np.int64, name='Timestamp'))
+        return pd.concat(frames) if len(frames) > 1 else frames[0]
+
+    def iter_frames(self, symbol: str, interval: str, size: int, start: Optional[TimeLike] = None,
+                    end: Optional[TimeLike] = None, exchange: str = 'binance') -> Iterator[pd.DataFrame]:
+        """
+        Bars in `[start, end)` in frames of at most `size` bars, opening
+        one chunk at a time, e.g. for `CryptoBT.stream.StreamBacktest`.
+        """
+        for store in self.stores(symbol, interval, start, end, exchange):
+            yield from store.iter_frames(size, start, end)
+
+    def timestamps(self, symbol: str, interval: str, start: Optional[TimeLike] = None,
+                   end: Optional[TimeLike] = None, exchange: str = 'binance') -> np.ndarray:
+        parts = []
+        for store in self.stores(symbol, interval, start, end, exchange):
+            i, j = store.locate(start, end)
+            parts.append(store.timestamps[i:j])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def gaps(self, symbol: str, interval: str, start: Optional[TimeLike] = None,
+             end: Optional[TimeLike] = None, exchange: str = 'binance') -> pd.DataFrame:
+        """`find_gaps()` of the stored bars in `[start, end)`, read from the `Timestamp` column only."""
+        return find_gaps(self.timestamps(symbol, interval, start, end, exchange), interval)
+
+    def span(self, symbol: str, interval: str, exchange: str = 'binance') -> Optional[Tuple[int, int]]:
+        """Timestamps of the first and last stored bar, or None if there are none."""
+        stores = [store for store in self.stores(symbol, interval, exchange=exchange) if len(store)]
+        if not stores:
+            return None
+        return int(stores[0].timestamps[0]), int(stores[-1].timestamps[-1])
+
+    def ingest(self, data: Frames, symbol: Optional[str] = None, interval: Optional[str] = None,
+               exchange: Optional[str] = None) -> IngestReport:
+        """
+        Merge OHLCV frames or export paths into the history of `symbol`
+        and `interval` on `exchange`, which default to the ones in the
+        exports' names. Bars already stored are skipped, new bars after a
+        chunk's last one are appended to it, and a chunk is only rewritten
+        if bars land inside its range (e.g. filling a gap).
+        """
+        if isinstance(data, (str, pd.DataFrame)):
+            data = [data]
+        data = list(data)
+        names = [parse_export_name(item) for item in data if isinstance(item, str)]
+        given = {'exchange': exchange, 'symbol': symbol, 'interval': interval}
+        for key, value in given.items():
+            found = {name[key] for name in names if name}
+            if value is None:
+                if len(found) != 1:
+                    raise ValueError(f'Pass `{key}`: the exports name {sorted(found) or "none"}')
+                given[key] = found.pop()
+        exchange, symbol, interval = given['exchange'], given['symbol'], given['interval']
+
+        report = IngestReport(exchange, symbol, interval)
+        if data:
+            df = merge(data)
+            self._ingest(df, self.path(symbol, interval, exchange), report)
+        report.gaps = self.gaps(symbol, interval, exchange=exchange)
+        return report
+
+    def ingest_exports(self, paths: Iterable[str]) -> List[IngestReport]:
+        """`ingest()` export files into the histories their names say they belong to."""
+        groups: Dict[Tuple[str, str, str], List[str]] = {}
+        for path in paths:
+            name = parse_export_name(path)
+            if name is None:
+                raise ValueError(f'Not an OHLCV export name: {path!r}')
+            groups.setdefault((name['exchange'], name['symbol'], name['interval']), []).append(path)
+        return [self.ingest(group, symbol, interval, exchange)
+                for (exchange, symbol, interval), group in groups.items()]
+
+    def _ingest(self, df: pd.DataFrame, path: str, report: IngestReport):
+        timestamps = df.index.to_numpy()
+        report.rows += len(timestamps)
+        keys = self._chunk_keys(timestamps)
+        bounds = np.flatnonzero(np.diff(keys.astype(np.int64))) + 1
+        for i, j in zip(np.r_[0, bounds].tolist(), np.r_[bounds, len(keys)].tolist()):
+            name = str(keys[i])
+            chunk_path = os.path.join(path, name)
+            rows_ts, rows = timestamps[i:j], df.iloc[i:j]
+            if not os.path.exists(os.path.join(chunk_path, 'meta.json')):
+                OHLCVStore.create(chunk_path, rows.columns)._write(rows_ts, rows)
+                report.added += len(rows_ts)
+                report.appended.append(name)
+                continue
+
+            store = OHLCVStore(chunk_path)
+            stored = store.timestamps
+            new = ~_present(stored, rows_ts)
+            report.duplicates += int(np.count_nonzero(~new))
+            if not new.any():
+                continue
+            rows_ts, rows = rows_ts[new], rows.iloc[new]
+            report.added += len(rows_ts)
+            if not len(stored) or rows_ts[0] > stored[-1]:
+                store._write(rows_ts, rows)
+                report.appended.append(name)
+            else:
+                self._rewrite(store, merge([store.to_frame(), rows]))
+                report.rewritten.append(name)
+
+    @staticmethod
+    def _rewrite(store: OHLCVStore, df: pd.DataFrame):
+        """Replace a chunk by `df`, written next to it first so a failure leaves it intact."""
+        path = store.path
+        tmp, old = path + '.tmp', path + '.old'
+        shutil.rmtree(tmp, ignore_errors=True)
+        OHLCVStore.create(tmp, store.columns)._write(df.index.to_numpy(), df)
+        os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old)
+
+    def update(self, source, symbol: str, interval: str, start: TimeLike,
+               end: Optional[TimeLike] = None) -> IngestReport:
+        """
+        Download from `source` (e.g. `BinanceExchange`) the bars in
+        `[start, end)` missing from the history: before its first bar,
+        in its gaps and after its last bar (up to the latest, if `end` is
+        None). Bars already stored are not requested again.
+        """
+        step = interval_ms(interval)
+        start = _to_ms(start)
+        end = None if end is None else _to_ms(end)
+        timestamps = self.timestamps(symbol, interval, start, end, source.name)
+        if not len(timestamps):
+            missing = [(start, end)]
+        else:
+            gaps = find_gaps(timestamps, step)
+            missing = [(start, int(timestamps[0]))] if start < timestamps[0] else []
+            missing += [(a, b + step) for a, b in zip(gaps['Start'].tolist(), gaps['End'].tolist())]
+            missing.append((int(timestamps[-1]) + step, end))
+
+        frames = []
+        for a, b in missing:
+            while b is None or a < b:
+                page = source.fetch_klines(symbol, interval, a, b)
+                if not len(page):
+                    break
+                frames.append(page)
+                a = int(page.index[-1]) + step
+        return self.ingest(frames, symbol, interval, source.name)
+
+
+class FileExchange:
+    """
+    Stand-in for an exchange's klines endpoint, serving bars from the
+    OHLCV exports in `directory` a page of at most `limit` at a time, as
+    the real one would. For tests and offline work.
+    """
+    def __init__(self, directory: str, name: str = 'binance', limit: int = 1000):
+        self.directory = directory
+        self.name = name
+        self.limit = limit
+        self.requests = 0
+        self._frames: Dict[Tuple[str, str], pd.DataFrame] = {}
+
+    def _frame(self, symbol: str, interval: str) -> pd.DataFrame:
+        df = self._frames.get((symbol, interval))
+        if df is None:
+            paths = []
+            for filename in sorted(os.listdir(self.directory)):
+                name = parse_export_name(filename)
+                if name and (name['exchange'], name['symbol'], name['interval']) == (self.name, symbol, interval):
+                    paths.append(os.path.join(self.directory, filename))
+            if not paths:
+                raise ValueError(f'No {self.name} {symbol} {interval} exports in {self.directory!r}')
+            df = self._frames[(symbol, interval)] = merge(paths)
+        return df
+
+    def fetch_klines(self, symbol: str, interval: str, start: int, end: Optional[int] = None) -> pd.DataFrame:
+        """Up to `limit` bars with `start <= Timestamp < end`, oldest first."""
+        self.requests += 1
+        df = self._frame(symbol, interval)
+        timestamps = df.index.to_numpy()
+        i = np.searchsorted(timestamps, start)
+        j = len(timestamps) if end is None else np.searchsorted(timestamps, end)
+        return df.iloc[i:min(j, i + self.limit)]
+
+
+class BinanceExchange:
+    """Klines from the Binance REST API, USDⓈ-M futures by default; symbols as `BTC-USDT`."""
+    def __init__(self, futures: bool = True, limit: int = 1000, pause: float = .2):
+        self.name = 'binance'
+        self.url = ('https://fapi.binance.com/fapi/v1/klines' if futures else
+                    'https://api.binance.com/api/v3/klines')
+        self.limit = limit
+        self.pause = pause  # Seconds between requests, to stay under the rate limit
+
+    def fetch_klines(self, symbol: str, interval: str, start: int, end: Optional[int] = None) -> pd.DataFrame:
+        """Up to `limit` bars with `start <= Timestamp < end`, oldest first."""
+        query = {'symbol': symbol.replace('-', ''), 'interval': interval, 'startTime': start, 'limit': self.limit}
+        if end is not None:
+            query['endTime'] = end - 1
+        with urlopen(f'{self.url}?{urlencode(query)}') as response:
+            klines = json.load(response)
+        time.sleep(self.pause)
+        # Bars still open have a close time in the future
+        now = int(time.time() * 1000)
+        klines = [kline for kline in klines if kline[6] < now]
+        values = np.array([kline[1:6] for kline in klines], dtype=float).reshape(-1, len(OHLCV_COLUMNS))
+        return pd.DataFrame(values, columns=list(OHLCV_COLUMNS),
+                            index=pd.Index([kline[0] for kline in klines], dtype=np.int64, name='Timestamp'))
@@ -1,3 +1,5 @@
+from abc import ABCMeta, abstractmethod
+from collections import deque
 from typing import Callable, Optional, Sequence, Union
 import numpy as np
 import pandas as pd
@@ -21,3 +23,386 @@ def crossover(series1: Sequence, series2: Sequence) -> bool:
         return series1[-2] < series2[-2] and series1[-1] > series2[-1]
     except IndexError:
         return False
+
+
+# Indicators
+#
+# Each indicator comes in two forms: a batch function computing the
+# whole array with NumPy (for use with `Strategy.I`), and a streaming
+# class whose `update()` consumes one new bar in O(1) and returns the
+# latest value, for live/paper runs that must not recompute history.
+# Both agree value for value; warm-up bars are NaN.
+
+def _as_float_array(arr) -> np.ndarray:
+    return np.asarray(arr.values if isinstance(arr, pd.Series) else arr, dtype=float)
+
+
+def _sliding(arr: np.ndarray, n: int, func) -> np.ndarray:
+    out = np.full(len(arr), np.nan)
+    if len(arr) >= n:
+        out[n - 1:] = func(np.lib.stride_tricks.sliding_window_view(arr, n), axis=-1)
+    return out
+
+
+def _wilder(arr: np.ndarray, n: int) -> np.ndarray:
+    """Wilder's smoothing (EMA with alpha=1/n), seeded with the first value."""
+    return pd.Series(arr).ewm(alpha=1 / n, adjust=False).mean().values
+
+
+def sma(arr: Sequence, n: int) -> np.ndarray:
+    """`n`-period simple moving average of `arr`."""
+    arr = _as_float_array(arr)
+    out = np.full(len(arr), np.nan)
+    # Skip leading NaNs, e.g. of a symbol listed later than others in a portfolio
+    start = int(np.argmax(~np.isnan(arr))) if len(arr) else 0
+    arr = arr[start:]
+    if len(arr) >= n:
+        # Cumulative sum of deviations from the first value keeps the sums small
+        cumsum = np.empty(len(arr) + 1)
+        cumsum[0] = 0
+        np.cumsum(arr - arr[0], out=cumsum[1:])
+        out[start + n - 1:] = (cumsum[n:] - cumsum[:-n]) / n + arr[0]
+    return out
+
+
+def ema(arr: Sequence, n: int) -> np.ndarray:
+    """`n`-period exponential moving average (alpha = 2 / (n + 1)), seeded with the first value."""
+    return pd.Series(_as_float_array(arr)).ewm(span=n, adjust=False).mean().values
+
+
+def rolling_std(arr: Sequence, n: int) -> np.ndarray:
+    """`n`-period rolling (population) standard deviation."""
+    return _sliding(_as_float_array(arr), n, np.std)
+
+
+def rolling_min(arr: Sequence, n: int) -> np.ndarray:
+    """Lowest value of the last `n` periods."""
+    return _sliding(_as_float_array(arr), n, np.min)
+
+
+def rolling_max(arr: Sequence, n: int) -> np.ndarray:
+    """Highest value of the last `n` periods."""
+    return _sliding(_as_float_array(arr), n, np.max)
+
+
+def bollinger(arr: Sequence, n: int = 20, k: float = 2) -> np.ndarray:
+    """Bollinger bands as a (lower, middle, upper) block of shape `(3, len(arr))`."""
+    mid, std = sma(arr, n), rolling_std(arr, n)
+    return np.vstack((mid - k * std, mid, mid + k * std))
+
+
+def rsi(arr: Sequence, n: int = 14) -> np.ndarray:
+    """`n`-period relative strength index with Wilder's smoothing."""
+    arr = _as_float_array(arr)
+    out = np.full(len(arr), np.nan)
+    if len(arr) > n:
+        diff = np.diff(arr)
+        gain, loss = _wilder(np.maximum(diff, 0), n), _wilder(np.maximum(-diff, 0), n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[n:] = (100 - 100 / (1 + gain / loss))[n - 1:]
+    return out
+
+
+def atr(high: Sequence, low: Sequence, close: Sequence, n: int = 14) -> np.ndarray:
+    """`n`-period average true range with Wilder's smoothing."""
+    high, low, close = map(_as_float_array, (high, low, close))
+    prev_close = np.insert(close[:-1], 0, np.nan)
+    true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    out = _wilder(true_range, n)
+    out[:n - 1] = np.nan
+    return out
+
+
+def vwap(high: Sequence, low: Sequence, close: Sequence, volume: Sequence, n: Optional[int] = None
+         ) -> np.ndarray:
+    """
+    Volume-weighted average of the typical price (H+L+C)/3, over the last
+    `n` periods or, as crypto has no sessions, since the start if `n` is None.
+    """
+    high, low, close, volume = map(_as_float_array, (high, low, close, volume))
+    pv, volume = np.cumsum((high + low + close) / 3 * volume), np.cumsum(volume)
+    if n is not None:
+        pv[n:], volume[n:] = pv[n:] - pv[:-n], volume[n:] - volume[:-n]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = pv / volume
+    if n is not None:
+        out[:n - 1] = np.nan
+    return out
+
+
+# Batched indicators
+#
+# The same indicators for a whole vector of periods at once, as a
+# `(len(ns), len(arr))` block with a row per period (for use with
+# `Strategy.I_batch`). The pass over the data (a cumulative sum or a
+# table of window extremes) is shared by all periods where it can be;
+# EMAs, being recurrences, are run period by period in pandas instead.
+
+def _leading_nan(arr: np.ndarray) -> int:
+    return int(np.argmax(~np.isnan(arr))) if len(arr) else 0
+
+
+def sma_batch(arr: Sequence, ns: Sequence[int]) -> np.ndarray:
+    """`sma()` for each period in `ns`, all from one cumulative sum."""
+    arr = _as_float_array(arr)
+    out = np.full((len(ns), len(arr)), np.nan)
+    start = _leading_nan(arr)
+    arr = arr[start:]
+    if len(arr):
+        cumsum = np.empty(len(arr) + 1)
+        cumsum[0] = 0
+        np.cumsum(arr - arr[0], out=cumsum[1:])
+        for k, n in enumerate(map(int, ns)):
+            if len(arr) >= n:
+                out[k, start + n - 1:] = (cumsum[n:] - cumsum[:-n]) / n + arr[0]
+    return out
+
+
+def ema_batch(arr: Sequence, ns: Sequence[int]) -> np.ndarray:
+    """`ema()` for each period in `ns`, each recurrence run by pandas over one shared series."""
+    series = pd.Series(_as_float_array(arr))
+    out = np.empty((len(ns), len(series)))
+    for k, n in enumerate(ns):
+        out[k] = series.ewm(span=n, adjust=False).mean().values
+    return out
+
+
+def rolling_std_batch(arr: Sequence, ns: Sequence[int]) -> np.ndarray:
+    """`rolling_std()` for each period in `ns`, from cumulative sums of values and their squares."""
+    arr = _as_float_array(arr)
+    out = np.full((len(ns), len(arr)), np.nan)
+    start = _leading_nan(arr)
+    arr = arr[start:]
+    if len(arr):
+        # Sums of deviations from the mean, in extended precision where the platform has it,
+        # keep the cancellation in E[x^2] - E[x]^2 small
+        dev = (arr - arr.mean()).astype(np.longdouble)
+        cumsum, cumsum2 = np.zeros(len(arr) + 1, np.longdouble), np.zeros(len(arr) + 1, np.longdouble)
+        np.cumsum(dev, out=cumsum[1:])
+        np.cumsum(dev * dev, out=cumsum2[1:])
+        for k, n in enumerate(map(int, ns)):
+            if len(arr) >= n:
+                mean = (cumsum[n:] - cumsum[:-n]) / n
+                var = (cumsum2[n:] - cumsum2[:-n]) / n - mean * mean
+                out[k, start + n - 1:] = np.sqrt(np.maximum(var, 0))
+    return out
+
+
+def _window_extremes(arr: np.ndarray, ns: Sequence[int], func) -> np.ndarray:
+    # levels[j][i] is the extreme of arr[i:i + 2**j]; any window is covered by two overlapping such spans
+    out = np.full((len(ns), len(arr)), np.nan)
+    ns = [int(n) for n in ns]
+    levels = [arr]
+    while len(ns) and 2 ** len(levels) <= min(max(ns), len(arr)):
+        half = 2 ** (len(levels) - 1)
+        levels.append(func(levels[-1][:-half], levels[-1][half:]))
+    for k, n in enumerate(ns):
+        if len(arr) >= n:
+            j = n.bit_length() - 1
+            width = 2 ** j
+            out[k, n - 1:] = func(levels[j][:len(arr) - n + 1], levels[j][n - width:len(arr) - width + 1])
+    return out
+
+
+def rolling_min_batch(arr: Sequence, ns: Sequence[int]) -> np.ndarray:
+    """`rolling_min()` for each period in `ns`, from one table of minima over power-of-two windows."""
+    return _window_extremes(_as_float_array(arr), ns, np.minimum)
+
+
+def rolling_max_batch(arr: Sequence, ns: Sequence[int]) -> np.ndarray:
+    """`rolling_max()` for each period in `ns`, from one table of maxima over power-of-two windows."""
+    return _window_extremes(_as_float_array(arr), ns, np.maximum)
+
+
+def batched(func: Callable) -> Callable:
+    """
+    Batched form of any indicator `func(*args, n)` whose period is its
+    last argument, calling it once per period; for indicators without a
+    batched kernel.
+    """
+    def batch(*args, **kwargs) -> np.ndarray:
+        *args, ns = args
+        return np.vstack([np.asarray(func(*args, n, **kwargs), dtype=float) for n in ns])
+    batch.__name__ = f'{getattr(func, "__name__", "func")}_batch'
+    return batch
+
+
+class SMA:
+    """Streaming `sma()`."""
+    def __init__(self, n: int):
+        self.n = n
+        self.value = np.nan
+        self._window = deque()
+        self._first = None
+        self._sum = 0.
+
+    def update(self, value: float) -> float:
+        if self._first is None:
+            self._first = value
+        value -= self._first
+        self._window.append(value)
+        self._sum += value
+        if len(self._window) > self.n:
+            self._sum -= self._window.popleft()
+        if len(self._window) == self.n:
+            self.value = self._sum / self.n + self._first
+        return self.value
+
+
+class EMA:
+    """Streaming `ema()`."""
+    def __init__(self, n: int, alpha: Optional[float] = None):
+        self.n = n
+        self.alpha = 2 / (n + 1) if alpha is None else alpha
+        self.value = np.nan
+
+    def update(self, value: float) -> float:
+        if self.value != self.value:  # NaN: first value seeds the average
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+class RollingStd:
+    """Streaming `rolling_std()`, with Welford's update for adding and dropping a value."""
+    def __init__(self, n: int):
+        self.n = n
+        self.value = np.nan
+        self._window = deque()
+        self._mean = 0.
+        self._m2 = 0.
+
+    def update(self, value: float) -> float:
+        window = self._window
+        window.append(value)
+        if len(window) > self.n:
+            old = window.popleft()
+            mean = self._mean + (value - old) / self.n
+            self._m2 += (value - old) * (value - mean + old - self._mean)
+            self._mean = mean
+        else:
+            delta = value - self._mean
+            self._mean += delta / len(window)
+            self._m2 += delta * (value - self._mean)
+        if len(window) == self.n:
+            self.value = np.sqrt(max(self._m2, 0) / self.n)
+        return self.value
+
+
+class _RollingExtreme(metaclass=ABCMeta):
+    def __init__(self, n: int):
+        self.n = n
+        self.value = np.nan
+        self._i = 0
+        # Monotonic deque of (bar, value); the front is the current extreme
+        self._deque = deque()
+
+    @abstractmethod
+    def _dominates(self, a: float, b: float) -> bool:
+        """Whether value `a` stays the extreme over a later value `b`."""
+
+    def update(self, value: float) -> float:
+        dq = self._deque
+        while dq and not self._dominates(dq[-1][1], value):
+            dq.pop()
+        dq.append((self._i, value))
+        if dq[0][0] <= self._i - self.n:
+            dq.popleft()
+        self._i += 1
+        if self._i >= self.n:
+            self.value = dq[0][1]
+        return self.value
+
+
+class RollingMin(_RollingExtreme):
+    """Streaming `rolling_min()`."""
+    def _dominates(self, a, b):
+        return a < b
+
+
+class RollingMax(_RollingExtreme):
+    """Streaming `rolling_max()`."""
+    def _dominates(self, a, b):
+        return a > b
+
+
+class Bollinger:
+    """Streaming `bollinger()`; `update()` returns (lower, middle, upper)."""
+    def __init__(self, n: int = 20, k: float = 2):
+        self.k = k
+        self._sma = SMA(n)
+        self._std = RollingStd(n)
+        self.value = (np.nan, np.nan, np.nan)
+
+    def update(self, value: float) -> tuple:
+        mid, std = self._sma.update(value), self._std.update(value)
+        self.value = (mid - self.k * std, mid, mid + self.k * std)
+        return self.value
+
+
+class RSI:
+    """Streaming `rsi()`."""
+    def __init__(self, n: int = 14):
+        self.n = n
+        self.value = np.nan
+        self._prev = None
+        self._count = 0
+        self._gain = EMA(n, alpha=1 / n)
+        self._loss = EMA(n, alpha=1 / n)
+
+    def update(self, value: float) -> float:
+        if self._prev is not None:
+            diff = value - self._prev
+            gain, loss = self._gain.update(max(diff, 0.)), self._loss.update(max(-diff, 0.))
+            self._count += 1
+            if self._count >= self.n:
+                self.value = 100 - 100 / (1 + gain / loss) if loss else (100. if gain else np.nan)
+        self._prev = value
+        return self.value
+
+
+class ATR:
+    """Streaming `atr()`; `update()` takes the bar's high, low and close."""
+    def __init__(self, n: int = 14):
+        self.n = n
+        self.value = np.nan
+        self._prev_close = None
+        self._count = 0
+        self._tr = EMA(n, alpha=1 / n)
+
+    def update(self, high: float, low: float, close: float) -> float:
+        true_range = high - low
+        if self._prev_close is not None:
+            true_range = max(true_range, abs(high - self._prev_close), abs(low - self._prev_close))
+        self._prev_close = close
+        value = self._tr.update(true_range)
+        self._count += 1
+        if self._count >= self.n:
+            self.value = value
+        return self.value
+
+
+class VWAP:
+    """Streaming `vwap()`; `update()` takes the bar's high, low, close and volume."""
+    def __init__(self, n: Optional[int] = None):
+        self.n = n
+        self.value = np.nan
+        self._window = deque()
+        self._pv = 0.
+        self._volume = 0.
+
+    def update(self, high: float, low: float, close: float, volume: float) -> float:
+        pv = (high + low + close) / 3 * volume
+        self._pv += pv
+        self._volume += volume
+        if self.n is not None:
+            self._window.append((pv, volume))
+            if len(self._window) > self.n:
+                old_pv, old_volume = self._window.popleft()
+                self._pv -= old_pv
+                self._volume -= old_volume
+            if len(self._window) < self.n:
+                return self.value
+        self.value = self._pv / self._volume if self._volume else np.nan
+        return self.value
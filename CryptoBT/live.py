@@ -0,0 +1,283 @@
+"""
+Live and paper trading.
+
+`LiveRunner` drives an unchanged `Strategy` and `_TradingEngine` from an
+async source of closed bars: each bar is appended to a bounded history,
+orders resting from the previous bar are handed to the broker, the
+strategy's indicators are recomputed over the history and
+`Strategy.next()` decides, then newly placed orders go to the broker.
+
+Bar sources are async iterables of `(timestamp, open, high, low, close,
+volume)` tuples: `replay()` a DataFrame, `tail_csv()` a growing Binance
+export, or `binance_klines()` from the exchange websocket.
+"""
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import AsyncIterable, AsyncIterator, Callable, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+import pandas as pd
+
+from .CryptoBT import Order, Strategy, _Indicator, _TradingEngine, _as_indicator_array
+from ._util import _Data
+from .dto import SymbolConfig
+from .idl import OrderStatus
+from .store import OHLCV_COLUMNS, _index_to_ms
+
+Bar = Tuple[int, float, float, float, float, float]
+
+
+def _bars(df: pd.DataFrame) -> List[Bar]:
+    timestamps = _index_to_ms(df.index)
+    values = df[list(OHLCV_COLUMNS)].to_numpy(dtype=float)
+    return [(timestamp, *row) for timestamp, row in zip(timestamps.tolist(), values.tolist())]
+
+
+async def replay(df: pd.DataFrame, interval: Optional[float] = None) -> AsyncIterator[Bar]:
+    """Yield the bars of `df`, optionally `interval` seconds apart, e.g. for a paper session."""
+    for bar in _bars(df):
+        yield bar
+        await asyncio.sleep(interval or 0)
+
+
+async def tail_csv(path: str, poll_interval: float = 1.) -> AsyncIterator[Bar]:
+    """
+    Follow a Binance-style OHLCV CSV (`Timestamp,Open,High,Low,Close,Volume,...`)
+    that another process appends closed bars to, from its current end.
+    """
+    with open(path) as f:
+        f.seek(0, os.SEEK_END)
+        partial = ''
+        while True:
+            line = f.readline()
+            if not line:
+                await asyncio.sleep(poll_interval)
+                continue
+            line, partial = partial + line, ''
+            if not line.endswith('\n'):
+                partial = line  # Wait for the writer to finish the line
+                continue
+            fields = line.split(',')
+            yield (int(fields[0]), *map(float, fields[1:6]))
+
+
+async def binance_klines(symbol: str, interval: str = '1m', futures: bool = True) -> AsyncIterator[Bar]:
+    """Closed klines of `symbol` (e.g. 'BTCUSDT') from the Binance websocket; needs `websockets`."""
+    try:
+        import websockets
+    except ImportError:
+        raise ImportError('binance_klines() needs the `websockets` package: pip install websockets') from None
+    host = 'wss://fstream.binance.com' if futures else 'wss://stream.binance.com:9443'
+    async with websockets.connect(f'{host}/ws/{symbol.lower()}@kline_{interval}') as ws:
+        async for message in ws:
+            kline = json.loads(message)['k']
+            if kline['x']:  # Only closed bars
+                yield (int(kline['t']), float(kline['o']), float(kline['h']), float(kline['l']),
+                       float(kline['c']), float(kline['v']))
+
+
+class Broker:
+    """
+    Where the orders of a live strategy go. This default is a simulated
+    local exchange: orders rest in the engine's book and are filled
+    against each new bar. A broker for a real exchange would send the
+    orders in `submit()`, and in `on_bar()` apply the fills the exchange
+    reported since the last bar.
+    """
+    def on_bar(self, engine: _TradingEngine):
+        engine.handle_execution()
+
+    def submit(self, engine: _TradingEngine, orders: List[Order]):
+        pass
+
+
+class _History:
+    """
+    The last bars, in a buffer of twice the history length: bars are
+    appended in place, and once it's full the latest `history` bars are
+    moved to the front. `data` views the buffer, so strategies and the
+    engine see between `history` and `2 * history` bars.
+    """
+    def __init__(self, history: int):
+        self._values = np.full((2 * history, len(OHLCV_COLUMNS)), np.nan)
+        self._timestamps = np.zeros(2 * history, dtype=np.int64)
+        self._history = history
+        self._n = 0
+        self.data = _Data(pd.DataFrame(self._values, columns=list(OHLCV_COLUMNS),
+                                       index=pd.Index(self._timestamps, name='Timestamp'), copy=False))
+        self.data._set_length(0)
+
+    @property
+    def ohlc(self) -> np.ndarray:
+        return self._values[:, :4]
+
+    def append(self, bar: Bar) -> int:
+        """Add a bar; returns the number of bars dropped from the front to make room."""
+        dropped = 0
+        if self._n == len(self._values):
+            dropped = self._n - self._history + 1
+            self._values[:self._history - 1] = self._values[dropped:]
+            self._timestamps[:self._history - 1] = self._timestamps[dropped:]
+            self._n -= dropped
+        self._timestamps[self._n] = bar[0]
+        self._values[self._n] = bar[1:]
+        self._n += 1
+        self.data._update()  # The frame views the buffer, but `_Data` keeps a copy of its index
+        self.data._set_length(self._n)
+        return dropped
+
+
+class _IndicatorSpec:
+    __slots__ = ('attr', 'func', 'args', 'kwargs', 'name')
+
+    def __init__(self, func, args, kwargs, name):
+        self.attr = None
+        self.func, self.args, self.kwargs, self.name = func, args, kwargs, name
+
+
+def _record_indicators(strategy: Strategy, data: _Data) -> List[_IndicatorSpec]:
+    """Call `Strategy.init()`, recording how each indicator is computed so it can be redone."""
+    columns = {id(data[column]): column for column in OHLCV_COLUMNS}
+    specs: Dict[int, _IndicatorSpec] = {}
+    declare = strategy.I
+
+    def recording_indicator(func, *args, name=None, **kwargs):
+        value = declare(func, *args, name=name, **kwargs)
+        for arg in (*args, *kwargs.values()):
+            if isinstance(arg, (np.ndarray, pd.Series)) and id(arg) not in columns and id(arg) not in specs:
+                raise ValueError(f'Indicator "{value.name}" takes an array that is neither a data column nor '
+                                 'another indicator, which can not be recomputed as bars arrive')
+        i_kwargs = {key: value for key, value in kwargs.items()
+                    if key not in ('plot', 'overlay', 'color', 'scatter', 'cache', 'warmup')}
+        specs[id(value)] = _IndicatorSpec(func, args, i_kwargs, value.name)
+        return value
+
+    strategy.I = recording_indicator
+    try:
+        strategy.init()
+    finally:
+        del strategy.I
+    for attr, value in strategy.__dict__.items():
+        if isinstance(value, _Indicator) and id(value) in specs:
+            specs[id(value)].attr = attr
+
+    # Arguments are resolved by data column name or by the position of an earlier indicator
+    order = {key: k for k, key in enumerate(specs)}
+    for spec in specs.values():
+        spec.args = tuple(('column', columns[id(arg)]) if id(arg) in columns else
+                          ('indicator', order[id(arg)]) if id(arg) in specs else ('value', arg)
+                          for arg in spec.args)
+        spec.kwargs = {key: ('column', columns[id(arg)]) if id(arg) in columns else
+                       ('indicator', order[id(arg)]) if id(arg) in specs else ('value', arg)
+                       for key, arg in spec.kwargs.items()}
+    return list(specs.values())
+
+
+def _recompute_indicators(specs: List[_IndicatorSpec], strategy: Strategy, data: _Data):
+    """Recompute recorded indicators over the bars of `data`, into the strategy's attributes."""
+    values = []
+
+    def resolve(arg):
+        kind, value = arg
+        return data[value] if kind == 'column' else values[value] if kind == 'indicator' else value
+
+    for spec in specs:
+        value = _as_indicator_array(spec.func(*map(resolve, spec.args),
+                                              **{key: resolve(arg) for key, arg in spec.kwargs.items()}),
+                                    len(data))
+        value = _Indicator(value, name=spec.name, index=data.index)
+        values.append(value)
+        if spec.attr is not None:
+            setattr(strategy, spec.attr, value)
+
+
+class LiveRunner:
+    """
+    Run `strategy` live on the bars of `source`, keeping the last
+    `history` bars (and at most that many equity values and latencies).
+    `warmup` is an optional OHLCV frame of past bars to start from.
+    """
+    def __init__(self, strategy: Type[Strategy], source: AsyncIterable[Bar], *,
+                 history: int = 1000,
+                 broker: Optional[Broker] = None,
+                 balance: float = 1000000,
+                 maker_fee: float = 0,
+                 taker_fee: float = 0,
+                 hedge_mode: bool = False,
+                 exclusive_orders: bool = False,
+                 symbol: str = 'BTC-USDT',
+                 symbol_config: Optional[SymbolConfig] = None,
+                 warmup: Optional[pd.DataFrame] = None,
+                 on_bar: Optional[Callable[['LiveRunner'], None]] = None,
+                 **params):
+        self.source = source
+        self.broker = broker or Broker()
+        self.on_bar = on_bar
+        self._history = _History(history)
+        self.engine = _TradingEngine(self._history.data, balance, maker_fee, taker_fee, hedge_mode,
+                                     exclusive_orders, symbol=symbol, symbol_config=symbol_config,
+                                     ohlc=self._history.ohlc)
+        self.engine.equitys = deque(maxlen=history)
+        self.strategy = strategy(self.engine, self._history.data, params)
+        self._strategy_next = self.strategy.next
+        self._specs: List[_IndicatorSpec] = []
+        self.latencies = deque(maxlen=history)  # Seconds from bar arrival to submitted orders
+        self.n_bars = 0
+        self._started = False
+
+        if warmup is not None:
+            for bar in _bars(warmup):
+                self.engine._bar_offset += self._history.append(bar)
+            self.n_bars = len(warmup)
+
+    @property
+    def data(self) -> _Data:
+        return self._history.data
+
+    def _init_strategy(self):
+        self._specs = _record_indicators(self.strategy, self.data)
+
+    def _update_indicators(self):
+        _recompute_indicators(self._specs, self.strategy, self.data)
+
+    def step(self, bar: Bar):
+        """Process one closed bar."""
+        start = time.perf_counter()
+        history, engine = self._history, self.engine
+        engine._bar_offset += history.append(bar)
+        self.n_bars += 1
+        if not self._started:
+            self._init_strategy()
+            self._started = True
+            engine.equitys.extend([engine.equity] * (len(self.data) - 1))
+        else:
+            self._update_indicators()
+
+        # Orders from the previous bar are matched against this one first, as in a backtest
+        self.broker.on_bar(engine)
+        n_orders = engine.order_book._next_id
+        self._strategy_next()
+        if engine.order_book._next_id != n_orders:
+            self.broker.submit(engine, [order for order in engine.order_book.orders
+                                        if order.OrderStatus == OrderStatus.New])
+        self.latencies.append(time.perf_counter() - start)
+        if self.on_bar is not None:
+            self.on_bar(self)
+
+    async def run(self, max_bars: Optional[int] = None) -> 'LiveRunner':
+        """Consume the source until it ends (or for `max_bars` bars)."""
+        n = 0
+        async for bar in self.source:
+            self.step(bar)
+            n += 1
+            if max_bars is not None and n >= max_bars:
+                break
+        return self
+
+    @property
+    def equity(self) -> float:
+        return self.engine.equity
+
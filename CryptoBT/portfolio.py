@@ -0,0 +1,306 @@
+"""
+Multi-symbol portfolio backtesting.
+
+All symbols are aligned once on the union of their timestamps into a
+single `(symbols, fields, bars)` block. Each symbol gets a `_Data` cursor
+and a `_TradingEngine` over views of that block, and all engines draw
+on one shared cash account, so one event loop drives the whole book.
+Orders are matched by each symbol's engine, while funding, margin,
+liquidation and equity are computed over `(symbols, sides)` arrays of
+all positions at once.
+"""
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+import numpy as np
+import pandas as pd
+
+from .CryptoBT import Strategy, _Account, _Indicator, _PositionView, _TradingEngine
+from ._margin import CROSS, ISOLATED, as_funding, cross_liquidation, funding_payments, liquidation_prices, stack_tiers
+from ._preset import symbol_config_map
+from ._stats import _TRADE_COLUMNS, get_backtesting_results
+from ._util import _Array, _Data
+from .dto import SymbolConfig
+from .fills import FillModel
+from .idl import ExecType, Side
+
+FIELDS = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+
+def align(data: Dict[str, pd.DataFrame]) -> Tuple[pd.Index, np.ndarray]:
+    """
+    Align per-symbol OHLCV frames on the union of their indexes into one
+    `(symbols, fields, bars)` float block, so that each symbol's columns
+    are contiguous rows of it. Bars missing inside a symbol's
+    history repeat the previous close with zero volume; bars before its
+    first one stay NaN (not trading yet).
+    """
+    frames = {}
+    for symbol, df in data.items():
+        df = df.copy(deep=False)
+        df.columns = map(lambda x: x.lower().capitalize(), df.columns)
+        frames[symbol] = df
+    index = frames[next(iter(frames))].index
+    for df in frames.values():
+        index = index.union(df.index)
+
+    block = np.full((len(frames), len(FIELDS), len(index)), np.nan)
+    for j, df in enumerate(frames.values()):
+        df = df.reindex(index)
+        close = df['Close'].ffill()
+        for k, field in enumerate(FIELDS):
+            block[j, k] = close if field != 'Volume' else 0
+            values = df[field].to_numpy(dtype=float)
+            present = ~np.isnan(values)
+            block[j, k, present] = values[present]
+        block[j, :, np.isnan(close.to_numpy())] = np.nan
+    return index, block
+
+
+class _PortfolioData:
+    """
+    Per-symbol `_Data` cursors by `data[symbol]`, and cross-sectional
+    `(symbols, bars)` arrays by `data.Close` etc.
+    """
+    def __init__(self, index: pd.Index, block: np.ndarray, symbols: List[str]):
+        self.__index = index
+        self.__symbols = symbols
+        self.__i = len(index)
+        self.__fields = {field: _Array(block[:, k], name=field, index=index)
+                         for k, field in enumerate(FIELDS)}
+        # Transposed back, each symbol's `(fields, bars)` rows are the frame's own storage, not copied
+        self.__data = {symbol: _Data(pd.DataFrame(block[j].T, index=index, columns=list(FIELDS), copy=False))
+                       for j, symbol in enumerate(symbols)}
+
+    def __getitem__(self, symbol) -> _Data:
+        return self.__data[symbol]
+
+    def __getattr__(self, item):
+        try:
+            return self.__fields[item][..., :self.__i]
+        except KeyError:
+            raise AttributeError(f"Column '{item}' not in data") from None
+
+    def __iter__(self):
+        return iter(self.__symbols)
+
+    def __len__(self):
+        return self.__i
+
+    def items(self):
+        return self.__data.items()
+
+    @property
+    def symbols(self) -> List[str]:
+        return self.__symbols
+
+    @property
+    def index(self) -> pd.Index:
+        return self.__index[:self.__i]
+
+    def _set_length(self, i):
+        self.__i = i
+        for data in self.__data.values():
+            data._set_length(i)
+
+
+class PortfolioStrategy(Strategy):
+    """
+    Strategy over several symbols. `self.data[symbol]` is that symbol's
+    data, `self.data.Close` etc. are `(symbols, bars)` arrays, and orders
+    and positions take the symbol as their first argument.
+    """
+    def __init__(self, trading_engines: Dict[str, _TradingEngine], data: _PortfolioData, params):
+        super().__init__(None, data, params)
+        self.trading_engines = trading_engines
+        self.positions = {symbol: _PositionView(engine) for symbol, engine in trading_engines.items()}
+        self.position = None
+
+    def buy(self, symbol: str, *,
+            size: Optional[float] = None,
+            price: Optional[float] = None,
+            stop: Optional[float] = None,
+            tp: Optional[float] = None,
+            sl: Optional[float] = None,
+            trail: Optional[float] = None,
+            exec_type: Optional[ExecType] = ExecType.TakerFill
+            ):
+        return self.trading_engines[symbol].new_order(side=Side.Buy, size=size, price=price, stop=stop, tp=tp,
+                                                      sl=sl, trail=trail, exec_type=exec_type)
+
+    def sell(self, symbol: str, *,
+             size: Optional[float] = None,
+             price: Optional[float] = None,
+             stop: Optional[float] = None,
+             tp: Optional[float] = None,
+             sl: Optional[float] = None,
+             trail: Optional[float] = None,
+             exec_type: Optional[ExecType] = ExecType.TakerFill
+             ):
+        return self.trading_engines[symbol].new_order(side=Side.Sell, size=size, price=price, stop=stop, tp=tp,
+                                                      sl=sl, trail=trail, exec_type=exec_type)
+
+    @property
+    def equity(self) -> float:
+        """Cash plus the marked value of every position, as of the last bar."""
+        return next(iter(self.trading_engines.values())).account.equity
+
+
+class PortfolioBacktest:
+    def __init__(self, data: Dict[str, pd.DataFrame],
+                 strategy: Type[PortfolioStrategy],
+                 balance: Optional[float] = 1000000,
+                 maker_fee: Optional[float] = 0,
+                 taker_fee: Optional[float] = 0,
+                 hedge_mode: Optional[bool] = False,
+                 exclusive_orders: Optional[bool] = False,
+                 symbol_configs: Optional[Dict[str, SymbolConfig]] = None,
+                 leverage: float = 1,
+                 margin_mode: str = CROSS,
+                 funding_rates: Optional[Dict[str, Union[float, pd.Series]]] = None,
+                 fill_model: Optional[FillModel] = None):
+        """
+        Margin is as in `Backtest`, with `funding_rates` by symbol. With
+        cross margin, the positions of all symbols are backed by the shared
+        cash and their unrealized pnl together, and are liquidated together
+        when that no longer covers their maintenance margin. `fill_model`
+        fills the orders of every symbol.
+        """
+        if not data:
+            raise ValueError('Need OHLCV data for at least one symbol')
+        self._results = None
+
+        self.balance = balance
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.hedge_mode = hedge_mode
+        self.exclusive_orders = exclusive_orders
+        self.leverage = leverage
+        self.margin_mode = margin_mode
+        self.funding_rates = funding_rates or {}
+        self.fill_model = fill_model
+
+        self._strategy: Type[PortfolioStrategy] = strategy
+        self.symbols = list(data.keys())
+        self.symbol_configs = {symbol: (symbol_configs or {}).get(symbol) or symbol_config_map.get(symbol) or
+                               SymbolConfig(name=symbol)
+                               for symbol in self.symbols}
+        self.index, self.block = align(data)
+
+    def run(self, **kwargs) -> pd.Series:
+        n = len(self.index)
+        data = _PortfolioData(self.index, self.block, self.symbols)
+        account = _Account(self.balance)
+        engines = {symbol: _TradingEngine(data[symbol], self.balance, self.maker_fee, self.taker_fee,
+                                          self.hedge_mode, self.exclusive_orders, symbol=symbol,
+                                          symbol_config=self.symbol_configs[symbol], account=account,
+                                          ohlc=self.block[j, :4].T, leverage=self.leverage,
+                                          margin_mode=self.margin_mode,
+                                          funding=as_funding(self.index, self.funding_rates.get(symbol)),
+                                          fill_model=self.fill_model)
+                   for j, symbol in enumerate(self.symbols)}
+        engine_list = list(engines.values())
+        strategy = self._strategy(engines, data, kwargs)
+        strategy.init()
+
+        # Indicators used in Strategy.next(), directly or in a dict keyed by symbol
+        indicator_attrs = [(attr, value) for attr, value in strategy.__dict__.items()
+                           if isinstance(value, _Indicator) or
+                           (isinstance(value, dict) and value and
+                            all(isinstance(v, _Indicator) for v in value.values()))]
+
+        # Positions of all symbols, rows by symbol and columns long and short, refreshed after fills,
+        # and their margin rates, refreshed after `Strategy.next()` as it may `set_leverage()`
+        sign = np.array([1., -1.])
+        size, entry = np.zeros((len(engine_list), 2)), np.zeros((len(engine_list), 2))
+        margin_rate = np.array([1 / engine.leverage for engine in engine_list])[:, None]
+        tiers = stack_tiers([engine.symbol_config.maintenance_tiers for engine in engine_list])
+        schedules = [engine._funding for engine in engine_list]
+        funding = (None if all(schedule is None for schedule in schedules) else
+                   np.column_stack([np.zeros(n) if schedule is None else schedule for schedule in schedules]))
+
+        def refresh(j):
+            engine = engine_list[j]
+            size[j] = engine._buy_position.size, engine._sell_position.size
+            entry[j] = engine._buy_position.entry_price, engine._sell_position.entry_price
+
+        ohlc = self.block[:, :4]
+        close = self.block[:, 3]
+        equity = np.empty(n)
+        for i in range(n):
+            data._set_length(i + 1)
+            for attr, value in indicator_attrs:
+                setattr(strategy, attr,
+                        value[..., :i + 1] if isinstance(value, _Indicator) else
+                        {key: indicator[..., :i + 1] for key, indicator in value.items()})
+
+            bar = ohlc[:, :, i]
+            open_, high, low, price = bar.T
+            held = size.any(axis=1)
+            if funding is not None and held.any():
+                payments = funding_payments(sign, size, np.where(held, open_, 0.)[:, None], funding[i][:, None])
+                if payments.any():
+                    account.cash += float(payments.sum())
+                    for j in np.flatnonzero(payments.any(axis=1)).tolist():
+                        engine_list[j]._book_funding(payments[j])
+
+            # Orders placed on the previous bar are matched against this bar first
+            for j, engine in enumerate(engine_list):
+                if engine.order_book and open_[j] == open_[j]:  # Not NaN, i.e. trading
+                    engine._match_orders(i, *bar[j, :3].tolist())
+                    refresh(j)
+
+            held = size.any(axis=1)
+            if held.any():
+                self._liquidate(engine_list, i, account, sign, size, entry, margin_rate, tiers, open_, high, low)
+                for j in np.flatnonzero(held).tolist():
+                    refresh(j)
+
+            # Cash plus margin and unrealized pnl of all positions, as in `_TradingEngine.handle_execution()`
+            invested = (size[:, 0] * price - size[:, 0] * entry[:, 0] * (1 - margin_rate[:, 0]) +
+                        size[:, 1] * (entry[:, 1] * (1 + margin_rate[:, 0]) - price))
+            equity[i] = account.equity = account.cash + float(invested[size.any(axis=1)].sum())
+
+            strategy.next()
+            margin_rate[:, 0] = [1 / engine.leverage for engine in engine_list]
+
+        else:
+            # Settle any positions still open at their last close
+            for j, engine in enumerate(engine_list):
+                engine.settle_positions(close[j, n - 1])
+
+        ledgers = [engine.trades for engine in engine_list]
+        trades = {column: np.concatenate([ledger[column] for ledger in ledgers]) for column in _TRADE_COLUMNS}
+        with np.errstate(invalid='ignore'):
+            first_close = close[np.arange(len(self.symbols)), np.argmax(~np.isnan(close), axis=1)]
+            benchmark = np.nanmean(close / first_close[:, None], axis=0)  # Equal-weight buy & hold
+        self._results = get_backtesting_results(data=pd.DataFrame({'Close': benchmark}, index=self.index),
+                                                trades=trades, equity=equity)
+        self._results['_trades']['Symbol'] = np.repeat(self.symbols, [len(ledger) for ledger in ledgers])
+        return self._results
+
+    def _liquidate(self, engines: List[_TradingEngine], i: int, account: _Account, sign, size, entry, margin_rate,
+                   tiers, open_, high, low):
+        """Liquidate the positions whose margin the bar exhausts, checked for all of them at once."""
+        if self.margin_mode == ISOLATED:
+            below, above = liquidation_prices(sign, size, entry, size * entry * margin_rate, tiers).T
+            # NaN triggers compare False; a bar liquidates one side of a symbol at most
+            for j in np.flatnonzero((low <= below) | (high >= above)).tolist():
+                if low[j] <= below[j]:
+                    engines[j]._liquidate((Side.Buy,), min(open_[j], below[j]), i)
+                else:
+                    engines[j]._liquidate((Side.Sell,), max(open_[j], above[j]), i)
+        else:
+            collateral = account.cash + float(np.sum(size * entry * margin_rate))
+            prices = cross_liquidation(sign, size, entry, collateral, tiers, open_, high, low)
+            if prices is None:
+                return
+            liquidated = np.flatnonzero(size.any(axis=1)).tolist()
+            starts = [len(engines[j].trades) for j in liquidated]
+            for j in liquidated:
+                engines[j]._liquidate((Side.Buy, Side.Sell), prices[j], i)
+            if account.cash < 0:
+                # The loss beyond cash isn't borne, so it's taken off the liquidated trades' fees
+                rate = -account.cash / sum(engines[j].trades.notional(start) for j, start in zip(liquidated, starts))
+                for j, start in zip(liquidated, starts):
+                    engines[j].trades.rebate(start, rate)
+        account.cash = max(account.cash, 0.)
@@ -0,0 +1,227 @@
+"""
+A local database of backtest results.
+
+`ResultsStore` keeps the results of many runs in one SQLite file, each
+keyed by its strategy class, a hash of its parameters (and the backtest
+settings) and a fingerprint of its data, so a run already stored is
+found instead of run again, e.g. by `Backtest.optimize(results_store=...)`.
+
+The scalar metrics of each run are columns of the `runs` table, the
+ones commonly ranked or filtered by indexed, so that e.g. the best
+Sharpe ratios of runs with drawdowns under 20% are read off an index:
+
+    store.query('max_drawdown_pct > ?', (-20,), order_by='sharpe_ratio', limit=100)
+
+Equity curves and trade ledgers are kept apart, column by column in
+compressed NumPy archives, and only read by `get()`.
+"""
+import hashlib
+import io
+import json
+import pickle
+import sqlite3
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ._checkpoint import data_key
+from .cache import _hash_arg
+
+# Results metrics and the columns they are stored in
+METRICS = {
+    'Exposure Time [%]': 'exposure_pct',
+    'Equity Final [$]': 'equity_final',
+    'Equity Peak [$]': 'equity_peak',
+    'Return [%]': 'return_pct',
+    'Buy & Hold Return [%]': 'buy_hold_return_pct',
+    'Return (Ann.) [%]': 'return_ann_pct',
+    'Volatility (Ann.) [%]': 'volatility_ann_pct',
+    'Sharpe Ratio': 'sharpe_ratio',
+    'Sortino Ratio': 'sortino_ratio',
+    'Calmar Ratio': 'calmar_ratio',
+    'Max. Drawdown [%]': 'max_drawdown_pct',
+    'Avg. Drawdown [%]': 'avg_drawdown_pct',
+    '# Trades': 'n_trades',
+    'Win Rate [%]': 'win_rate_pct',
+    'Best Trade [%]': 'best_trade_pct',
+    'Worst Trade [%]': 'worst_trade_pct',
+    'Avg. Trade [%]': 'avg_trade_pct',
+    'Profit Factor': 'profit_factor',
+    'Expectancy [%]': 'expectancy_pct',
+    'SQN': 'sqn',
+}
+INDEXED = ('return_pct', 'return_ann_pct', 'sharpe_ratio', 'sortino_ratio', 'calmar_ratio', 'max_drawdown_pct',
+           'n_trades', 'win_rate_pct', 'profit_factor')
+
+# Results entries stored as frames rather than with the scalars
+_FRAMES = ('_equity_curve', '_trades')
+
+RunKey = Tuple[str, str, str]
+
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    strategy TEXT NOT NULL,
+    params_hash TEXT NOT NULL,
+    data_key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    created REAL NOT NULL,
+    {', '.join(f'{column} REAL' for column in METRICS.values())},
+    UNIQUE (strategy, params_hash, data_key)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    run_id INTEGER PRIMARY KEY REFERENCES runs (id),
+    stats BLOB NOT NULL,
+    equity_curve BLOB,
+    trades BLOB
+);
+{''.join(f'CREATE INDEX IF NOT EXISTS runs_{column} ON runs ({column});' for column in INDEXED)}
+'''
+
+
+def strategy_name(strategy: type) -> str:
+    return f'{strategy.__module__}.{strategy.__qualname__}'
+
+
+def params_hash(params: dict, settings: Optional[dict] = None) -> str:
+    """Hash of strategy `params` and backtest `settings`, the same for equal values of either."""
+    h = hashlib.blake2b(digest_size=16)
+    for values in (params, settings or {}):
+        for key, value in sorted(values.items()):
+            h.update(f'{key}='.encode())
+            if not _hash_arg(value, h):
+                h.update(repr(value).encode())  # e.g. a `FillModel`
+    return h.hexdigest()
+
+
+def _jsonable(value):
+    return value.item() if isinstance(value, np.generic) else repr(value)
+
+
+def _frame_to_blob(df: pd.DataFrame) -> bytes:
+    """A frame as a compressed archive of its index and columns."""
+    arrays = {'index': np.asarray(df.index),
+              'names': np.array([str(name) for name in (df.index.name, *df.columns)], dtype=str)}
+    for k, column in enumerate(df.columns):
+        values = df[column].to_numpy()
+        arrays[f'c{k}'] = values.astype(str) if values.dtype == object else values
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def _blob_to_frame(blob: bytes) -> pd.DataFrame:
+    with np.load(io.BytesIO(blob)) as arrays:
+        names = arrays['names'].tolist()
+        columns = {}
+        for k, name in enumerate(names[1:]):
+            values = arrays[f'c{k}']
+            columns[name] = values.astype(object) if values.dtype.kind == 'U' else values
+        index = pd.Index(arrays['index'], name=None if names[0] == 'None' else names[0])
+    return pd.DataFrame(columns, index=index)
+
+
+class ResultsStore:
+    def __init__(self, path: str):
+        """Open (or create) the results database at `path`."""
+        self.path = path
+        self._db = sqlite3.connect(path)
+        self._db.executescript(_SCHEMA)
+
+    def __repr__(self):
+        return f'<ResultsStore {self.path!r} runs={len(self)}>'
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM runs').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+    def run_keys(self, backtest, param_grid: Iterable[dict]) -> List[RunKey]:
+        """Keys of runs of `backtest` with each of `param_grid`, its data fingerprinted once."""
+        strategy, data = strategy_name(backtest._strategy), data_key(backtest.data)
+        settings = backtest._backtest_kwargs()
+        return [(strategy, params_hash(params, settings), data) for params in param_grid]
+
+    def find(self, keys: Sequence[RunKey]) -> Dict[RunKey, int]:
+        """Ids of the stored runs among `keys`."""
+        found = {}
+        cursor = self._db.cursor()
+        for key in keys:
+            row = cursor.execute('SELECT id FROM runs WHERE strategy = ? AND params_hash = ? AND data_key = ?',
+                                 key).fetchone()
+            if row is not None:
+                found[key] = row[0]
+        return found
+
+    def put(self, key: RunKey, params: dict, results: pd.Series) -> int:
+        """Store the `results` of the run with `params` under `key`, unless stored already; return its id."""
+        found = self.find([key])
+        if found:
+            return found[key]
+        stats = results.drop([name for name in results.index if name.startswith('_')])
+        metrics = [float(stats[name]) if name in stats and stats[name] is not None else None
+                   for name in METRICS]
+        with self._db:
+            cursor = self._db.execute(
+                f'INSERT OR IGNORE INTO runs (strategy, params_hash, data_key, params, created, '
+                f'{", ".join(METRICS.values())}) VALUES (?, ?, ?, ?, ?{", ?" * len(METRICS)})',
+                (*key, json.dumps(params, sort_keys=True, default=_jsonable), time.time(), *metrics))
+            if not cursor.rowcount:
+                # Stored meanwhile, e.g. by another process
+                return self.find([key])[key]
+            run_id = cursor.lastrowid
+            frames = [_frame_to_blob(results[name]) if name in results else None for name in _FRAMES]
+            self._db.execute('INSERT INTO blobs (run_id, stats, equity_curve, trades) VALUES (?, ?, ?, ?)',
+                             (run_id, zlib.compress(pickle.dumps(stats, protocol=pickle.HIGHEST_PROTOCOL)),
+                              *frames))
+        return run_id
+
+    def get(self, run_id: int) -> pd.Series:
+        """The results of a stored run, as `Backtest.run()` returned them."""
+        row = self._db.execute('SELECT stats, equity_curve, trades FROM blobs WHERE run_id = ?',
+                               (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f'No run {run_id} in {self.path!r}')
+        results = pickle.loads(zlib.decompress(row[0]))
+        for name, blob in zip(_FRAMES, row[1:]):
+            if blob is not None:
+                results[name] = _blob_to_frame(blob)
+        return results
+
+    def run(self, backtest, **params) -> pd.Series:
+        """`backtest.run(**params)`, or its stored results if it was run before."""
+        key, = self.run_keys(backtest, [params])
+        found = self.find([key])
+        if found:
+            return self.get(found[key])
+        results = backtest.run(**params)
+        self.put(key, params, results)
+        return results
+
+    def query(self, where: Optional[str] = None, args: Sequence = (), *,
+              order_by: Optional[str] = None, ascending: bool = False,
+              limit: Optional[int] = None) -> pd.DataFrame:
+        """
+        Stored runs matching the SQL condition `where` on the metric
+        columns (see `METRICS`) and `strategy`, with `?` placeholders
+        filled from `args`, best `order_by` first, as a frame of their
+        ids, strategies, parameters and metrics. Runs with an undefined
+        `order_by` metric come last.
+        """
+        sql = f'SELECT id, strategy, params, {", ".join(METRICS.values())} FROM runs'
+        if where:
+            sql += f' WHERE {where}'
+        if order_by is not None:
+            if order_by not in METRICS.values():
+                raise ValueError(f'Can only order by a metric column {tuple(METRICS.values())}, not {order_by!r}')
+            # NULLs sort first, so descending orders read the index as is
+            sql += f' ORDER BY {order_by} IS NULL, {order_by}' if ascending else f' ORDER BY {order_by} DESC'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        df = pd.read_sql_query(sql, self._db, params=tuple(args), index_col='id')
+        df['params'] = df['params'].map(json.loads)
+        return df
@@ -0,0 +1,225 @@
+"""
+Monte Carlo robustness of backtest results.
+
+Rather than re-running the strategy, thousands of alternative equity
+paths are resampled from one run's trade ledger and equity curve, as
+rows of a `(paths, steps)` matrix of step returns:
+
+- `MonteCarlo.shuffle_trades()`: the same trades in random order, which
+  changes the drawdowns along the way but not where the path ends,
+- `MonteCarlo.bootstrap_returns()`: bar returns resampled in blocks,
+  which keeps their short-range dependence (e.g. volatility clustering),
+- `MonteCarlo.randomize_costs()`: the trades with random fees and
+  slippage on both legs.
+
+Each returns the return, max. drawdown and Sharpe ratio of every path,
+for `confidence_intervals()`. Paths are simulated a chunk of rows at a
+time, sized to stay within `max_bytes`, optionally over several
+processes; every chunk draws from its own seed spawned from
+`random_state`, so results don't depend on how chunks were spread.
+"""
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from ._stats import _bar_span, _periods_per_year
+
+METRICS = ('Return [%]', 'Max. Drawdown [%]', 'Sharpe Ratio')
+
+# Arrays of a path's length held at once while simulating it
+_ARRAYS_PER_PATH = 4
+
+
+class _Sampler(metaclass=ABCMeta):
+    """Draws `(paths, steps)` matrices of step returns, `periods_per_year` steps a year."""
+    steps: int
+    periods_per_year: float
+
+    @abstractmethod
+    def sample(self, rng: np.random.Generator, n_paths: int) -> np.ndarray:
+        pass
+
+    def metrics(self, n_paths: int, seed: np.random.SeedSequence) -> np.ndarray:
+        returns = self.sample(np.random.default_rng(seed), n_paths)
+        return _path_metrics(returns, self.periods_per_year)
+
+
+class _TradeShuffle(_Sampler):
+    def __init__(self, returns: np.ndarray, periods_per_year: float):
+        self.returns = returns
+        self.steps = len(returns)
+        self.periods_per_year = periods_per_year
+
+    def sample(self, rng, n_paths):
+        return rng.permuted(np.broadcast_to(self.returns, (n_paths, self.steps)), axis=1)
+
+
+class _BlockBootstrap(_Sampler):
+    def __init__(self, returns: np.ndarray, block: int, periods_per_year: float):
+        self.returns = returns
+        self.block = block
+        self.steps = len(returns)
+        self.periods_per_year = periods_per_year
+
+    def sample(self, rng, n_paths):
+        # Circular blocks, so bars near the ends are drawn as often as the rest
+        n_blocks = -(-self.steps // self.block)
+        starts = rng.integers(0, self.steps, (n_paths, n_blocks, 1))
+        rows = ((starts + np.arange(self.block)) % self.steps).reshape(n_paths, -1)[:, :self.steps]
+        return self.returns[rows]
+
+
+class _CostDraw(_Sampler):
+    def __init__(self, pnl, size, entry_price, exit_price, capital,
+                 fee: Tuple[float, float], slippage: Tuple[float, float], periods_per_year: float):
+        self.pnl = pnl
+        self.size = size
+        self.entry_price = entry_price
+        self.exit_price = exit_price
+        self.capital = capital
+        self.fee = fee
+        self.slippage = slippage
+        self.steps = len(pnl)
+        self.periods_per_year = periods_per_year
+
+    def sample(self, rng, n_paths):
+        shape = (n_paths, self.steps)
+        # Slippage is always against the trade, on the way in and out
+        entry_cost = rng.uniform(*self.fee, shape) + rng.uniform(*self.slippage, shape)
+        exit_cost = rng.uniform(*self.fee, shape) + rng.uniform(*self.slippage, shape)
+        costs = self.size * (self.entry_price * entry_cost + self.exit_price * exit_cost)
+        return (self.pnl - costs) / self.capital
+
+
+def _path_metrics(returns: np.ndarray, periods_per_year: float) -> np.ndarray:
+    """Return and max. drawdown (in %) and Sharpe ratio of each row of step `returns`."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.cumprod(1 + returns, axis=1)
+        # The starting equity is the first peak
+        drawdown = 1 - growth / np.maximum(np.maximum.accumulate(growth, axis=1), 1)
+        sharpe = returns.mean(axis=1) / returns.std(axis=1, ddof=1) * np.sqrt(periods_per_year)
+    return np.column_stack(((growth[:, -1] - 1) * 100, -drawdown.max(axis=1) * 100, sharpe))
+
+
+def confidence_intervals(results: pd.DataFrame, confidence: float = .95) -> pd.DataFrame:
+    """Two-sided `confidence` interval and median of each metric of simulated `results`."""
+    tail = (1 - confidence) / 2
+    quantiles = results.quantile([tail, .5, 1 - tail])
+    quantiles.index = ['Lower', 'Median', 'Upper']
+    return quantiles.T
+
+
+class MonteCarlo:
+    def __init__(self, trades: pd.DataFrame, equity, index: Optional[pd.Index] = None, *,
+                 maker_fee: float = 0,
+                 taker_fee: float = 0,
+                 random_state: Optional[int] = None,
+                 max_bytes: int = 256 * 2**20,
+                 max_workers: Optional[int] = 1):
+        """
+        Simulations from a backtest's `trades` (`stats['_trades']`) and
+        `equity` curve, the bars of which are on `index` (to annualize
+        Sharpe ratios as `Backtest.run()` does). `maker_fee` and
+        `taker_fee` bound the fee rates drawn by `randomize_costs()`.
+        Each batch of paths is kept within about `max_bytes` of memory;
+        `max_workers` other than 1 simulates batches in that many
+        processes (None for one per CPU).
+        """
+        equity = np.asarray(equity, dtype=float)
+        if len(equity) < 2:
+            raise ValueError('Need an equity curve of at least two bars')
+        trades = trades.sort_values('ExitBar', kind='stable')  # In the order their pnl is realized
+        self.equity = equity
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.random_state = random_state
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.periods_per_year = _periods_per_year(_bar_span(index if index is not None else pd.RangeIndex(0)))
+        years = (len(equity) - 1) / self.periods_per_year
+
+        # Pnl before fees, which `randomize_costs()` draws anew
+        self._pnl = trades['PnL'].to_numpy(dtype=float) + trades['Fees'].to_numpy(dtype=float)
+        self._size = trades['Size'].to_numpy(dtype=float)
+        self._entry_price = trades['EntryPrice'].to_numpy(dtype=float)
+        self._exit_price = trades['ExitPrice'].to_numpy(dtype=float)
+        # Trades are sized off the equity before they open
+        self._capital = equity[np.maximum(trades['EntryBar'].to_numpy(dtype=np.int64) - 1, 0)]
+        self._trades_per_year = len(trades) / years
+
+        self.trade_returns = trades['PnL'].to_numpy(dtype=float) / self._capital
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.bar_returns = np.diff(equity) / equity[:-1]
+
+    @classmethod
+    def from_backtest(cls, bt, **kwargs) -> 'MonteCarlo':
+        """Simulations from the last `Backtest.run()` of `bt`, with its fees."""
+        stats = bt._results
+        if stats is None:
+            raise RuntimeError('Run the backtest first')
+        equity_curve = stats['_equity_curve']
+        kwargs = {'maker_fee': bt.maker_fee, 'taker_fee': bt.taker_fee, **kwargs}
+        return cls(stats['_trades'], equity_curve['Equity'], equity_curve.index, **kwargs)
+
+    def __repr__(self):
+        return f'<MonteCarlo trades={len(self.trade_returns)} bars={len(self.equity)}>'
+
+    def shuffle_trades(self, n_paths: int = 1000) -> pd.DataFrame:
+        """Metrics of `n_paths` paths taking the trades in random order."""
+        self._check_trades()
+        return self._simulate(_TradeShuffle(self.trade_returns, self._trades_per_year), n_paths)
+
+    def bootstrap_returns(self, n_paths: int = 1000, block: Optional[int] = None) -> pd.DataFrame:
+        """
+        Metrics of `n_paths` paths of bar returns resampled in circular
+        blocks of `block` bars, by default the cube root of their number.
+        """
+        if block is None:
+            block = int(round(len(self.bar_returns) ** (1 / 3)))
+        block = min(max(int(block), 1), len(self.bar_returns))
+        return self._simulate(_BlockBootstrap(self.bar_returns, block, self.periods_per_year), n_paths)
+
+    def randomize_costs(self, n_paths: int = 1000, fee: Optional[Tuple[float, float]] = None,
+                        slippage: Tuple[float, float] = (0, .0005)) -> pd.DataFrame:
+        """
+        Metrics of `n_paths` paths of the trades with, on each leg, a fee
+        rate drawn uniformly from `fee` (by default from maker to taker
+        fee) plus adverse slippage drawn from `slippage`, as fractions of
+        the price, instead of the costs actually paid.
+        """
+        self._check_trades()
+        fee = fee or (min(self.maker_fee, self.taker_fee), max(self.maker_fee, self.taker_fee))
+        return self._simulate(_CostDraw(self._pnl, self._size, self._entry_price, self._exit_price,
+                                        self._capital, fee, slippage, self._trades_per_year), n_paths)
+
+    def _check_trades(self):
+        if not len(self.trade_returns):
+            raise ValueError('No trades to simulate')
+
+    def _simulate(self, sampler: _Sampler, n_paths: int) -> pd.DataFrame:
+        chunk = max(1, self.max_bytes // (sampler.steps * 8 * _ARRAYS_PER_PATH))
+        sizes = [min(chunk, n_paths - start) for start in range(0, n_paths, chunk)]
+        seeds = np.random.SeedSequence(self.random_state).spawn(len(sizes))
+        if self.max_workers == 1 or len(sizes) == 1:
+            parts = [sampler.metrics(size, seed) for size, seed in zip(sizes, seeds)]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_monte_carlo_init,
+                                     initargs=(sampler,)) as executor:
+                parts = list(executor.map(_monte_carlo_run, sizes, seeds))
+        values = np.concatenate(parts) if parts else np.empty((0, len(METRICS)))
+        return pd.DataFrame(values, columns=list(METRICS))
+
+
+# Per-process state of `MonteCarlo` workers
+_monte_carlo_state = {}
+
+
+def _monte_carlo_init(sampler: _Sampler):
+    _monte_carlo_state['sampler'] = sampler
+
+
+def _monte_carlo_run(n_paths: int, seed: np.random.SeedSequence) -> np.ndarray:
+    return _monte_carlo_state['sampler'].metrics(n_paths, seed)
@@ -0,0 +1,146 @@
+"""
+Columnar binary OHLCV storage.
+
+A store is a directory holding one raw little-endian binary file per
+column (`Timestamp.bin`, `Open.bin`, ...) plus a `meta.json` with the
+dtypes and row count. CSV exports are converted once with
+`OHLCVStore.from_csv()`; afterwards columns are `np.memmap`-ed lazily,
+so opening even a multi-GB history costs no parsing and time-range
+slicing only binary-searches the `Timestamp` column.
+"""
+import json
+import os
+from typing import Dict, Iterator, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+OHLCV_COLUMNS = ('Open', 'High', 'Low', 'Close', 'Volume')
+
+_META_FILE = 'meta.json'
+_INDEX = 'Timestamp'
+
+TimeLike = Union[int, str, pd.Timestamp, np.datetime64]
+
+
+def _to_ms(value: TimeLike) -> int:
+    """Millisecond epoch of `value`; integers are taken as already in ms."""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.value // 10**6
+
+
+def _index_to_ms(index: pd.Index) -> np.ndarray:
+    if np.issubdtype(index.dtype, np.integer):
+        return np.asarray(index, dtype=np.int64)
+    index = pd.DatetimeIndex(pd.to_datetime(index))
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+    return index.asi8 // 10**6
+
+
+class OHLCVStore:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, _META_FILE)) as f:
+            meta = json.load(f)
+        self._dtypes: Dict[str, np.dtype] = {col: np.dtype(dtype) for col, dtype in meta['columns'].items()}
+        self._length: int = meta['length']
+        self._columns: Dict[str, np.memmap] = {}
+
+    @classmethod
+    def create(cls, path: str, columns=OHLCV_COLUMNS) -> 'OHLCVStore':
+        """Create an empty store at `path`."""
+        os.makedirs(path, exist_ok=True)
+        dtypes = {_INDEX: '<i8', **{col: '<f8' for col in columns}}
+        for col in dtypes:
+            open(os.path.join(path, f'{col}.bin'), 'wb').close()
+        with open(os.path.join(path, _META_FILE), 'w') as f:
+            json.dump({'columns': dtypes, 'length': 0}, f)
+        return cls(path)
+
+    @classmethod
+    def from_csv(cls, csv_path: str, path: str, chunksize: int = 1_000_000) -> 'OHLCVStore':
+        """
+        Convert a Binance-style OHLCV CSV export (first column a millisecond
+        `Timestamp` or a date, then Open, High, Low, Close, Volume, ...) into
+        a store at `path`, reading it `chunksize` rows at a time.
+        """
+        store = None
+        for chunk in pd.read_csv(csv_path, index_col=0, chunksize=chunksize):
+            chunk.columns = map(lambda x: x.lower().capitalize(), chunk.columns)
+            if store is None:
+                store = cls.create(path, [col for col in OHLCV_COLUMNS if col in chunk.columns])
+            store._write(_index_to_ms(chunk.index), chunk)
+        if store is None:
+            raise ValueError(f'No rows in {csv_path}')
+        return store
+
+    def _write(self, timestamps: np.ndarray, df: pd.DataFrame):
+        """Append rows, which must all come after the ones already stored."""
+        if not len(timestamps):
+            return
+        if np.any(np.diff(timestamps) <= 0) or (self._length and timestamps[0] <= self.timestamps[-1]):
+            raise ValueError('OHLCV rows must be appended in strictly increasing Timestamp order')
+        for col, dtype in self._dtypes.items():
+            values = timestamps if col == _INDEX else df[col].to_numpy()
+            with open(os.path.join(self.path, f'{col}.bin'), 'ab') as f:
+                np.ascontiguousarray(values, dtype=dtype).tofile(f)
+        self._length += len(timestamps)
+        self._columns.clear()
+        with open(os.path.join(self.path, _META_FILE), 'w') as f:
+            json.dump({'columns': {col: dtype.str for col, dtype in self._dtypes.items()},
+                       'length': self._length}, f)
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return f'<OHLCVStore {self.path!r} rows={self._length}>'
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        return tuple(col for col in self._dtypes if col != _INDEX)
+
+    def column(self, name: str) -> np.ndarray:
+        """Read-only memory map of a whole column."""
+        arr = self._columns.get(name)
+        if arr is None:
+            if not self._length:
+                return np.empty(0, dtype=self._dtypes[name])
+            arr = self._columns[name] = np.memmap(os.path.join(self.path, f'{name}.bin'),
+                                                  dtype=self._dtypes[name], mode='r', shape=(self._length,))
+        return arr
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.column(_INDEX)
+
+    def locate(self, start: Optional[TimeLike] = None, end: Optional[TimeLike] = None) -> Tuple[int, int]:
+        """Row range `[i, j)` of bars with `start <= Timestamp < end`, by binary search."""
+        timestamps = self.timestamps
+        i = 0 if start is None else int(np.searchsorted(timestamps, _to_ms(start), side='left'))
+        j = len(timestamps) if end is None else int(np.searchsorted(timestamps, _to_ms(end), side='left'))
+        return i, max(i, j)
+
+    def to_frame(self, start: Optional[TimeLike] = None, end: Optional[TimeLike] = None) -> pd.DataFrame:
+        """
+        OHLCV bars in `[start, end)` as a DataFrame indexed by `Timestamp`,
+        the same shape as a parsed CSV export. The columns are views of
+        the memory maps, so only the pages actually used are read.
+        """
+        return self._frame(*self.locate(start, end))
+
+    def iter_frames(self, size: int, start: Optional[TimeLike] = None, end: Optional[TimeLike] = None
+                    ) -> Iterator[pd.DataFrame]:
+        """`to_frame(start, end)` in consecutive frames of at most `size` bars."""
+        i, j = self.locate(start, end)
+        for k in range(i, j, size):
+            yield self._frame(k, min(k + size, j))
+
+    def _frame(self, i: int, j: int) -> pd.DataFrame:
+        index = pd.Index(self.timestamps[i:j], name=_INDEX)
+        return pd.DataFrame({col: self.column(col)[i:j] for col in self.columns}, index=index, copy=False)
@@ -0,0 +1,190 @@
+"""
+Backtesting histories too long to hold in memory.
+
+`StreamBacktest` runs a `Strategy` over OHLCV bars pulled a chunk at a
+time, from an `OHLCVStore` (or `Catalog.iter_frames()`) or any iterable
+of frames. Only the last bars the strategy needs are kept between
+chunks: the longest warm-up of its indicators (see `Strategy.I`) plus
+`lookback` bars `Strategy.next()` may look back over. Each chunk is run
+after those bars, with the indicators recomputed over both as they were
+declared in `Strategy.init()`, which is called only once; the trading
+engine, with its positions, orders and trades, carries on from chunk to
+chunk.
+
+Indicators thus have to be computed from data columns and other
+indicators, as in `CryptoBT.live`, and strategies see at most the kept
+bars plus one chunk, e.g. `len(self.data)` doesn't count bars from the
+start. Results are the same as `Backtest.run()`'s as long as the
+indicators only depend on their warm-up.
+"""
+from typing import Callable, Iterable, Optional, Tuple, Type, Union
+
+import numpy as np
+import pandas as pd
+
+from .CryptoBT import Strategy, _Indicator, _KernelEngine, _TradingEngine
+from ._margin import CROSS, MARGIN_MODES, as_funding
+from ._stats import _EquityStats
+from ._util import _Data, try_
+from .fills import FillModel
+from .live import _record_indicators, _recompute_indicators
+from .store import OHLCVStore
+
+Source = Union[OHLCVStore, Iterable[pd.DataFrame], Callable[[], Iterable[pd.DataFrame]]]
+
+
+def _warmup(indicator: _Indicator) -> int:
+    """Bars the indicator needs before each value: as declared, else its most leading NaNs."""
+    warmup = indicator._opts.get('warmup')
+    if warmup is not None:
+        return int(warmup)
+    values = try_(lambda: np.atleast_2d(np.asarray(indicator, dtype=float)))
+    if values is None or not values.shape[-1]:
+        return 0
+    valid = ~np.isnan(values)
+    return int(np.where(valid.any(axis=1), valid.argmax(axis=1), values.shape[-1]).max())
+
+
+def _trade_bars(engine, seen: int, first_bar: int, index: pd.Index) -> Tuple[np.ndarray, pd.Index]:
+    """
+    Bars of `index`, from bar `first_bar` on, that trades closed after
+    ledger row `seen`, or still open, entered or exited on, with their
+    index values.
+    """
+    ledger = engine.trades
+    bars = np.concatenate([ledger['entry_time'][seen:], ledger['exit_time'][seen:],
+                           np.array([trade.entry_time for trade in engine.open_trades], dtype=np.int64)])
+    bars = np.unique(bars[(bars >= first_bar) & (bars < first_bar + len(index))])
+    return bars, index[bars - first_bar]
+
+
+class StreamBacktest:
+    def __init__(self, source: Source,
+                 strategy: Type[Strategy],
+                 chunk: int = 100_000,
+                 lookback: int = 100,
+                 balance: Optional[float] = 1000000,
+                 maker_fee: Optional[float] = 0,
+                 taker_fee: Optional[float] = 0,
+                 hedge_mode: Optional[bool] = False,
+                 exclusive_orders: Optional[bool] = False,
+                 kernel: bool = False,
+                 leverage: float = 1,
+                 margin_mode: str = CROSS,
+                 funding_rates: Optional[Union[float, pd.Series]] = None,
+                 fill_model: Optional[FillModel] = None,
+                 curve_every: int = 1):
+        """
+        Backtest over the bars of `source`: an `OHLCVStore`, read `chunk`
+        bars at a time, or an iterable of consecutive OHLCV frames (or a
+        function returning one, so the backtest can be run more than
+        once). `lookback` is how many past bars `Strategy.next()` uses
+        beyond the current one. The results' `_equity_curve` keeps every
+        `curve_every`-th bar and the last. Other arguments are as in
+        `Backtest`.
+        """
+        if margin_mode not in MARGIN_MODES:
+            raise ValueError(f'Margin mode should be one of {MARGIN_MODES}, not {margin_mode!r}')
+        if chunk < 1 or lookback < 0 or curve_every < 1:
+            raise ValueError('`chunk` and `curve_every` should be positive and `lookback` non-negative')
+        self._results = None
+
+        self.source = source
+        self.chunk = chunk
+        self.lookback = lookback
+        self.balance = balance
+        self.maker_fee = maker_fee
+        self.taker_fee = taker_fee
+        self.hedge_mode = hedge_mode
+        self.exclusive_orders = exclusive_orders
+        self.kernel = kernel
+        self.leverage = leverage
+        self.margin_mode = margin_mode
+        self.funding_rates = funding_rates
+        self.fill_model = fill_model
+        self.curve_every = curve_every
+        # Bars kept between chunks, once known from the strategy's indicators
+        self.window: Optional[int] = None
+
+        self._strategy: Type[Strategy] = strategy
+
+    def _frames(self) -> Iterable[pd.DataFrame]:
+        if isinstance(self.source, OHLCVStore):
+            return self.source.iter_frames(self.chunk)
+        if callable(self.source):
+            return self.source()
+        return self.source
+
+    def run(self, **kwargs) -> pd.Series:
+        """Run the strategy over all bars of the source, with `kwargs` overriding its parameters."""
+        engine = strategy = data = specs = None
+        tail = None
+        offset = 0  # Bars dropped from the front so far
+        stats = _EquityStats(self.curve_every)
+        # Index values of the bars trades entered or exited on, as the bars themselves aren't kept
+        trade_bars, trade_times = [], []
+        seen = 0  # Ledger rows whose bars are noted
+
+        for chunk in self._frames():
+            if not len(chunk):
+                continue
+            chunk = chunk.copy(deep=False)
+            chunk.columns = map(lambda x: x.lower().capitalize(), chunk.columns)
+            if tail is not None and not chunk.index[0] > tail.index[-1]:
+                raise ValueError(f'Chunks must follow each other in time; a chunk starting at '
+                                 f'{chunk.index[0]} came after bar {tail.index[-1]}')
+            frame = chunk if tail is None else pd.concat([tail, chunk])
+            data = _Data(frame)
+            funding = as_funding(frame.index, self.funding_rates)
+            if engine is None:
+                engine_class = _KernelEngine if self.kernel else _TradingEngine
+                engine = engine_class(data, self.balance, self.maker_fee, self.taker_fee, self.hedge_mode,
+                                      self.exclusive_orders, leverage=self.leverage, margin_mode=self.margin_mode,
+                                      funding=funding, fill_model=self.fill_model)
+                strategy = self._strategy(engine, data, kwargs)
+                specs = _record_indicators(strategy, data)
+                data._update()
+                self.window = self.lookback + max(map(_warmup, strategy._indicators), default=0)
+            else:
+                engine.data = data
+                engine._ohlc = frame[['Open', 'High', 'Low', 'Close']].to_numpy(dtype=float)
+                engine._funding = funding
+                engine._bar_offset = offset
+                strategy.data = data
+                _recompute_indicators(specs, strategy, data)
+
+            # Indicators used in Strategy.next()
+            indicator_attrs = [(attr, indicator) for attr, indicator in strategy.__dict__.items()
+                               if isinstance(indicator, _Indicator)]
+            for i in range(len(frame) - len(chunk), len(frame)):
+                data._set_length(i + 1)
+                for attr, indicator in indicator_attrs:
+                    setattr(strategy, attr, indicator[..., :i + 1])
+
+                # Orders placed on the previous bar are matched against this bar first
+                engine.handle_execution()
+                strategy.next()
+
+            first_bar, index = stats.n, chunk.index
+            stats.update(index, chunk['Close'].to_numpy(dtype=float), engine.equitys)
+            engine.equitys = []
+            bars, times = _trade_bars(engine, seen, first_bar, index)
+            trade_bars.append(bars)
+            trade_times.append(times)
+            seen = len(engine.trades)
+            kept = min(self.window, len(frame))
+            tail = frame.iloc[len(frame) - kept:]
+            offset += len(frame) - kept
+
+        if engine is None:
+            raise ValueError('No bars to backtest')
+        # Settle any positions still open at the last close
+        engine.settle_positions(data.Close[-1])
+        bars, times = _trade_bars(engine, seen, first_bar, index)
+        trade_bars.append(bars)
+        trade_times.append(times)
+
+        bars, first = np.unique(np.concatenate(trade_bars), return_index=True)
+        times = trade_times[0].append(trade_times[1:])[first]
+        self._results = stats.results(engine.trades.columns(), lambda b: times[np.searchsorted(bars, b)])
+        return self._results
@@ -1,8 +1,34 @@
+import asyncio
+import os
+import tempfile
 import unittest
 import warnings
-from unittest import TestCase
-from CryptoBT import Strategy, Backtest
+from unittest import TestCase, mock
+
+import numpy as np
+import pandas as pd
+
+from CryptoBT import Strategy, Backtest, PortfolioStrategy, PortfolioBacktest
+from CryptoBT import _kernel
+from CryptoBT.CryptoBT import Order
+from CryptoBT._orders import _OrderBook
+from CryptoBT._margin import funding_schedule, maintenance_tier
+from CryptoBT._preset import symbol_config_map
+from CryptoBT._util import _Data
+from CryptoBT.cache import IndicatorCache, get_indicator_cache, set_indicator_cache
+from CryptoBT.ingest import Catalog, FileExchange, find_gaps, merge, parse_export_name
+from CryptoBT._vectorized import run_signals
+from CryptoBT.fills import FillModel
+from CryptoBT.idl import ExecType, OrderStatus, Side
+from CryptoBT import lib
 from CryptoBT.lib import crossover
+from CryptoBT.live import Broker, LiveRunner, replay, tail_csv
+from CryptoBT.portfolio import _PortfolioData, align
+from CryptoBT.results import ResultsStore
+from CryptoBT.robustness import MonteCarlo, confidence_intervals
+from CryptoBT.store import OHLCVStore
+from CryptoBT.stream import StreamBacktest
+from CryptoBT.ticks import AGG_TRADES_COLUMNS, TickReplay, agg_trades_to_bin, read_agg_trades
 from CryptoBT.test import BTCUSDT, SMA
 
 class SMAStrategy(Strategy):
@@ -27,7 +53,1319 @@ class TestBacktest(TestCase):
     def test_backtest(self):
         bt = Backtest(BTCUSDT, SMAStrategy)
         bt.run()
+        # The caller's frame is left as it was
+        df = BTCUSDT.rename(columns=str.lower)
+        Backtest(df, SMAStrategy)
+        self.assertEqual(list(df.columns), [column.lower() for column in BTCUSDT.columns])
+
+    def test_data_cursor(self):
+        lengths = []
+
+        class CursorStrategy(Strategy):
+            def init(self):
+                self.sma = self.I(SMA, self.data.Close, 10)
+
+            def next(self):
+                assert len(self.data.Close) == len(self.sma) == len(self.data)
+                lengths.append(len(self.data))
+
+        Backtest(BTCUSDT, CursorStrategy).run()
+        self.assertEqual(lengths, list(range(1, len(BTCUSDT) + 1)))
+
+    def test_timeframes(self):
+        df = BTCUSDT.iloc[:1000]
+        seen = []
+
+        class TimeframeStrategy(Strategy):
+            def init(self):
+                quarter = self.data.tf('15m')
+                self.sma = self.I(lambda: quarter.align(lib.sma(quarter.bars.Close, 4)), name='sma(15m)')
+
+            def next(self):
+                quarter = self.data.tf('15m')
+                seen.append((len(quarter.Close), quarter.Close[-1], self.sma[-1]))
+
+        Backtest(df, TimeframeStrategy).run()
+        times = pd.to_datetime(df.index, unit='ms')
+        bars = df.set_index(times).resample('15min').agg({'Open': 'first', 'High': 'max', 'Low': 'min',
+                                                          'Close': 'last', 'Volume': 'sum'})
+        # The latest 15 minute bar ending by each 1 minute bar's close
+        completed = np.searchsorted(bars.index + pd.Timedelta('15min'), times + pd.Timedelta('1min'),
+                                    side='right') - 1
+        expected_close = np.where(completed >= 0, bars.Close.to_numpy()[completed], np.nan)
+        expected_sma = np.where(completed >= 0, bars.Close.rolling(4).mean().to_numpy()[completed], np.nan)
+        lengths, closes, smas = map(np.array, zip(*seen))
+        np.testing.assert_array_equal(lengths, np.arange(1, len(df) + 1))
+        np.testing.assert_array_equal(closes, expected_close)
+        np.testing.assert_allclose(smas, expected_sma)
+
+        data = _Data(df.copy())
+        np.testing.assert_array_equal(data.tf('15min').bars.High, bars.High)
+        with self.assertRaises(ValueError):
+            data.tf('30s')
+
+    def test_resting_limit_orders(self):
+        strategies = []
+
+        class GridStrategy(Strategy):
+            def init(self):
+                self.orders = []
+                strategies.append(self)
+
+            def next(self):
+                if not self.orders:
+                    close = self.data.Close[-1]
+                    self.orders = [self.buy(size=.1, price=close * (1 - k / 1000),
+                                            tp=close * (1 - k / 1000) * 1.002, sl=close * (1 - k / 1000) * .99)
+                                   for k in range(1, 100)]
+
+        Backtest(BTCUSDT, GridStrategy).run()
+        orders = strategies[0].orders
+        filled = [order for order in orders if order.OrderStatus == OrderStatus.MakerFill]
+        # Orders deep below the market are only hit many bars after being placed
+        self.assertTrue(filled)
+        self.assertGreater(max(order.exec_time for order in filled), 1)
+        for order in filled:
+            self.assertLessEqual(order.exec_price, order.price)
+
+    def test_run_vectorized_matches_run(self):
+        engines = []
+
+        class RecordingSMAStrategy(SMAStrategy):
+            size = None
+
+            def init(self):
+                super().init()
+                engines.append(self.trading_engine)
+
+            def next(self):
+                if crossover(self.sma1, self.sma2):
+                    self.position.close()
+                    self.buy(size=self.size)
+                elif crossover(self.sma2, self.sma1):
+                    self.position.close()
+                    self.sell(size=self.size)
+
+        close = BTCUSDT.Close.values
+        sma1, sma2 = SMA(close, SMAStrategy.fast).values, SMA(close, SMAStrategy.slow).values
+        entries, short_entries = np.zeros(len(close), bool), np.zeros(len(close), bool)
+        entries[1:] = (sma1[:-1] < sma2[:-1]) & (sma1[1:] > sma2[1:])
+        short_entries[1:] = (sma2[:-1] < sma1[:-1]) & (sma2[1:] > sma1[1:])
+
+        # All-in, a fixed size, and a size more than the cash covers (every entry rejected)
+        for size in (None, 10, 100):
+            engines.clear()
+            Backtest(BTCUSDT, RecordingSMAStrategy, taker_fee=.0004).run(size=size)
+            engine = engines[0]
+            equity, trades = run_signals(BTCUSDT.Open.values, close, entries=entries, short_entries=short_entries,
+                                         size=size, balance=engine.init_balance, fee_rate=.0004,
+                                         symbol_config=symbol_config_map['BTC-USDT'])
+
+            np.testing.assert_allclose(equity, engine.equitys)
+            self.assertEqual(len(trades['size']), len(engine.trades))
+            np.testing.assert_allclose(trades['size'], engine.trades['size'])
+            np.testing.assert_array_equal(trades['exit_time'], engine.trades['exit_time'])
+            if size == 100:
+                self.assertEqual(len(engine.trades), 0)
+
+    def test_trade_ledger(self):
+        engines = []
+
+        class PartialCloseStrategy(Strategy):
+            def init(self):
+                engines.append(self.trading_engine)
+
+            def next(self):
+                if len(self.data) == 10:
+                    self.buy(size=1, tp=self.data.Close[-1] * 1.002)
+                elif len(self.data) == 11:
+                    self.buy(size=2)
+
+        stats = Backtest(BTCUSDT, PartialCloseStrategy).run()
+        ledger = engines[0].trades
+        # The take profit closes half of the latest trade, the rest is settled at the end
+        self.assertEqual(len(ledger), 3)
+        np.testing.assert_array_equal(ledger['size'], [1, 1, 1])
+        np.testing.assert_array_equal(ledger['entry_order_id'], [2, 2, 0])
+        self.assertLess(ledger['exit_time'][0], len(BTCUSDT) - 1)
+        self.assertFalse(engines[0].open_trades)
+        self.assertEqual(len(ledger.to_frame()), stats['# Trades'])
+        self.assertFalse(hasattr(engines[0].position[Side.Buy], '__dict__'))
+
+    def test_profile(self):
+        stats = Backtest(BTCUSDT, SMAStrategy).run(profile=True)
+        profile = stats['_profile']
+        self.assertEqual(len(profile.bar_latency), len(BTCUSDT))
+        self.assertEqual(profile.histogram().sum(), len(BTCUSDT))
+        self.assertEqual(profile.counters['trades'], stats['# Trades'])
+        self.assertEqual(profile.counters['fills'], profile.counters['orders'])
+        # The kernel engine fills orders outside `_fill()`, and they are counted all the same
+        kernel_profile = Backtest(BTCUSDT, SMAStrategy, kernel=True).run(profile=True)['_profile']
+        self.assertEqual(kernel_profile.counters, profile.counters)
+        self.assertTrue((profile.phases >= 0).all())
+        self.assertAlmostEqual(profile.phases.drop('total').sum(), profile.phases['total'], places=3)
+        self.assertIn('rss_mb', profile.memory)
+        self.assertNotIn('_profile', Backtest(BTCUSDT, SMAStrategy).run())
+
+    def test_optimize(self):
+        bt = Backtest(BTCUSDT, SMAStrategy)
+        _, heatmap = bt.optimize(fast=[5, 10, 15], slow=[10, 30], constraint=lambda p: p.fast < p.slow,
+                                 maximize=lambda stats: 1., return_heatmap=True, max_workers=2)
+        self.assertEqual(list(heatmap.index), [(5, 10), (5, 30), (10, 30), (15, 30)])
+        self.assertEqual(list(heatmap.index.names), ['fast', 'slow'])
+
+        _, heatmap = bt.optimize(fast=range(5, 15), slow=[30], method='random', max_tries=3, random_state=0,
+                                 maximize=lambda stats: 1., return_heatmap=True, max_workers=1)
+        self.assertEqual(len(heatmap), 3)
+
+        with self.assertRaises(AttributeError):
+            bt.optimize(missing=[1, 2], max_workers=1)
+
+    def test_checkpoint(self):
+        class CrashingStrategy(TestKernel.OrderMixStrategy):
+            crash_at = None
+
+            def init(self):
+                super().init()
+                self.sma = self.I(lib.sma, self.data.Close, 20)
+
+            def next(self):
+                if len(self.data) == CrashingStrategy.crash_at:
+                    raise KeyboardInterrupt
+                super().next()
+
+        kwargs = dict(maker_fee=.0002, taker_fee=.0004, leverage=3)
+        expected_orders = []
+
+        class ExpectedStrategy(CrashingStrategy):
+            def init(self):
+                super().init()
+                self.orders = expected_orders
+
+        expected = Backtest(BTCUSDT, ExpectedStrategy, **kwargs).run()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'run.ckpt')
+            CrashingStrategy.crash_at = 5500
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    Backtest(BTCUSDT, CrashingStrategy, **kwargs).run(checkpoint_every=1000, checkpoint_path=path)
+            finally:
+                CrashingStrategy.crash_at = None
+            self.assertLess(os.path.getsize(path), 200_000)
+
+            with self.assertRaises(ValueError):
+                Backtest(BTCUSDT, CrashingStrategy, maker_fee=.0002, taker_fee=.0004).resume(path)
+            with self.assertRaises(ValueError):
+                Backtest(BTCUSDT.iloc[:-1], CrashingStrategy, **kwargs).resume(path)
+
+            strategies = []
+
+            class ResumedStrategy(CrashingStrategy):
+                def init(self):
+                    super().init()
+                    strategies.append(self)
+
+            ResumedStrategy.__qualname__ = CrashingStrategy.__qualname__
+            stats = Backtest(BTCUSDT, ResumedStrategy, **kwargs).resume(path)
+            np.testing.assert_array_equal(stats['_equity_curve'].Equity, expected['_equity_curve'].Equity)
+            pd.testing.assert_frame_equal(stats['_trades'], expected['_trades'])
+            # Orders the strategy kept from before the checkpoint are the ones the restored engine filled
+            strategy = strategies[0]
+            self.assertEqual(len(strategy.orders), len(expected_orders))
+            self.assertEqual([order.OrderStatus for order in strategy.orders],
+                             [order.OrderStatus for order in expected_orders])
+
+    def test_walk_forward(self):
+        df = BTCUSDT.iloc[:3000]
+        bt = Backtest(df, SMAStrategy, taker_fee=.0004)
+        stats = bt.walk_forward(train=1000, test=500, fast=[5, 10], slow=[30, 60], max_workers=1)
+        folds = stats['_folds']
+        self.assertEqual(len(folds), 4)
+        self.assertEqual(list(folds.TestStart), list(df.index[[1000, 1500, 2000, 2500]]))
+        self.assertEqual(stats['_equity_curve'].index[0], df.index[1000])
+        self.assertEqual(len(stats['_equity_curve']), 2000)
+
+        # Each test window compounds from where the previous one ended
+        equity = stats['_equity_curve'].Equity.to_numpy()
+        self.assertEqual(folds.TestScore[0], equity[499])
+        self.assertAlmostEqual(stats['Equity Final [$]'] / bt.balance,
+                               np.prod(folds.TestScore / bt.balance))
+        # Indicators are warmed up on the training bars, so trading can start on the first test bar
+        trades = stats['_trades']
+        self.assertLess(trades.EntryBar.min(), folds.slow[0])
+        self.assertTrue(((trades.EntryBar >= 0) & (trades.ExitBar < 2000)).all())
+
+        parallel = bt.walk_forward(train=1000, test=500, fast=[5, 10], slow=[30, 60], max_workers=2)
+        np.testing.assert_allclose(parallel['_equity_curve'].Equity, equity)
+
+        anchored = bt.walk_forward(train=1000, test=1000, anchored=True, fast=[10], slow=[30], max_workers=1)
+        self.assertEqual(list(anchored['_folds'].TrainStart), [df.index[0]] * 2)
+
+        # Bars between spaced-out test windows are left out of the stitched results
+        spaced = bt.walk_forward(train=1000, test=250, step=500, fast=[10], slow=[30], max_workers=1)
+        curve = spaced['_equity_curve']
+        self.assertEqual(len(curve), 4 * 250)
+        self.assertEqual(list(curve.index[[0, 250, -1]]), list(df.index[[1000, 1500, 2749]]))
+        self.assertEqual(spaced['End'], pd.Timestamp(df.index[2749], unit='ms'))
+        with self.assertRaises(ValueError):
+            bt.walk_forward(train=1000, test=500, step=250, fast=[10], slow=[30], max_workers=1)
+
+    def test_stats(self):
+        stats = Backtest(BTCUSDT, SMAStrategy, taker_fee=.0004).run()
+        equity = stats['_equity_curve'].Equity
+        self.assertEqual(stats['Equity Final [$]'], equity.iloc[-1])
+        self.assertAlmostEqual(stats['Max. Drawdown [%]'], ((equity / equity.cummax() - 1).min()) * 100)
+        self.assertEqual(stats['# Trades'], len(stats['_trades']))
+        self.assertAlmostEqual(stats['Win Rate [%]'], (stats['_trades'].PnL > 0).mean() * 100)
+
+        # Trade pnl is net of fees and funding, so it adds up to the equity, liquidations included
+        for settings in ({}, dict(leverage=50, margin_mode='isolated'), dict(leverage=20, funding_rates=.0003)):
+            for kernel in (False, True):
+                leveraged = Backtest(BTCUSDT, TestKernel.OrderMixStrategy, maker_fee=.0002, taker_fee=.0004,
+                                     kernel=kernel, **settings).run()
+                trades = leveraged['_trades']
+                self.assertAlmostEqual(trades.PnL.sum(), leveraged['Equity Final [$]'] - 1_000_000, places=4)
+                self.assertGreater(trades.Fees.sum(), 0)
+        self.assertNotEqual(trades.Funding.sum(), 0)
+
+        # A short can lose more than its notional without the average trade turning NaN
+        df = pd.DataFrame({'Open': np.linspace(100, 300, 10)}, index=BTCUSDT.index[:10])
+        df['High'] = df['Low'] = df['Close'] = df.Open
+
+        class ShortStrategy(Strategy):
+            def init(self):
+                pass
+
+            def next(self):
+                if len(self.data) == 1:
+                    self.sell(size=1)
+
+        short = Backtest(df, ShortStrategy).run()
+        self.assertLess(short['_trades'].ReturnPct.iloc[0], -1)
+        self.assertEqual(short['Avg. Trade [%]'], -100)
+
+        close = BTCUSDT.Close.values
+        sma1, sma2 = SMA(close, SMAStrategy.fast).values, SMA(close, SMAStrategy.slow).values
+        entries, short_entries = np.zeros(len(close), bool), np.zeros(len(close), bool)
+        entries[1:] = (sma1[:-1] < sma2[:-1]) & (sma1[1:] > sma2[1:])
+        short_entries[1:] = (sma2[:-1] < sma1[:-1]) & (sma2[1:] > sma1[1:])
+        vectorized_stats = Backtest(BTCUSDT, SMAStrategy, taker_fee=.0004).run_vectorized(
+            entries, short_entries=short_entries)
+        for key in ('Return [%]', 'Sharpe Ratio', 'Max. Drawdown [%]', '# Trades', 'Profit Factor'):
+            self.assertAlmostEqual(stats[key], vectorized_stats[key], msg=key)
+
+        _, heatmap = Backtest(BTCUSDT, SMAStrategy).optimize(fast=[5, 10], slow=[30, 50], return_heatmap=True,
+                                                             max_workers=1)
+        self.assertEqual(heatmap.name, 'Equity Final [$]')
+        self.assertFalse(heatmap.isnull().any())
+
+
+class TestMargin(TestCase):
+
+    class HoldStrategy(Strategy):
+        side = 'buy'
+
+        def init(self):
+            self.engine = self.trading_engine
+
+        def next(self):
+            if len(self.data) == 1:
+                getattr(self, self.side)()
+
+    def run_hold(self, df=BTCUSDT, side='buy', **kwargs):
+        bt = Backtest(df, self.HoldStrategy, taker_fee=.0004, **kwargs)
+        engines = []
+
+        class Recording(self.HoldStrategy):
+            def init(self):
+                super().init()
+                engines.append(self.engine)
+
+        bt._strategy = Recording
+        return bt.run(side=side), engines[0]
+
+    def test_leverage(self):
+        df = BTCUSDT.iloc[:2000]
+        _, flat = self.run_hold(df)
+        _, levered = self.run_hold(df, leverage=3)
+        # Three times the exposure from the same cash
+        self.assertAlmostEqual(levered.trades['size'][0] / flat.trades['size'][0], 1.0004 / (1 / 3 + .0004), places=4)
+        with np.errstate(invalid='ignore'):
+            pnl = np.diff(np.asarray(levered.equitys)[1:]) / np.diff(np.asarray(flat.equitys)[1:])
+        np.testing.assert_allclose(pnl[np.isfinite(pnl)], levered.trades['size'][0] / flat.trades['size'][0])
+        with self.assertRaises(ValueError):
+            Backtest(df, SMAStrategy, leverage=3).run_vectorized(np.zeros(len(df), bool))
+
+        # Changing leverage moves margin between cash and the position, not equity
+        engine = levered
+        engine._buy_position.size, engine._buy_position.entry_price = 1., 100.
+        engine.cash = 1000.
+        engine.set_leverage(2)
+        self.assertAlmostEqual(engine.cash, 1000 + 100 / 3 - 100 / 2)
+        with self.assertRaises(ValueError):
+            engine.set_leverage(200)
+
+    def test_liquidation(self):
+        df = BTCUSDT.iloc[:3000]
+        low, high = df.Low.to_numpy(), df.High.to_numpy()
+        for side, margin_mode in (('buy', 'isolated'), ('sell', 'isolated'), ('buy', 'cross')):
+            stats, engine = self.run_hold(df, side=side, leverage=100, margin_mode=margin_mode, balance=10_000)
+            self.assertEqual(len(engine.liquidations), 1)
+            order = engine.liquidations[0]
+            trade = stats['_trades'].iloc[0]
+            self.assertEqual(trade.ExitBar, order.exec_time)
+            self.assertEqual(trade.ExitPrice, order.exec_price)
+            # First bar whose range reaches the liquidation price
+            reached = (low <= order.exec_price) if side == 'buy' else (high >= order.exec_price)
+            self.assertEqual(order.exec_time, np.argmax(reached[1:]) + 1)
+
+            # At the liquidation price margin plus pnl (plus free cash, with cross margin) is the
+            # maintenance margin, which is lost
+            size, entry = trade.Size, trade.EntryPrice
+            sign = 1 if side == 'buy' else -1
+            rate, amount = maintenance_tier(size * entry, engine.symbol_config.maintenance_tiers)
+            margin = size * entry / 100
+            free_cash = 10_000 - margin - size * entry * .0004
+            self.assertAlmostEqual((free_cash if margin_mode == 'cross' else 0) + margin +
+                                   sign * (order.exec_price - entry) * size,
+                                   rate * size * order.exec_price - amount, places=6)
+            self.assertAlmostEqual(engine.cash, free_cash if margin_mode == 'isolated' else 0, places=6)
+            self.assertEqual(engine.position[Side.Buy].size + engine.position[Side.Sell].size, 0)
+
+    def test_funding(self):
+        df = BTCUSDT.iloc[:3000]
+        rates = pd.Series([.0001, -.0002, .0003],
+                          index=pd.to_datetime(['2023-04-18', '2023-04-19', '2023-04-20']))
+        schedule = funding_schedule(df.index, rates)
+        times = pd.to_datetime(df.index, unit='ms')
+        funding_bars = np.flatnonzero(schedule)
+        self.assertTrue(len(funding_bars))
+        self.assertTrue(((times[funding_bars].hour % 8 == 0) & (times[funding_bars].minute == 0)).all())
+        np.testing.assert_array_equal(schedule[funding_bars],
+                                      rates.reindex(times[funding_bars], method='ffill').to_numpy())
+
+        _, unfunded = self.run_hold(df)
+        _, funded = self.run_hold(df, funding_rates=rates)
+        size = funded.trades['size'][0]
+        expected = (size * df.Open.to_numpy() * schedule)[1:].sum()
+        self.assertAlmostEqual(funded.funding_paid, expected, places=6)
+        self.assertAlmostEqual(unfunded.equitys[-1] - funded.equitys[-1], expected, places=6)
+
+        _, short = self.run_hold(df, side='sell', funding_rates=.0001)
+        self.assertLess(short.funding_paid, 0)
+
+
+class TestFills(TestCase):
+
+    class OrdersStrategy(Strategy):
+        # (bar, method, kwargs) of the orders to place
+        orders = ()
+
+        def init(self):
+            self.placed = []
+            self.engine = self.trading_engine
+
+        def next(self):
+            for bar, method, kwargs in self.orders:
+                if len(self.data) == bar:
+                    self.placed.append(getattr(self.position if method == 'close' else self, method)(**kwargs))
+
+    def run_orders(self, orders, df=BTCUSDT.iloc[:500], **kwargs):
+        strategies = []
+
+        class Recording(self.OrdersStrategy):
+            def init(self):
+                super().init()
+                strategies.append(self)
+
+        results = Backtest(df, Recording, maker_fee=.0002, taker_fee=.0004, **kwargs).run(orders=orders)
+        return results, strategies[0]
+
+    def test_slippage(self):
+        orders = ((1, 'buy', dict(size=.1)), (100, 'close', {}))
+        df = BTCUSDT.iloc[:500]
+        results, _ = self.run_orders(orders)
+        slipped, _ = self.run_orders(orders, fill_model=FillModel(slippage=1, slippage_pct=.0001))
+        trade, slipped_trade = results['_trades'].iloc[0], slipped['_trades'].iloc[0]
+        self.assertEqual(trade.EntryPrice, df.Open.iloc[1])
+        self.assertEqual(slipped_trade.EntryPrice, min(df.Open.iloc[1] * 1.0001 + 1, df.High.iloc[1]))
+        self.assertEqual(slipped_trade.ExitPrice, max(df.Open.iloc[100] * .9999 - 1, df.Low.iloc[100]))
+        self.assertLess(slipped['Equity Final [$]'], results['Equity Final [$]'])
+
+    def test_participation(self):
+        df = BTCUSDT.iloc[:500]
+        size = 25
+        results, strategy = self.run_orders(((1, 'buy', dict(size=size, tp=df.Close.iloc[0] * 1.01)),),
+                                            fill_model=FillModel(participation=.1))
+        trades = results['_trades'].sort_values('EntryBar')
+        # Filled over consecutive bars, at most a tenth of each bar's volume
+        self.assertGreater(len(trades), 1)
+        self.assertAlmostEqual(trades.Size.sum(), size)
+        np.testing.assert_array_equal(trades.EntryBar, np.arange(1, 1 + len(trades)))
+        self.assertTrue((trades.Size.to_numpy() <= .1 * df.Volume.iloc[trades.EntryBar].to_numpy() + 1e-9).all())
+        order = strategy.placed[0]
+        self.assertEqual(order.OrderStatus, OrderStatus.TakerFill)
+        # One take-profit order for everything filled
+        tp = [o for o in strategy.engine.order_book.orders if o.parent_order_id == order.order_id]
+        self.assertEqual(len(tp), 1)
+        self.assertAlmostEqual(tp[0].size, size)
+
+    def test_latency(self):
+        orders = ((1, 'buy', dict(size=.1)), (100, 'close', {}))
+        results, _ = self.run_orders(orders, fill_model=FillModel(latency=3))
+        trade = results['_trades'].iloc[0]
+        self.assertEqual((trade.EntryBar, trade.ExitBar), (4, 103))
+
+    def test_maker_taker(self):
+        df = BTCUSDT.iloc[:500]
+        close = df.Close.iloc[0]
+        orders = ((1, 'buy', dict(size=.1, price=close * .999)),  # Rests until hit
+                  (1, 'buy', dict(size=.1, price=close * 1.01)),  # Crosses on arrival
+                  (1, 'buy', dict(size=.1, price=close * 1.01, exec_type=ExecType.MakerFill)))
+        _, default = self.run_orders(orders)
+        _, modeled = self.run_orders(orders, fill_model=FillModel())
+        self.assertEqual([order.OrderStatus for order in default.placed], [OrderStatus.MakerFill] * 3)
+        self.assertEqual([order.OrderStatus for order in modeled.placed],
+                         [OrderStatus.MakerFill, OrderStatus.TakerFill, OrderStatus.Expired])
+        self.assertEqual(modeled.placed[1].exec_price, df.Open.iloc[1])
+        self.assertGreater(modeled.placed[0].exec_time, 1)
+
+    def test_kernel(self):
+        fill_model = FillModel(slippage_pct=.0001, participation=.05, latency=1)
+        results = [Backtest(BTCUSDT.iloc[:3000], TestKernel.OrderMixStrategy, maker_fee=.0002, taker_fee=.0004,
+                            kernel=kernel, fill_model=fill_model).run()
+                   for kernel in (False, True)]
+        self.assertGreater(results[0]['# Trades'], 10)
+        pd.testing.assert_frame_equal(results[1]['_trades'], results[0]['_trades'])
+
+
+class TestKernel(TestCase):
+
+    class OrderMixStrategy(Strategy):
+        def init(self):
+            self.orders = []
+
+        def next(self):
+            close, k = self.data.Close[-1], len(self.data)
+            if k % 7 == 0:
+                self.orders.append(self.buy(size=.05, price=close * .999, tp=close * 1.002, sl=close * .99))
+            if k % 11 == 0:
+                self.orders.append(self.sell(price=close * 1.001, tp=close * .998, sl=close * 1.01))
+            if k % 13 == 0:
+                self.orders.append(self.buy(size=.02, stop=close * 1.001))
+            if k % 50 == 0:
+                self.position.close()
+
+    def test_matches_reference(self):
+        margin = dict(leverage=5, margin_mode='isolated', funding_rates=.0001)
+        for strategy, kwargs in ((SMAStrategy, {}), (self.OrderMixStrategy, {}), (self.OrderMixStrategy, margin)):
+            engines = []
+
+            class RecordingStrategy(strategy):
+                def init(self):
+                    super().init()
+                    engines.append(self.trading_engine)
+
+            reference, kernel = (Backtest(BTCUSDT, RecordingStrategy, maker_fee=.0002, taker_fee=.0004,
+                                          kernel=use_kernel, **kwargs).run()
+                                 for use_kernel in (False, True))
+            self.assertGreater(reference['# Trades'], 10)
+            np.testing.assert_array_equal(kernel['_equity_curve'].Equity, reference['_equity_curve'].Equity)
+            pd.testing.assert_frame_equal(kernel['_trades'], reference['_trades'])
+            for column in ('entry_order_id', 'exit_order_id'):
+                np.testing.assert_array_equal(engines[1].trades[column], engines[0].trades[column])
+
+            orders = [[(order.order_id, order.OrderStatus, order.size, order.exec_time, order.exec_price)
+                       for order in engine.order_book.orders] for engine in engines]
+            self.assertEqual(orders[1], orders[0])
+            self.assertEqual(len(engines[1].order_book), len(engines[0].order_book))
+            self.assertEqual(engines[1].order_book._next_id, engines[0].order_book._next_id)
+
+    def test_without_numba(self):
+        # The plain Python loops, as run when numba isn't installed: fill_bar() with the order book's own
+        # matching, and with the scalar matching loop
+        settings = dict(maker_fee=.0002, taker_fee=.0004, leverage=5)
+        reference = Backtest(BTCUSDT, self.OrderMixStrategy, **settings).run()
+        self.assertGreater(reference['# Trades'], 10)
+        for match_bar in (None, _kernel._match_bar):
+            with mock.patch('CryptoBT.CryptoBT.fill_bar', _kernel._fill_bar), \
+                    mock.patch('CryptoBT.CryptoBT.match_bar', match_bar):
+                stats = Backtest(BTCUSDT, self.OrderMixStrategy, kernel=True, **settings).run()
+            pd.testing.assert_frame_equal(stats['_trades'], reference['_trades'])
+            np.testing.assert_array_equal(stats['_equity_curve'].Equity, reference['_equity_curve'].Equity)
+
+    def test_match_bar(self):
+        book = _OrderBook()
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            price, stop = rng.choice([np.nan, 1.], 2) * rng.uniform(90, 110, 2)
+            book.add(Order(side=rng.choice([Side.Buy, Side.Sell]), size=1., price=None if np.isnan(price) else price,
+                           stop=None if np.isnan(stop) else stop))
+        book.cancel(book.orders[0])
+        columns = book._book
+        for open_, high, low in rng.uniform(95, 105, (50, 3)):
+            high, low = max(open_, high, low), min(open_, high, low)
+            expected = book.match(open_, high, low)
+            matchers = [_kernel._match_bar] + ([_kernel.match_bar] if _kernel.match_bar is not None else [])
+            for match_bar in matchers:
+                rows, prices = match_bar(columns['side'], columns['price'], columns['stop'], columns['status'],
+                                         len(book.orders), open_, high, low)
+                np.testing.assert_array_equal(rows, expected[0])
+                np.testing.assert_array_equal(prices, expected[1])
+
+
+class TestLib(TestCase):
+
+    def test_streaming_indicators_match_batch(self):
+        df = BTCUSDT.iloc[:2000]
+        high, low, close, volume = df.High.values, df.Low.values, df.Close.values, df.Volume.values
+
+        def stream(indicator, *columns):
+            return np.array([indicator.update(*values) for values in zip(*columns)])
+
+        for batch, streamed in (
+                (lib.sma(close, 20), stream(lib.SMA(20), close)),
+                (lib.ema(close, 20), stream(lib.EMA(20), close)),
+                (lib.rolling_std(close, 20), stream(lib.RollingStd(20), close)),
+                (lib.rolling_min(close, 20), stream(lib.RollingMin(20), close)),
+                (lib.rolling_max(close, 20), stream(lib.RollingMax(20), close)),
+                (lib.bollinger(close, 20), stream(lib.Bollinger(20), close).T),
+                (lib.rsi(close, 14), stream(lib.RSI(14), close)),
+                (lib.atr(high, low, close, 14), stream(lib.ATR(14), high, low, close)),
+                (lib.vwap(high, low, close, volume, 30), stream(lib.VWAP(30), high, low, close, volume)),
+        ):
+            np.testing.assert_allclose(batch, streamed, rtol=1e-9)
+
+        np.testing.assert_allclose(lib.sma(close, 20), SMA(close, 20))
+
+    def test_batched_indicators(self):
+        close = np.r_[np.nan, np.nan, BTCUSDT.Close.values[:3000]]
+        ns = [1, 2, 3, 5, 16, 20, 33, 64, 200]
+        for batch, single in ((lib.sma_batch, lib.sma), (lib.ema_batch, lib.ema),
+                              (lib.rolling_min_batch, lib.rolling_min), (lib.rolling_max_batch, lib.rolling_max),
+                              (lib.batched(lib.rsi), lib.rsi)):
+            np.testing.assert_array_equal(batch(close, ns), np.vstack([single(close, n) for n in ns]))
+        np.testing.assert_allclose(lib.rolling_std_batch(close, ns), np.vstack([lib.rolling_std(close, n) for n in ns]),
+                                   rtol=1e-6, atol=1e-4)
+        self.assertEqual(lib.sma_batch(close[:10], [5, 20]).shape, (2, 10))
+
+    def test_indicators_in_strategy(self):
+        class BollingerStrategy(Strategy):
+            def init(self):
+                self.bands = self.I(lib.bollinger, self.data.Close, 20)
+                self.rsi = self.I(lib.rsi, self.data.Close)
+
+            def next(self):
+                lower, _, upper = self.bands[:, -1]
+                if self.rsi[-1] < 30 and self.data.Close[-1] < lower and not self.position:
+                    self.buy()
+                elif self.data.Close[-1] > upper and self.position:
+                    self.position.close()
+
+        stats = Backtest(BTCUSDT, BollingerStrategy).run()
+        self.assertGreater(stats['# Trades'], 0)
+
+
+class TestPortfolio(TestCase):
+
+    def test_single_symbol_matches_backtest(self):
+        class PortfolioSMAStrategy(PortfolioStrategy):
+            def init(self):
+                self.sma1 = self.I(SMA, self.data['BTC-USDT'].Close, SMAStrategy.fast)
+                self.sma2 = self.I(SMA, self.data['BTC-USDT'].Close, SMAStrategy.slow)
+
+            def next(self):
+                if crossover(self.sma1, self.sma2):
+                    self.positions['BTC-USDT'].close()
+                    self.buy('BTC-USDT')
+                elif crossover(self.sma2, self.sma1):
+                    self.positions['BTC-USDT'].close()
+                    self.sell('BTC-USDT')
+
+        stats = Backtest(BTCUSDT, SMAStrategy, taker_fee=.0004).run()
+        portfolio_stats = PortfolioBacktest({'BTC-USDT': BTCUSDT}, PortfolioSMAStrategy, taker_fee=.0004).run()
+        np.testing.assert_allclose(portfolio_stats['_equity_curve'].Equity, stats['_equity_curve'].Equity)
+        self.assertEqual(portfolio_stats['# Trades'], stats['# Trades'])
+
+    def test_shared_account(self):
+        eth = BTCUSDT.iloc[500:].drop(BTCUSDT.index[1000:1010])
+        eth[['Open', 'High', 'Low', 'Close']] /= 15
+        index, block = align({'BTC-USDT': BTCUSDT, 'ETH-USDT': eth})
+        self.assertEqual(block.shape, (2, 5, len(BTCUSDT)))
+        self.assertTrue(np.isnan(block[1, :, :500]).all())
+        # Missing bars repeat the previous close with no volume
+        np.testing.assert_array_equal(block[1, :4, 1000:1010], eth.Close.iloc[499])
+        np.testing.assert_array_equal(block[1, 4, 1000:1010], 0)
+        # Each symbol's frame is a view of its rows of the block
+        data = _PortfolioData(index, block, ['BTC-USDT', 'ETH-USDT'])
+        self.assertTrue(np.shares_memory(data['ETH-USDT'].df.values, block[1]))
+
+        class EqualWeightStrategy(PortfolioStrategy):
+            def init(self):
+                self.sma = {symbol: self.I(lib.sma, self.data[symbol].Close, 60) for symbol in self.data}
+
+            def next(self):
+                for symbol in self.data:
+                    close, position = self.data[symbol].Close[-1], self.positions[symbol]
+                    if close > self.sma[symbol][-1] and not position:
+                        self.buy(symbol, size=round(self.equity * .4 / close, 3))
+                    elif close < self.sma[symbol][-1] and position:
+                        position.close()
+
+        stats = PortfolioBacktest({'BTC-USDT': BTCUSDT, 'ETH-USDT': eth}, EqualWeightStrategy,
+                                  taker_fee=.0004).run()
+        trades = stats['_trades']
+        self.assertEqual(set(trades.Symbol), {'BTC-USDT', 'ETH-USDT'})
+        self.assertTrue((trades[trades.Symbol == 'ETH-USDT'].EntryBar >= 500 + 59).all())
+        self.assertEqual(stats['# Trades'], len(trades))
+
+    def test_margin(self):
+        class HoldStrategy(PortfolioStrategy):
+            sizes = {}
+
+            def init(self):
+                pass
+
+            def next(self):
+                if len(self.data) == 1:
+                    for symbol, size in self.sizes.items():
+                        self.buy(symbol, size=abs(size)) if size > 0 else self.sell(symbol, size=-size)
+
+        # A single symbol is liquidated as by `Backtest`
+        df = BTCUSDT.iloc[:3000]
+        settings = dict(leverage=100, balance=10_000)
+        for side, margin_mode in (('buy', 'isolated'), ('sell', 'isolated'), ('buy', 'cross')):
+            expected, _ = TestMargin().run_hold(df, side=side, margin_mode=margin_mode, **settings)
+            size = expected['_trades'].Size.iloc[0] * (1 if side == 'buy' else -1)
+            stats = PortfolioBacktest({'BTC-USDT': df}, HoldStrategy, margin_mode=margin_mode, taker_fee=.0004,
+                                      **settings).run(sizes={'BTC-USDT': size})
+            pd.testing.assert_frame_equal(stats['_trades'].drop(columns='Symbol'), expected['_trades'])
+            np.testing.assert_allclose(stats['_equity_curve'].Equity, expected['_equity_curve'].Equity)
+
+        # Long a symbol and its mirror image: either leg alone is liquidated, but with cross
+        # margin each one's pnl backs the other's
+        mirror = df.copy()
+        mirror[['Open', 'Close']] = 60_000 - df[['Open', 'Close']]
+        mirror['High'], mirror['Low'] = 60_000 - df.Low, 60_000 - df.High
+        sizes = {'BTC-USDT': 10, 'MIRROR': 10}
+        liquidated = {}
+        for margin_mode in ('isolated', 'cross'):
+            stats = PortfolioBacktest({'BTC-USDT': df, 'MIRROR': mirror}, HoldStrategy, margin_mode=margin_mode,
+                                      taker_fee=.0004, **settings).run(sizes=sizes)
+            liquidated[margin_mode] = np.sum(stats['_trades'].ExitBar < len(df) - 1)
+        self.assertEqual(liquidated, {'isolated': 2, 'cross': 0})
+
+    def test_set_leverage(self):
+        class LeverStrategy(Strategy):
+            def init(self):
+                pass
+
+            def next(self):
+                if len(self.data) == 2:
+                    self.buy(size=1)
+                elif len(self.data) == 10:
+                    self.trading_engine.set_leverage(5)
+
+        class PortfolioLeverStrategy(PortfolioStrategy):
+            def init(self):
+                pass
+
+            def next(self):
+                if len(self.data) == 2:
+                    self.buy('BTC-USDT', size=1)
+                elif len(self.data) == 10:
+                    self.trading_engines['BTC-USDT'].set_leverage(5)
+
+        # Moving margin between cash and the position leaves equity as it was
+        df = BTCUSDT.iloc[:100]
+        expected = Backtest(df, LeverStrategy, balance=1_000_000).run()
+        stats = PortfolioBacktest({'BTC-USDT': df}, PortfolioLeverStrategy, balance=1_000_000).run()
+        np.testing.assert_allclose(stats['_equity_curve'].Equity, expected['_equity_curve'].Equity)
+
+
+class TestTicks(TestCase):
+
+    @staticmethod
+    def agg_trades(df):
+        """Four trades per bar: open, then low and high in the bar's direction, then close."""
+        up = (df.Close >= df.Open).to_numpy()[:, None]
+        prices = np.where(up, df[['Open', 'Low', 'High', 'Close']], df[['Open', 'High', 'Low', 'Close']]).ravel()
+        timestamps = (df.index.to_numpy()[:, None] + np.arange(4) * 15000).ravel()
+        n = len(prices)
+        return pd.DataFrame({'agg_trade_id': np.arange(n), 'price': prices,
+                             'quantity': np.repeat(df.Volume.to_numpy() / 4, 4),
+                             'first_trade_id': np.arange(n), 'last_trade_id': np.arange(n),
+                             'transact_time': timestamps, 'is_buyer_maker': False}, columns=AGG_TRADES_COLUMNS)
+
+    def test_read_agg_trades(self):
+        trades = self.agg_trades(BTCUSDT.iloc[:1000])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, 'BTCUSDT-aggTrades.csv')
+            trades.to_csv(csv_path, index=False)
+            bin_path = agg_trades_to_bin(csv_path, os.path.join(tmpdir, 'BTCUSDT-aggTrades.bin'), chunksize=999)
+            for path in (csv_path, bin_path):
+                chunks = list(read_agg_trades(path, chunksize=1500))
+                self.assertEqual(max(len(chunk[0]) for chunk in chunks), 1500)
+                timestamps, prices, quantities = map(np.concatenate, zip(*chunks))
+                np.testing.assert_array_equal(timestamps, trades.transact_time)
+                np.testing.assert_array_equal(prices, trades.price)
+
+    def test_tick_replay(self):
+        # Market orders fill at the first trade of a bar, i.e. its open, as without ticks
+        trades = self.agg_trades(BTCUSDT.iloc[100:3000])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            csv_path = os.path.join(tmpdir, 'BTCUSDT-aggTrades.csv')
+            trades.to_csv(csv_path, index=False)
+            stats = Backtest(BTCUSDT, SMAStrategy).run(ticks=csv_path)
+        np.testing.assert_allclose(stats['_equity_curve'].Equity,
+                                   Backtest(BTCUSDT, SMAStrategy).run()['_equity_curve'].Equity)
+
+        # Within a bar that dipped before rallying, the stop loss is hit before the take profit
+        o, h, l, c = BTCUSDT[['Open', 'High', 'Low', 'Close']].to_numpy().T
+        bar = int(np.flatnonzero((c > o) & (h - o > 5) & (o - l > 5))[0])
+
+        class BracketStrategy(Strategy):
+            def init(self):
+                pass
+
+            def next(self):
+                if len(self.data) == bar:
+                    self.buy(size=1, tp=h[bar] - 1, sl=l[bar] + 1)
+
+        window = self.agg_trades(BTCUSDT.iloc[bar - 5:bar + 5])
+        chunks = [(window.transact_time.to_numpy(), window.price.to_numpy(), window.quantity.to_numpy())]
+        trade = Backtest(BTCUSDT, BracketStrategy).run(ticks=chunks)['_trades'].iloc[0]
+        self.assertEqual(trade.EntryPrice, o[bar])
+        self.assertEqual((trade.ExitBar, trade.ExitPrice), (bar, l[bar]))
+
+    def test_tick_replay_buffer(self):
+        # Trades before the bars replayed are dropped as they are pulled, not buffered
+        trades = self.agg_trades(BTCUSDT.iloc[:1000])
+        columns = (trades.transact_time.to_numpy(), trades.price.to_numpy(), trades.quantity.to_numpy())
+        buffered = []
+
+        def chunks():
+            for k in range(0, len(trades), 50):
+                buffered.append(len(replay._timestamps))
+                yield tuple(column[k:k + 50] for column in columns)
+
+        replay = TickReplay(chunks(), BTCUSDT.index[800:901])
+        for i in range(100):
+            prices, _ = replay(i)
+            np.testing.assert_array_equal(prices, trades.price.to_numpy()[(800 + i) * 4:(801 + i) * 4])
+        self.assertLessEqual(max(buffered), 50 + 4)
+
+
+SMA_PERIOD = 10
+
+
+def period_sma(arr):
+    return _period_sma(arr)
+
+
+def _period_sma(arr):
+    return lib.sma(arr, SMA_PERIOD)
+
+
+class TestIndicatorCache(TestCase):
+
+    def setUp(self):
+        self.previous = get_indicator_cache()
+
+    def tearDown(self):
+        set_indicator_cache(self.previous)
+
+    def test_reuse(self):
+        calls = []
+
+        def counted_sma(arr, n):
+            calls.append(n)
+            return lib.sma(arr, n)
+
+        class CachedStrategy(SMAStrategy):
+            def init(self):
+                self.sma1 = self.I(counted_sma, self.data.Close, self.fast)
+                self.sma2 = self.I(counted_sma, self.data.Close, self.slow)
+
+        cache = IndicatorCache()
+        set_indicator_cache(cache)
+        key = cache.key(lib.sma, (BTCUSDT.Close.values, 10), {})
+        self.assertEqual(key, cache.key(lib.sma, (BTCUSDT.Close.values.copy(), 10), {}))
+        self.assertNotEqual(key, cache.key(lib.sma, (BTCUSDT.Close.values, 11), {}))
+        self.assertNotEqual(key, cache.key(lib.ema, (BTCUSDT.Close.values, 10), {}))
+        self.assertNotEqual(key, cache.key(lib.sma, (BTCUSDT.Open.values, 10), {}))
+        self.assertIsNone(cache.key(counted_sma, (BTCUSDT.Close.values, 10), {}))
+        self.assertIsNone(cache.key(lib.sma, (object(), 10), {}))
+        # Large arrays are hashed whole, and Series with their index
+        large = np.arange(2**18, dtype=float)
+        changed = large.copy()
+        changed[[12345, 12347]] = changed[[12347, 12345]]  # Same sum, off any sampling stride
+        self.assertNotEqual(cache.key(lib.sma, (large, 10), {}), cache.key(lib.sma, (changed, 10), {}))
+        close = BTCUSDT.Close.iloc[:100]
+        shifted = pd.Series(close.values, index=close.index + 60_000)
+        self.assertNotEqual(cache.key(lib.sma, (close, 10), {}), cache.key(lib.sma, (shifted, 10), {}))
+
+        class LibSMAStrategy(SMAStrategy):
+            def init(self):
+                self.sma1 = self.I(lib.sma, self.data.Close, self.fast)
+                self.sma2 = self.I(lib.sma, self.data.Close, self.slow)
+
+        stats = Backtest(BTCUSDT, LibSMAStrategy).run()
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 2, 2))
+        self.assertEqual(Backtest(BTCUSDT, LibSMAStrategy).run()['Equity Final [$]'], stats['Equity Final [$]'])
+        Backtest(BTCUSDT, LibSMAStrategy).run(fast=30)
+        self.assertEqual((cache.hits, cache.misses), (4, 2))
+        # Closures may depend on more than their arguments, so they are always called
+        Backtest(BTCUSDT, CachedStrategy).run()
+        Backtest(BTCUSDT, CachedStrategy).run()
+        self.assertEqual(len(calls), 4)
+
+        # Least recently used arrays are evicted to stay within the byte budget
+        cache = IndicatorCache(max_bytes=BTCUSDT.Close.values.nbytes * 2)
+        set_indicator_cache(cache)
+        Backtest(BTCUSDT, LibSMAStrategy).run(fast=5)
+        Backtest(BTCUSDT, LibSMAStrategy).run(fast=6)
+        self.assertEqual(len(cache), 2)
+        self.assertLessEqual(cache.n_bytes, cache.max_bytes)
+
+    def test_batch(self):
+        cache = IndicatorCache()
+        set_indicator_cache(cache)
+
+        class BatchStrategy(SMAStrategy):
+            def init(self):
+                self.sma1 = self.I_batch(lib.sma_batch, self.data.Close, params=range(5, 51), select=self.fast)
+                self.sma2 = self.I_batch(lib.sma_batch, self.data.Close, params=range(5, 51), select=self.slow)
+
+        class LibSMAStrategy(SMAStrategy):
+            def init(self):
+                self.sma1 = self.I(lib.sma, self.data.Close, self.fast)
+                self.sma2 = self.I(lib.sma, self.data.Close, self.slow)
+
+        for fast, slow in ((10, 30), (7, 50)):
+            stats = Backtest(BTCUSDT, BatchStrategy).run(fast=fast, slow=slow)
+            self.assertEqual(stats['Equity Final [$]'],
+                             Backtest(BTCUSDT, LibSMAStrategy).run(fast=fast, slow=slow)['Equity Final [$]'])
+        # The block is computed once, and every other declaration reuses it
+        self.assertEqual(len([key for key in cache._entries if cache._entries[key].ndim == 2]), 1)
+
+        ribbons = []
+
+        class RibbonStrategy(SMAStrategy):
+            def init(self):
+                self.ribbon = self.I_batch(lib.sma_batch, self.data.Close, params=[10, 20, 30])
+                ribbons.append(self.ribbon)
+
+            def next(self):
+                if not self.position and (np.diff(self.ribbon[:, -1]) < 0).all():
+                    self.buy()
+                elif self.position and self.ribbon[0, -1] < self.ribbon[2, -1]:
+                    self.position.close()
+
+        self.assertGreater(Backtest(BTCUSDT, RibbonStrategy).run()['# Trades'], 0)
+        self.assertEqual((ribbons[0].shape, ribbons[0].name), ((3, len(BTCUSDT)), 'sma_batch(C,10..30)'))
+        with self.assertRaises(ValueError):
+            Backtest(BTCUSDT, BatchStrategy).run(fast=100)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            set_indicator_cache(IndicatorCache(path=tmpdir))
+            stats = Backtest(BTCUSDT, SMAStrategy).run()
+            self.assertEqual(len([f for f in os.listdir(tmpdir) if f.endswith('.npy')]), 2)
+
+            cache = IndicatorCache(path=tmpdir)
+            set_indicator_cache(cache)
+            self.assertEqual(Backtest(BTCUSDT, SMAStrategy).run()['Equity Final [$]'], stats['Equity Final [$]'])
+            self.assertEqual((cache.hits, cache.misses), (2, 0))
+
+    def test_globals(self):
+        global SMA_PERIOD
+        cache = IndicatorCache()
+        close = BTCUSDT.Close.values
+        key = cache.key(period_sma, (close,), {})
+        self.assertIsNotNone(key)
+        try:
+            # Globals read by the function or its helpers are part of the key
+            SMA_PERIOD = 50
+            self.assertNotEqual(cache.key(period_sma, (close,), {}), key)
+            SMA_PERIOD = object()
+            self.assertIsNone(cache.key(period_sma, (close,), {}))
+        finally:
+            SMA_PERIOD = 10
+        self.assertEqual(cache.key(period_sma, (close,), {}), key)
+
+        smas = []
+
+        class PeriodStrategy(SMAStrategy):
+            def init(self):
+                smas.append(self.I(period_sma, self.data.Close))
+                super().init()
+
+        set_indicator_cache(cache)
+        Backtest(BTCUSDT, PeriodStrategy).run()
+        try:
+            SMA_PERIOD = 50
+            Backtest(BTCUSDT, PeriodStrategy).run()
+        finally:
+            SMA_PERIOD = 10
+        np.testing.assert_array_equal(smas[1], lib.sma(close, 50))
+
+    def test_writable(self):
+        set_indicator_cache(IndicatorCache())
+        smas = []
+
+        class FilledStrategy(SMAStrategy):
+            def init(self):
+                super().init()
+                self.sma1[np.isnan(self.sma1)] = 0
+                smas.append(self.sma1)
+
+        # Computed and stored, then reused, the indicator can be edited in place either way
+        Backtest(BTCUSDT, FilledStrategy).run()
+        Backtest(BTCUSDT, FilledStrategy).run()
+        self.assertEqual(get_indicator_cache().hits, 2)
+        self.assertFalse(np.isnan(smas[1]).any())
+
+
+class TestLive(TestCase):
+
+    def test_matches_backtest(self):
+        df = BTCUSDT.iloc[:3000]
+        submitted = []
+
+        class RecordingBroker(Broker):
+            def submit(self, engine, orders):
+                submitted.extend(orders)
+
+        runner = LiveRunner(SMAStrategy, replay(df), history=200, broker=RecordingBroker(), taker_fee=.0004)
+        asyncio.run(runner.run())
+        stats = Backtest(df, SMAStrategy, taker_fee=.0004).run()
+
+        self.assertEqual(runner.n_bars, len(df))
+        self.assertLessEqual(len(runner.data), 400)
+        self.assertEqual(len(runner.latencies), 200)
+        np.testing.assert_allclose(runner.engine.equitys, stats['_equity_curve'].Equity.iloc[-200:])
+        live_trades = runner.engine.trades
+        np.testing.assert_array_equal(live_trades['entry_time'], stats['_trades'].EntryBar.iloc[:len(live_trades)])
+        self.assertEqual(len(submitted), runner.engine.order_book._next_id)
+        self.assertTrue(all(order.exec_time is not None for order in submitted[:-2]))
+
+    def test_warmup(self):
+        df = BTCUSDT.iloc[:600]
+        runner = LiveRunner(SMAStrategy, replay(df.iloc[500:]), warmup=df.iloc[:500], history=200)
+        asyncio.run(runner.run())
+        self.assertEqual(runner.n_bars, len(df))
+        self.assertEqual(runner.data.index[-1], df.index[-1])
+        # Trading starts with the live bars; their trades are timed in bars since the first warmup bar
+        self.assertTrue((runner.engine.trades['entry_time'] >= 500).all())
+        self.assertGreater(len(runner.engine.trades), 0)
+
+    def test_tail_csv(self):
+        rows = BTCUSDT.iloc[:20]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'BTC-USDT_1m.csv')
+            rows.iloc[:0].to_csv(path)
+
+            async def write():
+                for k in range(len(rows)):
+                    await asyncio.sleep(.002)
+                    rows.iloc[k:k + 1].to_csv(path, mode='a', header=False)
+
+            async def main():
+                runner = LiveRunner(SMAStrategy, tail_csv(path, poll_interval=.001), history=10)
+                writer = asyncio.create_task(write())
+                await asyncio.wait_for(runner.run(max_bars=len(rows)), 10)
+                await writer
+                return runner
+
+            runner = asyncio.run(main())
+        self.assertEqual(runner.n_bars, len(rows))
+        self.assertEqual(runner.data.index[-1], rows.index[-1])
+        np.testing.assert_array_equal(runner.data.Close, rows.Close.iloc[-len(runner.data):])
+
+    def test_indicator_inputs(self):
+        class DerivedInputStrategy(SMAStrategy):
+            def init(self):
+                self.sma1 = self.I(lib.sma, self.data.Close * 2, 10)
+
+        runner = LiveRunner(DerivedInputStrategy, replay(BTCUSDT.iloc[:5]))
+        with self.assertRaises(ValueError):
+            asyncio.run(runner.run())
+
+
+class TestStore(TestCase):
+
+    def test_from_csv(self):
+        csv_path = os.path.join(os.path.dirname(__file__), 'ohlcv_binance_BTC-USDT_1m_2023-04-18_2023-04-25.csv')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            OHLCVStore.from_csv(csv_path, os.path.join(tmpdir, 'BTC-USDT_1m'), chunksize=3000)
+            store = OHLCVStore(os.path.join(tmpdir, 'BTC-USDT_1m'))
+            self.assertEqual(len(store), len(BTCUSDT))
+            self.assertEqual(store.columns, ('Open', 'High', 'Low', 'Close', 'Volume'))
+
+            df = store.to_frame()
+            np.testing.assert_array_equal(df.index, BTCUSDT.index)
+            np.testing.assert_array_equal(df.Close, BTCUSDT.Close)
+            self.assertTrue(np.shares_memory(df.Close.values, store.column('Close')))
+
+            day = store.to_frame('2023-04-20', '2023-04-21')
+            self.assertEqual(len(day), 24 * 60)
+            self.assertEqual(day.index[0], 1681948800000)
+
+            with self.assertRaises(ValueError):
+                store._write(store.timestamps[:1].copy(), day.iloc[:1])
+
+            stats = Backtest(store.to_frame(), SMAStrategy).run()
+            self.assertEqual(stats['Equity Final [$]'], Backtest(BTCUSDT, SMAStrategy).run()['Equity Final [$]'])
+
+
+class TestStream(TestCase):
+
+    class BracketStrategy(Strategy):
+        def init(self):
+            self.sma = self.I(SMA, self.data.Close, 50)
+            self.lengths = []
+
+        def next(self):
+            self.lengths.append(len(self.data))
+            close = self.data.Close[-1]
+            if not self.position and crossover(self.data.Close, self.sma):
+                self.buy(size=.5, tp=close * 1.003, sl=close * .997)
+
+    def assert_same_results(self, stats, expected):
+        self.assertGreater(expected['# Trades'], 10)
+        pd.testing.assert_frame_equal(stats['_trades'], expected['_trades'])
+        np.testing.assert_allclose(stats['_equity_curve'].Equity, expected['_equity_curve'].Equity, rtol=1e-12)
+
+    def test_store(self):
+        strategies = []
+
+        class Recording(self.BracketStrategy):
+            def init(self):
+                super().init()
+                strategies.append(self)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = OHLCVStore.create(os.path.join(tmpdir, 'BTC-USDT_1m'))
+            store._write(BTCUSDT.index.to_numpy(), BTCUSDT)
+            bt = StreamBacktest(store, Recording, chunk=1000, lookback=1, taker_fee=.0004)
+            stats = bt.run()
+        self.assert_same_results(stats, Backtest(BTCUSDT, self.BracketStrategy, taker_fee=.0004).run())
+        # The SMA's warm-up plus the bar crossover() looks back at
+        self.assertEqual(bt.window, 50)
+        self.assertEqual(max(strategies[0].lengths), 1050)
+
+    def test_generator(self):
+        strategies = []
+
+        class Recording(SMAStrategy):
+            def init(self):
+                super().init()
+                strategies.append(self)
+
+        def frames():
+            for part in np.array_split(np.arange(len(BTCUSDT)), 13):
+                yield BTCUSDT.iloc[part].rename(columns=str.lower)
+
+        settings = dict(maker_fee=.0002, taker_fee=.0004, leverage=2, funding_rates=.0001,
+                        fill_model=FillModel(slippage_pct=.0001, latency=1))
+        bt = StreamBacktest(frames, Recording, lookback=1, **settings)
+        stats = bt.run()
+        self.assert_same_results(stats, Backtest(BTCUSDT, SMAStrategy, **settings).run())
+        # The strategy is set up once, and sees the kept bars and one chunk at a time
+        self.assertEqual(len(strategies), 1)
+        self.assertEqual(len(strategies[0].data), 30 + len(BTCUSDT) // 13)
+        # Runs again from the start
+        pd.testing.assert_frame_equal(bt.run()['_trades'], stats['_trades'])
+
+        with self.assertRaises(ValueError):
+            StreamBacktest([BTCUSDT.iloc[100:200], BTCUSDT.iloc[:100]], SMAStrategy).run()
+
+    def test_thinned_curve(self):
+        frames = [BTCUSDT.iloc[part] for part in np.array_split(np.arange(len(BTCUSDT)), 7)]
+        stats = StreamBacktest(frames, SMAStrategy, lookback=1, taker_fee=.0004, curve_every=100).run()
+        expected = Backtest(BTCUSDT, SMAStrategy, taker_fee=.0004).run()
+        pd.testing.assert_frame_equal(stats['_trades'], expected['_trades'])
+        # Statistics are still over every bar, only the stored curve is thinned
+        for key in expected.index.drop(['_equity_curve', '_trades']):
+            if isinstance(expected[key], float):
+                self.assertAlmostEqual(stats[key], expected[key], places=9, msg=key)
+            else:
+                self.assertEqual(stats[key], expected[key], msg=key)
+        curve = expected['_equity_curve'].iloc[np.append(np.arange(0, len(BTCUSDT), 100), len(BTCUSDT) - 1)]
+        pd.testing.assert_frame_equal(stats['_equity_curve'], curve, rtol=1e-12)
+
+
+class TestIngest(TestCase):
+
+    @staticmethod
+    def write_exports(tmpdir, ranges):
+        paths = []
+        for i, j in ranges:
+            days = BTCUSDT.Date.iloc[[i, j - 1]].str[:10].tolist()
+            path = os.path.join(tmpdir, f'ohlcv_binance_BTC-USDT_1m_{days[0]}_{days[1]}.csv')
+            BTCUSDT.iloc[i:j].to_csv(path)
+            paths.append(path)
+        return paths
+
+    def test_merge(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = self.write_exports(tmpdir, [(0, 4000), (3000, 7000), (6000, len(BTCUSDT))])
+            self.assertEqual(parse_export_name(paths[0])['symbol'], 'BTC-USDT')
+            df = merge(paths[::-1])
+            np.testing.assert_array_equal(df.index, BTCUSDT.index)
+            np.testing.assert_array_equal(df.Close, BTCUSDT.Close)
+            self.assertEqual(list(df.columns), ['Open', 'High', 'Low', 'Close', 'Volume'])
+
+        revised = BTCUSDT.iloc[10:20].copy()
+        revised['Close'] += 1
+        df = merge([BTCUSDT.iloc[:30], revised])
+        self.assertEqual(len(df), 30)
+        np.testing.assert_array_equal(df.Close.iloc[10:20], revised.Close)
+
+        timestamps = np.delete(BTCUSDT.index.to_numpy(), np.r_[100:105, 200])
+        gaps = find_gaps(timestamps, '1m')
+        self.assertEqual(gaps.Bars.tolist(), [5, 1])
+        self.assertEqual(gaps.Start.tolist(), BTCUSDT.index[[100, 200]].tolist())
+        self.assertEqual(gaps.End.tolist(), BTCUSDT.index[[104, 200]].tolist())
+
+    def test_ingest(self):
+        n = len(BTCUSDT)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = self.write_exports(tmpdir, [(0, 3000), (5000, 7000), (2500, 4000), (6500, n), (3900, 5100)])
+            catalog = Catalog(os.path.join(tmpdir, 'catalog'), chunk='D')
+
+            report, = catalog.ingest_exports(paths[:2])
+            self.assertEqual(report.added, 5000)
+            self.assertEqual(report.gaps.Bars.tolist(), [2000])
+
+            # Overlapping exports only append past the end of each chunk
+            report = catalog.ingest(paths[2:4])
+            self.assertEqual((report.added, report.duplicates), (n - 6000, 1000))
+            self.assertFalse(report.rewritten)
+            self.assertEqual(report.gaps.Bars.tolist(), [1000])
+
+            # Filling the gap rewrites only the chunk it's in
+            report = catalog.ingest(paths[4])
+            self.assertEqual((report.added, report.duplicates), (1000, 200))
+            self.assertEqual((report.appended, report.rewritten), (['2023-04-21'], ['2023-04-22']))
+            self.assertTrue(report.gaps.empty)
+            self.assertEqual(Catalog(catalog.root).chunk, 'D')
+
+            df = catalog.load('BTC-USDT', '1m')
+            np.testing.assert_array_equal(df.index, BTCUSDT.index)
+            np.testing.assert_array_equal(df.Close, BTCUSDT.Close)
+            self.assertEqual(catalog.span('BTC-USDT', '1m'), (BTCUSDT.index[0], BTCUSDT.index[-1]))
+
+            # A range is loaded from the chunks covering it alone
+            path = catalog.path('BTC-USDT', '1m')
+            for name in catalog.chunks('BTC-USDT', '1m'):
+                if name not in ('2023-04-20', '2023-04-21'):
+                    os.remove(os.path.join(path, name, 'Close.bin'))
+            df = catalog.load('BTC-USDT', '1m', '2023-04-20 12:00', '2023-04-21 12:00')
+            self.assertEqual(len(df), 24 * 60)
+            np.testing.assert_array_equal(df.Close, BTCUSDT.Close.loc[df.index])
+
+    def test_update(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.write_exports(tmpdir, [(0, len(BTCUSDT))])
+            exchange = FileExchange(tmpdir, limit=1000)
+            catalog = Catalog(os.path.join(tmpdir, 'catalog'))
+            catalog.ingest(BTCUSDT.iloc[np.r_[2000:3000, 6000:6500]], 'BTC-USDT', '1m', 'binance')
+
+            report = catalog.update(exchange, 'BTC-USDT', '1m', start=BTCUSDT.index[0])
+            self.assertEqual(report.added, len(BTCUSDT) - 1500)
+            self.assertTrue(report.gaps.empty)
+            np.testing.assert_array_equal(catalog.load('BTC-USDT', '1m').Close, BTCUSDT.Close)
+
+            exchange.requests = 0
+            report = catalog.update(exchange, 'BTC-USDT', '1m', start=BTCUSDT.index[0])
+            self.assertEqual((report.added, exchange.requests), (0, 1))
+
+
+class TestRobustness(TestCase):
+
+    def test_monte_carlo(self):
+        bt = Backtest(BTCUSDT, SMAStrategy, taker_fee=.0004)
+        stats = bt.run()
+        mc = MonteCarlo.from_backtest(bt, random_state=0)
+        final_return = (np.prod(1 + mc.trade_returns) - 1) * 100
+        self.assertAlmostEqual(final_return, stats['Return [%]'], delta=.1)
+
+        # Reordering trades changes the drawdowns but not where the path ends
+        shuffled = mc.shuffle_trades(500)
+        self.assertEqual(len(shuffled), 500)
+        np.testing.assert_allclose(shuffled['Return [%]'], final_return)
+        self.assertGreater(shuffled['Max. Drawdown [%]'].std(), 0)
+        self.assertTrue(shuffled.equals(MonteCarlo.from_backtest(bt, random_state=0).shuffle_trades(500)))
+
+        # Batches of paths draw from their own seeds, whether serially or in processes
+        chunked = MonteCarlo.from_backtest(bt, random_state=0, max_bytes=2**20)
+        bootstrapped = chunked.bootstrap_returns(300)
+        chunked.max_workers = 2
+        self.assertTrue(bootstrapped.equals(chunked.bootstrap_returns(300)))
+        intervals = confidence_intervals(bootstrapped, .9)
+        self.assertEqual(list(intervals.columns), ['Lower', 'Median', 'Upper'])
+        self.assertLess(intervals.loc['Sharpe Ratio', 'Lower'], stats['Sharpe Ratio'])
+        self.assertGreater(intervals.loc['Sharpe Ratio', 'Upper'], stats['Sharpe Ratio'])
+        # A single block of every bar is just the curve rotated
+        rotated = mc.bootstrap_returns(10, block=len(BTCUSDT))
+        np.testing.assert_allclose(rotated['Return [%]'], stats['Return [%]'])
+
+        gross = mc.randomize_costs(5, fee=(0, 0), slippage=(0, 0))['Return [%]']
+        self.assertGreater(gross.iloc[0], stats['Return [%]'])
+        costs = mc.randomize_costs(200)
+        self.assertTrue((costs['Return [%]'] < gross.iloc[0]).all())
+
+
+class TestResults(TestCase):
+
+    def test_store(self):
+        inits = []
+
+        class CountingStrategy(SMAStrategy):
+            def init(self):
+                inits.append(dict(self.params))
+                super().init()
+
+        df = BTCUSDT.iloc[:3000]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = ResultsStore(os.path.join(tmpdir, 'results.db'))
+            bt = Backtest(df, CountingStrategy, taker_fee=.0004)
+            results = store.run(bt, fast=5)
+            stored = store.run(bt, fast=5)
+            self.assertEqual(len(inits), 1)
+            self.assertEqual(stored['Sharpe Ratio'], results['Sharpe Ratio'])
+            pd.testing.assert_frame_equal(stored['_trades'], results['_trades'])
+            pd.testing.assert_frame_equal(stored['_equity_curve'], results['_equity_curve'])
+            # Other settings make another run
+            store.run(Backtest(df, CountingStrategy, taker_fee=.0002), fast=5)
+            self.assertEqual((len(inits), len(store)), (2, 2))
+
+            # Only runs not stored yet are run, and the stored ones scored the same
+            grid = dict(fast=[5, 8, 10], slow=[20, 30])
+            inits.clear()
+            _, heatmap = bt.optimize(**grid, maximize='Sharpe Ratio', return_heatmap=True, max_workers=1,
+                                     results_store=store)
+            self.assertEqual(len(inits), 6 + 1)  # And the best run again
+            inits.clear()
+            _, stored_heatmap = bt.optimize(**grid, maximize='Sharpe Ratio', return_heatmap=True, max_workers=1,
+                                            results_store=store)
+            self.assertEqual(len(inits), 1)
+            pd.testing.assert_series_equal(stored_heatmap, heatmap)
+            self.assertEqual(len(store), 8)
+
+            top = store.query('max_drawdown_pct > ? AND n_trades > 0', (-5,), order_by='sharpe_ratio', limit=3)
+            runs = store.query()
+            expected = runs[(runs.max_drawdown_pct > -5) & (runs.n_trades > 0)].sort_values('sharpe_ratio',
+                                                                                           ascending=False)
+            self.assertEqual(top.index.tolist(), expected.index[:3].tolist())
+            self.assertEqual(set(top.params.iloc[0]) - {'fast', 'slow'}, set())
+            with self.assertRaises(ValueError):
+                store.query(order_by='sharpe_ratio; DROP TABLE runs')
+            store.close()
+
 
 if __name__ == '__main__':
     warnings.filterwarnings('error')
-    unittest.main()
\ No newline at end of file
+    unittest.main()
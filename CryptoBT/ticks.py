@@ -0,0 +1,129 @@
+"""
+Intrabar trade replay.
+
+Binance aggTrades exports (CSV, or the fixed-width binary written by
+`agg_trades_to_bin()`) are streamed in chunks of `(timestamps, prices,
+quantities)` arrays. `TickReplay` hands the engine the trades of one bar
+at a time, so resting orders are matched trade by trade, in the order
+the market actually traded, while memory stays at about one chunk.
+"""
+import os
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .store import _index_to_ms
+
+AGG_TRADES_COLUMNS = ('agg_trade_id', 'price', 'quantity', 'first_trade_id', 'last_trade_id',
+                      'transact_time', 'is_buyer_maker')
+
+AGG_TRADE_DTYPE = np.dtype([('Timestamp', '<i8'), ('Price', '<f8'), ('Quantity', '<f8')])
+
+TradeChunk = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def _has_header(csv_path: str) -> bool:
+    # Older Binance dumps have no header row, newer ones do
+    first = pd.read_csv(csv_path, nrows=1, header=None).iloc[0, 0]
+    try:
+        float(first)
+        return False
+    except ValueError:
+        return True
+
+
+def _read_agg_trades_csv(csv_path: str, chunksize: int) -> Iterator[TradeChunk]:
+    header = 0 if _has_header(csv_path) else None
+    for chunk in pd.read_csv(csv_path, header=header, usecols=[1, 2, 5], chunksize=chunksize):
+        timestamps = chunk.iloc[:, 2].to_numpy(dtype=np.int64)
+        if len(timestamps) and timestamps[0] > 10**14:
+            timestamps = timestamps // 1000  # Spot dumps since 2025 are in microseconds
+        yield timestamps, chunk.iloc[:, 0].to_numpy(dtype=float), chunk.iloc[:, 1].to_numpy(dtype=float)
+
+
+def _read_agg_trades_bin(path: str, chunksize: int) -> Iterator[TradeChunk]:
+    if not os.path.getsize(path):
+        return
+    records = np.memmap(path, dtype=AGG_TRADE_DTYPE, mode='r')
+    for i in range(0, len(records), chunksize):
+        chunk = records[i:i + chunksize]
+        yield chunk['Timestamp'], chunk['Price'], chunk['Quantity']
+
+
+def read_agg_trades(path: str, chunksize: int = 1_000_000) -> Iterator[TradeChunk]:
+    """
+    Stream an aggTrades file as `(timestamps, prices, quantities)` chunks
+    of at most `chunksize` trades. `.bin` files are memory mapped, any
+    other (e.g. `.csv` or `.zip`) is parsed as a Binance CSV export.
+    """
+    if path.endswith('.bin'):
+        return _read_agg_trades_bin(path, chunksize)
+    return _read_agg_trades_csv(path, chunksize)
+
+
+def agg_trades_to_bin(csv_path: str, path: str, chunksize: int = 1_000_000) -> str:
+    """Convert an aggTrades CSV export once into the binary format read by `read_agg_trades()`."""
+    with open(path, 'wb') as f:
+        for timestamps, prices, quantities in _read_agg_trades_csv(csv_path, chunksize):
+            records = np.empty(len(timestamps), dtype=AGG_TRADE_DTYPE)
+            records['Timestamp'], records['Price'], records['Quantity'] = timestamps, prices, quantities
+            records.tofile(f)
+    return path
+
+
+class TickReplay:
+    """
+    Splits a time-ordered stream of trade chunks into bars. Call with
+    increasing bar numbers; bars outside the time span of the stream
+    give `None`, bars inside it the (possibly empty) `(prices, quantities)`
+    traded in `[bar start, next bar start)`.
+    """
+    def __init__(self, chunks: Union[str, Iterable[TradeChunk]], bar_index: pd.Index,
+                 chunksize: int = 1_000_000):
+        if isinstance(chunks, str):
+            chunks = read_agg_trades(chunks, chunksize)
+        self._chunks = iter(chunks)
+        bounds = _index_to_ms(bar_index)
+        self._bounds = np.append(bounds, np.iinfo(np.int64).max)
+        self._timestamps = np.empty(0, dtype=np.int64)
+        self._prices = self._quantities = np.empty(0)
+        self._exhausted = False
+        self._started = False
+
+    def _pull(self, start: int) -> bool:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._exhausted = True
+            return False
+        timestamps, prices, quantities = (np.asarray(column) for column in chunk)
+        timestamps = np.concatenate([self._timestamps, timestamps])
+        # Trades before the bar being split out are never handed out, so they are dropped
+        # rather than carried over, and memory stays about one chunk plus that bar's trades
+        drop = np.searchsorted(timestamps, start, side='left')
+        if drop:
+            self._started = True
+        self._timestamps = timestamps[drop:]
+        self._prices = np.concatenate([self._prices, prices])[drop:]
+        self._quantities = np.concatenate([self._quantities, quantities])[drop:]
+        return True
+
+    def __call__(self, i: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        start, end = self._bounds[i], self._bounds[i + 1]
+        # Buffer trades up to the first one past this bar
+        while (not len(self._timestamps) or self._timestamps[-1] < end) and not self._exhausted:
+            self._pull(start)
+
+        timestamps = self._timestamps
+        lo = np.searchsorted(timestamps, start, side='left')
+        hi = np.searchsorted(timestamps, end, side='left')
+        if hi > 0:
+            self._started = True
+        elif not self._started:
+            return None  # Bar is before the first trade
+        if self._exhausted and hi == len(timestamps) and lo == hi:
+            return None  # Bar is after the last trade
+        prices, quantities = self._prices[lo:hi], self._quantities[lo:hi]
+        self._timestamps, self._prices, self._quantities = (timestamps[hi:], self._prices[hi:],
+                                                            self._quantities[hi:])
+        return prices, quantities
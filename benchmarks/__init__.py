@@ -0,0 +1,5 @@
+"""
+Benchmarks of the backtest hot paths.
+
+Run `python -m benchmarks --help` from the repository root.
+"""
@@ -0,0 +1,88 @@
+"""
+Run the benchmarks and optionally compare them against a saved baseline:
+
+    python -m benchmarks --sizes fixture,1m --output results.json
+    python -m benchmarks --baseline results.json --threshold .1
+
+Each case runs in a fresh process, so its peak RSS is its own. The exit
+status is 1 if any case got slower than the baseline by more than
+`--threshold`.
+"""
+import argparse
+import json
+import platform
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import numpy
+import pandas
+
+from .cases import CASES
+from .data import SIZES
+from .runner import _git_commit, compare, measure
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default=','.join(CASES), help='comma separated cases (default: all)')
+    parser.add_argument('--sizes', default='fixture', help=f'comma separated data sizes of {list(SIZES)}')
+    parser.add_argument('--repeat', type=int, default=None,
+                        help='timed runs per case, best is kept (default: 3 on the fixture, else 1)')
+    parser.add_argument('--no-allocations', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare against')
+    parser.add_argument('--threshold', type=float, default=.1,
+                        help='relative throughput drop counted as a regression (default: .1)')
+    args = parser.parse_args(argv)
+
+    cases, sizes = args.cases.split(','), args.sizes.split(',')
+    for name in cases:
+        if name not in CASES:
+            parser.error(f'unknown case {name!r}, expected some of {list(CASES)}')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error(f'unknown size {size!r}, expected some of {list(SIZES)}')
+
+    results = {}
+    for size in sizes:
+        repeat = args.repeat or (3 if SIZES[size] is None else 1)
+        for name in cases:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+                result = executor.submit(measure, name, size, repeat, not args.no_allocations).result()
+            key = f'{name}[{size}]'
+            results[key] = result
+            alloc = f"{result['alloc_peak_mb']:9.1f} MB alloc" if 'alloc_peak_mb' in result else ''
+            rss = f"{result['peak_rss_mb']:9.1f} MB RSS" if result['peak_rss_mb'] is not None else ''
+            print(f"{key:32} {result['throughput']:14,.0f} {result['unit']:9} {rss} {alloc}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                    'commit': _git_commit(),
+                    'python': platform.python_version(),
+                    'numpy': numpy.__version__,
+                    'pandas': pandas.__version__,
+                    'machine': platform.platform(),
+                },
+                'results': results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        ratios = compare(results, baseline)
+        regressions = [key for key, ratio in ratios.items() if ratio < 1 - args.threshold]
+        print()
+        for key, ratio in ratios.items():
+            print(f"{key:32} {ratio:6.2f}x baseline{'  REGRESSION' if key in regressions else ''}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
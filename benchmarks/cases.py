@@ -0,0 +1,161 @@
+"""
+Benchmark cases. Each takes the OHLCV frame and returns the callable to
+time, the number of units one call processes and the unit's name.
+"""
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from CryptoBT import Backtest, Strategy, lib
+from CryptoBT.CryptoBT import _TradingEngine
+from CryptoBT._util import _Data, _Indicator
+from CryptoBT.idl import Side
+
+Case = Callable[[pd.DataFrame], Tuple[Callable[[], object], int, str]]
+
+# Per-bar engine loops are capped so that the 10M sizes finish in minutes
+MAX_ENGINE_BARS = 200_000
+N_CALLS = 100_000
+
+
+class SmaCross(Strategy):
+    fast = 10
+    slow = 30
+
+    def init(self):
+        self.sma1 = self.I(lib.sma, self.data.Close, self.fast)
+        self.sma2 = self.I(lib.sma, self.data.Close, self.slow)
+
+    def next(self):
+        if lib.crossover(self.sma1, self.sma2):
+            self.position.close()
+            self.buy()
+        elif lib.crossover(self.sma2, self.sma1):
+            self.position.close()
+            self.sell()
+
+
+class Grid(Strategy):
+    """Resting limit orders with tp/sl children, stops and closes; heavy on fills."""
+    def init(self):
+        pass
+
+    def next(self):
+        close, k = self.data.Close[-1], len(self.data)
+        if k % 7 == 0:
+            self.buy(size=.05, price=close * .999, tp=close * 1.002, sl=close * .99)
+        if k % 11 == 0:
+            self.sell(size=.05, price=close * 1.001, tp=close * .998, sl=close * 1.01)
+        if k % 13 == 0:
+            self.buy(size=.02, stop=close * 1.001)
+        if k % 50 == 0:
+            self.position.close()
+
+
+class Idle(Strategy):
+    def init(self):
+        pass
+
+    def next(self):
+        pass
+
+
+def _engine(df: pd.DataFrame) -> Tuple[_TradingEngine, _Data]:
+    data = _Data(df.copy(deep=False))
+    return _TradingEngine(data, 1_000_000, 0, .0004, False, False), data
+
+
+def run(df):
+    bt = Backtest(df, SmaCross, taker_fee=.0004)
+    return bt.run, len(df), 'bars/s'
+
+
+def run_idle(df):
+    bt = Backtest(df, Idle)
+    return bt.run, len(df), 'bars/s'
+
+
+def run_grid(df):
+    bt = Backtest(df.iloc[:MAX_ENGINE_BARS], Grid, maker_fee=.0002, taker_fee=.0004)
+    return bt.run, min(len(df), MAX_ENGINE_BARS), 'bars/s'
+
+
+def run_grid_kernel(df):
+    bt = Backtest(df.iloc[:MAX_ENGINE_BARS], Grid, maker_fee=.0002, taker_fee=.0004, kernel=True)
+    bt.run()  # Compile (or load the cached compilation) outside of the timing
+    return bt.run, min(len(df), MAX_ENGINE_BARS), 'bars/s'
+
+
+def run_vectorized(df):
+    close = df.Close.to_numpy()
+    sma1, sma2 = lib.sma(close, 10), lib.sma(close, 30)
+    entries = np.zeros(len(close), bool)
+    short_entries = np.zeros(len(close), bool)
+    entries[1:] = (sma1[:-1] < sma2[:-1]) & (sma1[1:] > sma2[1:])
+    short_entries[1:] = (sma2[:-1] < sma1[:-1]) & (sma2[1:] > sma1[1:])
+    bt = Backtest(df, SmaCross, taker_fee=.0004)
+    return lambda: bt.run_vectorized(entries, short_entries=short_entries), len(df), 'bars/s'
+
+
+def new_order(df):
+    def place():
+        engine, data = _engine(df.iloc[:100])
+        for _ in range(N_CALLS):
+            engine.new_order(side=Side.Buy, size=.01, price=1.)
+
+    return place, N_CALLS, 'orders/s'
+
+
+def handle_execution(df):
+    df = df.iloc[:MAX_ENGINE_BARS]
+
+    def loop():
+        # One market order per bar, alternately opening and closing a position
+        engine, data = _engine(df)
+        for i in range(len(df)):
+            data._set_length(i + 1)
+            engine.handle_execution()
+            if i % 2:
+                engine.close_position()
+            else:
+                engine.new_order(side=Side.Buy, size=.01)
+
+    return loop, len(df), 'orders/s'
+
+
+def strategy_I(df):
+    engine, data = _engine(df)
+    strategy = Idle(engine, data, {})
+    close = data.Close
+
+    def indicator():
+        strategy._indicators.clear()  # Don't keep every repeat's array alive
+        strategy.I(lib.sma, close, 20)
+
+    return indicator, len(df), 'bars/s'
+
+
+def crossover(df):
+    close = df.Close.to_numpy()
+    sma1 = _Indicator(lib.sma(close, 10), name='sma1')
+    sma2 = _Indicator(lib.sma(close, 30), name='sma2')
+
+    def calls():
+        for _ in range(N_CALLS):
+            lib.crossover(sma1, sma2)
+
+    return calls, N_CALLS, 'calls/s'
+
+
+CASES: Dict[str, Case] = {
+    'run': run,
+    'run_idle': run_idle,
+    'run_grid': run_grid,
+    'run_grid_kernel': run_grid_kernel,
+    'run_vectorized': run_vectorized,
+    'new_order': new_order,
+    'handle_execution': handle_execution,
+    'Strategy.I': strategy_I,
+    'crossover': crossover,
+}
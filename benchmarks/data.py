@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+SIZES = {
+    'fixture': None,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+
+def synthetic_ohlcv(n: int, seed: int = 0, start: int = 1577836800000) -> pd.DataFrame:
+    """
+    `n` one-minute bars of a geometric random walk starting at 30000,
+    indexed by millisecond `Timestamp` like a Binance export.
+    """
+    rng = np.random.default_rng(seed)
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 5e-4, n)))
+    open_ = np.empty(n)
+    open_[0] = close[0]
+    open_[1:] = close[:-1]
+    spread = np.abs(rng.normal(0, 3e-4, n)) * close
+    return pd.DataFrame({
+        'Open': open_,
+        'High': np.maximum(open_, close) + spread,
+        'Low': np.minimum(open_, close) - spread,
+        'Close': close,
+        'Volume': rng.gamma(2, 10, n),
+    }, index=pd.Index(start + 60000 * np.arange(n, dtype=np.int64), name='Timestamp'))
+
+
+def load(size: str) -> pd.DataFrame:
+    """OHLCV bars of a named size: the bundled BTC-USDT fixture or a synthetic walk."""
+    if size not in SIZES:
+        raise ValueError(f'Unknown size {size!r}, expected one of {list(SIZES)}')
+    if SIZES[size] is None:
+        from CryptoBT.test import BTCUSDT
+        return BTCUSDT
+    return synthetic_ohlcv(SIZES[size])
@@ -0,0 +1,56 @@
+"""Timing, memory and baseline comparison of single benchmark cases."""
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, Optional
+
+from .cases import CASES
+from .data import load
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def measure(case: str, size: str, repeat: int, allocations: bool) -> Dict:
+    df = load(size)
+    func, count, unit = CASES[case](df)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    seconds = min(times)
+    result = {'unit': unit, 'count': count, 'seconds': seconds, 'throughput': count / seconds}
+    if allocations:
+        tracemalloc.start()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        result['alloc_peak_mb'] = peak / 2**20
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict, baseline: Dict) -> Dict[str, float]:
+    """Throughput ratio to the baseline of every case in both, keyed like `results`."""
+    return {key: result['throughput'] / baseline[key]['throughput']
+            for key, result in results.items() if key in baseline}